@@ -1,5 +1,6 @@
 import os
 import sys
+import multiprocessing
 
 import wx
 import ctypes
@@ -18,4 +19,6 @@ def main():
 
 
 if __name__ == '__main__':
+    # needed by the ingest worker processes when running from a frozen executable
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,107 @@
+# Rows per second written to a new database file by the pandas to_sql path the
+# saves used before, by insert_frame with the default journal settings and by
+# insert_frame inside bulk_load, then by a full write_tables inside bulk_load.
+#
+#     python benchmarks/bulk_write.py [records]
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from components.database import (DATABASE_SCHEMA_VERSION, build_tables, bulk_load, create_schema, drop_schema,
+                                 insert_frame, sql_type, write_tables)
+
+
+PROFILE = {'identifier_col': 'HN', 'date_col': 'DATE', 'organism_col': 'ORGANISM', 'specimens_col': 'SPECIMEN'}
+DRUGS = ['AMK', 'AMP', 'CAZ', 'CIP', 'CRO', 'CTX', 'FEP', 'GEN', 'IPM', 'MEM', 'SXT', 'TZP']
+
+
+def generate(records, seed=0):
+    rng = np.random.default_rng(seed)
+    organisms = ['org{}'.format(i) for i in range(60)]
+    frame = pd.DataFrame({
+        'HN': rng.integers(0, records // 4 + 1, records),
+        'DATE': pd.Timestamp('2019-01-01') + pd.to_timedelta(rng.integers(0, 730, records), unit='D'),
+        'ORGANISM': rng.choice(organisms, records),
+        'SPECIMEN': rng.choice(['blood', 'urine', 'sputum', 'pus', 'csf'], records),
+        'WARD': rng.choice(['ward{}'.format(i) for i in range(40)], records),
+    })
+    for drug in DRUGS:
+        frame[drug] = rng.choice(np.array(['S', 'I', 'R', None], dtype=object), records, p=[0.5, 0.1, 0.2, 0.2])
+    organism_lookup = pd.DataFrame({'ORGANISM': organisms, 'GENUS': ['Genus{}'.format(i // 3) for i in range(60)],
+                                    'SPECIES': ['species{}'.format(i) for i in range(60)], 'GRAM': 'negative'})
+    drug_lookup = pd.DataFrame({'drug': DRUGS, 'group': ['group{}'.format(i % 5) for i in range(len(DRUGS))]})
+    return build_tables(frame, DRUGS, organism_lookup, drug_lookup, PROFILE)
+
+
+def schema(con, tables):
+    drop_schema(con)
+    create_schema(con, [(col, sql_type(tables['isolates'][col])) for col in tables['isolates'].columns
+                        if col not in ('record_id', 'organism_id', 'added_at', 'fingerprint')])
+
+
+def with_to_sql(con, tables, metadata):
+    schema(con, tables)
+    for name, frame in tables.items():
+        frame.to_sql(name, con, if_exists='append', index=False)
+    metadata.to_sql('metadata', con, if_exists='replace', index=False)
+    con.commit()
+
+
+def with_insert_frame(con, tables, metadata):
+    con.execute('BEGIN')
+    schema(con, tables)
+    for name, frame in tables.items():
+        insert_frame(con, name, frame)
+    metadata.to_sql('metadata', con, if_exists='replace', index=False)
+    con.commit()
+
+
+def with_bulk_load(con, tables, metadata):
+    with bulk_load(con):
+        with_insert_frame(con, tables, metadata)
+
+
+def with_write_tables(con, tables, metadata):
+    # the monthly counts included
+    with bulk_load(con):
+        write_tables(con, tables, metadata)
+
+
+def timed(write, tables, metadata):
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'bench.db')
+    con = sqlite3.connect(path)
+    try:
+        start = time.perf_counter()
+        write(con, tables, metadata)
+        return time.perf_counter() - start
+    finally:
+        con.close()
+        for name in os.listdir(folder):
+            os.remove(os.path.join(folder, name))
+        os.rmdir(folder)
+
+
+def main(records):
+    tables = generate(records)
+    metadata = pd.DataFrame([{'schema_version': DATABASE_SCHEMA_VERSION, 'created_at': '2021-01-01T00:00:00',
+                              'source_path': '', 'profile_json': json.dumps(PROFILE)}])
+    rows = sum(len(frame) for frame in tables.values())
+    print('{} records, {} rows over the tables'.format(records, rows))
+    for label, write in [('to_sql', with_to_sql), ('insert_frame', with_insert_frame),
+                         ('insert_frame + bulk_load', with_bulk_load), ('write_tables + bulk_load', with_write_tables)]:
+        seconds = min(timed(write, tables, metadata) for _ in range(3))
+        print('{:26} {:7.2f} s {:10,.0f} rows/sec'.format(label, seconds, rows / seconds))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+
+from components.dataset import SIR_I, SIR_R, SIR_S, encode_datetime, fill_missing_labels, sir_codes
+
+
+ORGANISM_FIELDS = ['GENUS', 'SPECIES', 'GRAM']
+CUBE_MAX_CARDINALITY = 1000
+PARALLEL_MIN_ROWS = 500000
+DAY_COLUMN = '__day__'
+NO_DAY = np.iinfo(np.int64).min
+
+
+def drug_pairs_for(drug_data, drug_columns):
+    if drug_data.empty or not drug_columns:
+        return []
+    lookup = drug_data[['abbr', 'group']].drop_duplicates()
+    lookup = lookup[lookup['abbr'].isin(drug_columns)]
+    return list(zip(lookup['group'], lookup['abbr']))
+
+
+def annotate_organisms(data, organism_col, organism_lookup, fields=ORGANISM_FIELDS):
+    # equivalent to an inner merge with the organism lookup, but it only adds
+    # the requested lookup fields instead of copying every column of the data
+    organism_lookup = organism_lookup.drop_duplicates('ORGANISM')
+    position = pd.Index(organism_lookup['ORGANISM']).get_indexer(data[organism_col].astype(object))
+    matched = position >= 0
+    annotated = data[matched].copy(deep=False)
+    for field in fields:
+        annotated[field] = organism_lookup[field].to_numpy()[position[matched]]
+    return annotated
+
+
+def group_codes(data, indexes):
+    grouper = data.groupby(indexes, observed=True, sort=True)
+    codes = grouper.ngroup().to_numpy()
+    keys = grouper.size().index
+    return codes, keys
+
+
+def sir_matrix(data, drug_columns):
+    if not drug_columns:
+        return np.empty((len(data), 0), dtype=np.int8)
+    return np.column_stack([sir_codes(data[col]).astype(np.int8) for col in drug_columns])
+
+
+def grouped_sir_counts(codes, n_groups, matrix):
+    # one bincount over (group, drug) cells replaces the melt + groupby
+    valid = codes >= 0
+    codes = codes[valid]
+    matrix = matrix[valid]
+    n_drugs = matrix.shape[1]
+    cells = codes[:, None] * n_drugs + np.arange(n_drugs)
+    size = n_groups * n_drugs
+    isolates = np.bincount(codes, minlength=n_groups)
+    sens = np.bincount(cells[matrix == SIR_S], minlength=size).reshape(n_groups, n_drugs)
+    resists = np.bincount(cells[(matrix == SIR_I) | (matrix == SIR_R)], minlength=size)\
+        .reshape(n_groups, n_drugs)
+    return isolates, sens, resists
+
+
+def pair_columns(drug_pairs):
+    columns = pd.MultiIndex.from_tuples(drug_pairs, names=['group', 'variable'])
+    return columns.sort_values()
+
+
+def count_frames(keys, columns, drug_columns, isolates, sens, resists):
+    position = [drug_columns.index(drug) for drug in columns.get_level_values('variable')]
+    # every isolate of a group counts towards the total of every drug, tested or not
+    total = pd.DataFrame(np.repeat(isolates[:, None], len(columns), axis=1), index=keys, columns=columns)
+    sens = pd.DataFrame(sens[:, position], index=keys, columns=columns)
+    resists = pd.DataFrame(resists[:, position], index=keys, columns=columns)
+    return total, sens, resists
+
+
+def format_count(value):
+    if pd.isna(value):
+        return ''
+    try:
+        return '{:.0f}'.format(float(value))
+    except (TypeError, ValueError):
+        return ''
+
+
+def _unique_text(values, formatter, missing):
+    # every distinct value is formatted once and the text is broadcast by code,
+    # percents are rounded and counts repeat, so there are far fewer than cells
+    codes, uniques = pd.factorize(values)
+    text = np.array([formatter(value) for value in uniques] + [missing], dtype=str)
+    return text[codes]
+
+
+def narst_frame(percent, total):
+    percent_text = _unique_text(percent.to_numpy(dtype=np.float64).ravel(), lambda v: str(float(v)), '-')
+    total_text = _unique_text(total.to_numpy(dtype=np.float64).ravel(), format_count, '')
+    text = np.strings.add(np.strings.add(percent_text, ' ('), np.strings.add(total_text, ')'))
+    text = np.where(np.strings.startswith(percent_text, '-'), '', text)
+    return pd.DataFrame(text.reshape(percent.shape).astype(object), index=percent.index, columns=percent.columns)
+
+
+def _prepare(data, indexes, drug_columns, extra_columns=()):
+    # every row counts as an isolate, so the identifier column itself is not needed
+    columns = list(dict.fromkeys(list(indexes) + list(drug_columns) + list(extra_columns)))
+    # missing labels form their own '' group, as they did before nulls were kept
+    return fill_missing_labels(data[columns], list(indexes))
+
+
+def partial_counts(data, indexes, drug_columns):
+    # module level so that it can be pickled into worker processes
+    codes, keys = group_codes(data, indexes)
+    isolates, sens, resists = grouped_sir_counts(codes, len(keys), sir_matrix(data, drug_columns))
+    return keys.to_frame(index=False), isolates, sens, resists
+
+
+def merge_counts(partials, indexes):
+    # the partitions share their categories, so grouping the concatenated keys
+    # orders the groups exactly like grouping all rows at once
+    keys = pd.concat([partial[0] for partial in partials], ignore_index=True)
+    codes, merged = group_codes(keys, indexes)
+    isolates = sum_by_code(codes, len(merged), np.concatenate([partial[1] for partial in partials]))
+    sens = sum_by_code(codes, len(merged), np.concatenate([partial[2] for partial in partials]))
+    resists = sum_by_code(codes, len(merged), np.concatenate([partial[3] for partial in partials]))
+    return merged, isolates, sens, resists
+
+
+def sir_counts(data, indexes, drug_columns, executor=None, partitions=1):
+    if executor is None or partitions <= 1 or len(data) < PARALLEL_MIN_ROWS:
+        codes, keys = group_codes(data, indexes)
+        return (keys,) + grouped_sir_counts(codes, len(keys), sir_matrix(data, drug_columns))
+    bounds = np.linspace(0, len(data), partitions + 1).astype(np.int64)
+    futures = [executor.submit(partial_counts, data.iloc[low:high], indexes, drug_columns)
+               for low, high in zip(bounds[:-1], bounds[1:]) if high > low]
+    return merge_counts([future.result() for future in futures], indexes)
+
+
+def prune_groups(keys, isolates, sens, resists, min_isolates=0):
+    # groups below the cutoff are dropped before any frame is built for them
+    if min_isolates <= 1:
+        return keys, isolates, sens, resists
+    keep = isolates >= min_isolates
+    return keys[keep], isolates[keep], sens[keep], resists[keep]
+
+
+def biogram_counts(data, indexes, drug_pairs, executor=None, partitions=1, min_isolates=0):
+    columns = pair_columns(drug_pairs)
+    drug_columns = list(dict.fromkeys(columns.get_level_values('variable')))
+    data = _prepare(data, indexes, drug_columns)
+    counts = prune_groups(*sir_counts(data, indexes, drug_columns, executor, partitions), min_isolates)
+    return count_frames(counts[0], columns, drug_columns, *counts[1:])
+
+
+def filter_date_range(data, date_col, start=None, end=None):
+    # same rows as comparing .dt.date against the picked dates, without
+    # building a Python date object per row
+    dates = encode_datetime(data[date_col])
+    mask = np.ones(len(data), dtype=bool)
+    if start is not None:
+        mask &= (dates >= pd.Timestamp(start).normalize()).to_numpy()
+    if end is not None:
+        mask &= (dates < pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).to_numpy()
+    return data[mask]
+
+
+def day_numbers(series):
+    values = encode_datetime(series).to_numpy().astype('datetime64[D]')
+    days = values.astype(np.int64)
+    days[np.isnat(values)] = NO_DAY
+    return days
+
+
+def to_day_number(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64)
+
+
+def cube_dimensions(data, candidates, max_cardinality=CUBE_MAX_CARDINALITY):
+    dims = []
+    for col in candidates:
+        if col in ORGANISM_FIELDS:
+            dims.append(col)
+        elif col in data.columns and data[col].nunique(dropna=False) <= max_cardinality:
+            dims.append(col)
+    return dims
+
+
+def sum_by_code(codes, n_groups, values):
+    out = np.zeros((n_groups,) + values.shape[1:], dtype=np.int64)
+    np.add.at(out, codes, values)
+    return out
+
+
+def prefix_sums(values, dtype):
+    zeros = np.zeros((1,) + values.shape[1:], dtype=dtype)
+    return np.concatenate([zeros, np.cumsum(values, axis=0, dtype=dtype)])
+
+
+class AggregationCube(object):
+    # Counts are kept as prefix sums over cells sorted by (group, day), where a
+    # group is one combination of the cube dimensions. The counts of a date
+    # window are then two searchsorted lookups per group instead of a scan.
+    def __init__(self, groups, dims, columns, drug_columns, positions, first_day, span,
+                 isolates, sens, resists):
+        self.groups = groups
+        self.dims = dims
+        self.columns = columns
+        self.drug_columns = drug_columns
+        self.positions = positions
+        self.first_day = first_day
+        self.span = span
+        self.isolates = isolates
+        self.sens = sens
+        self.resists = resists
+        self._layouts = {}
+
+    @classmethod
+    def build(cls, data, dims, drug_pairs, date_col=None, executor=None, partitions=1):
+        columns = pair_columns(drug_pairs)
+        drug_columns = list(dict.fromkeys(columns.get_level_values('variable')))
+        extra = [date_col] if date_col else []
+        data = _prepare(data, dims, drug_columns, extra)
+        frame = data[dims].copy(deep=False)
+        frame[DAY_COLUMN] = day_numbers(data[date_col]) if date_col else 0
+        for col in drug_columns:
+            frame[col] = data[col]
+        keys, isolates, sens, resists = sir_counts(frame, dims + [DAY_COLUMN], drug_columns, executor, partitions)
+
+        cells = keys.to_frame(index=False)
+        group_of_cell, groups = group_codes(cells[dims], dims)
+        days = cells[DAY_COLUMN].to_numpy()
+        dated = days != NO_DAY
+        first_day = days[dated].min() if dated.any() else 0
+        span = int(days[dated].max() - first_day + 1) if dated.any() else 1
+        # day offset 0 is reserved for records without a date
+        offsets = np.where(dated, days - first_day + 1, 0)
+        positions = group_of_cell.astype(np.int64) * (span + 1) + offsets
+        order = np.argsort(positions, kind='stable')
+
+        dtype = np.int32 if len(data) < np.iinfo(np.int32).max else np.int64
+        return cls(groups.to_frame(index=False), dims, columns, drug_columns, positions[order], first_day,
+                   span, prefix_sums(isolates[order], dtype), prefix_sums(sens[order], dtype),
+                   prefix_sums(resists[order], dtype))
+
+    def covers(self, indexes):
+        return all(index in self.dims for index in indexes)
+
+    def _offset(self, value):
+        return int(np.clip(to_day_number(value) - self.first_day + 1, 0, self.span + 1))
+
+    def window(self, start=None, end=None):
+        # a group owns offsets 0 to span, the offset after it is offset 0 of the next group,
+        # so an end past the last day stops at span and a start past it leaves nothing
+        if start is None and end is None:
+            low, high = 0, self.span
+        else:
+            low = 1 if start is None else max(self._offset(start), 1)
+            high = self.span if end is None else min(self._offset(end), self.span)
+        base = np.arange(len(self.groups), dtype=np.int64) * (self.span + 1)
+        lo = np.searchsorted(self.positions, base + low, side='left')
+        hi = np.searchsorted(self.positions, base + high, side='right')
+        if low > high:
+            hi = lo
+        return (self.isolates[hi] - self.isolates[lo],
+                self.sens[hi] - self.sens[lo],
+                self.resists[hi] - self.resists[lo])
+
+    def _layout(self, indexes):
+        # the groups of a layout do not depend on the window, so reports asking for
+        # the same layout over other windows reuse them
+        layout = tuple(indexes)
+        if layout not in self._layouts:
+            self._layouts[layout] = group_codes(self.groups[list(indexes)], list(indexes))
+        return self._layouts[layout]
+
+    def rollup(self, indexes, start=None, end=None, min_isolates=0):
+        isolates, sens, resists = self.window(start, end)
+        # groups without isolates in the window would not exist in the raw data either
+        present = isolates > 0
+        codes, keys = self._layout(indexes)
+        used, codes = np.unique(codes[present], return_inverse=True)
+        keys = keys[used]
+        n_groups = len(keys)
+        isolates = sum_by_code(codes, n_groups, isolates[present])
+        sens = sum_by_code(codes, n_groups, sens[present])
+        resists = sum_by_code(codes, n_groups, resists[present])
+        keys, isolates, sens, resists = prune_groups(keys, isolates, sens, resists, min_isolates)
+        return count_frames(keys, self.columns, self.drug_columns, isolates, sens, resists)
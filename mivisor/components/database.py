@@ -0,0 +1,1048 @@
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from hashlib import blake2b
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from components.dataset import SIR_CATEGORIES, SIR_I, SIR_R, SIR_S, as_text, compact_frame, encode_sir
+from components.dedup import find_duplicates, key_codes
+
+
+DATABASE_SCHEMA_VERSION = 2
+FACT_COLUMNS = ['record_id', 'drug', 'drug_group', 'sensitivity', 'added_at']
+ORGANISM_NAME = 'organism_name'
+ORGANISM_COLUMNS = ['GENUS', 'SPECIES', 'GRAM', ORGANISM_NAME]
+LABEL_COLUMNS = ['drug', 'drug_group', 'sensitivity', ORGANISM_NAME]
+READ_CHUNK_SIZE = 50000
+WRITE_CHUNK_SIZE = 100000
+BULK_CACHE_KIB = 256000
+FINGERPRINT_FIELDS = ['identifier_col', 'date_col', 'organism_col', 'specimens_col']
+INDEX_NAMES = ['results_record', 'organisms_name', 'isolates_date', 'isolates_organism', 'isolates_specimen',
+               'summary_organism']
+SUMMARY_TABLE = 'monthly_counts'
+SUMMARY_COUNTS = ['total', 'identified', 'sens', 'resists']
+SUMMARY_MAX_CARDINALITY = 1000
+PARTITION_TABLE = 'partitions'
+PARTITION_FORMATS = OrderedDict([('year', '%Y'), ('month', '%Y-%m')])
+UNDATED_PARTITION = 'undated'
+# SQLite attaches at most 10 databases unless built with a higher limit
+MAX_ATTACHED = 10
+PARTITIONED_TABLES = ['isolates', 'results', 'records', 'facts', SUMMARY_TABLE]
+SHARED_TABLES = ['organisms', 'drug_groups', 'drugs', 'sensitivities']
+
+
+def quote(name):
+    return '"{}"'.format(str(name).replace('"', '""'))
+
+
+def read_profile(con):
+    row = con.execute('SELECT profile_json FROM metadata ORDER BY rowid DESC LIMIT 1').fetchone()
+    if row is None:
+        raise ValueError('metadata is empty')
+    return json.loads(row[0])
+
+
+def table_columns(con, table='facts'):
+    return [row[1] for row in con.execute('PRAGMA table_info({})'.format(quote(table)))]
+
+
+def object_type(con, name):
+    # temp objects first, like SQLite resolves names; partitions are read through temp views
+    row = con.execute('SELECT type FROM sqlite_temp_master WHERE name = ? UNION ALL '
+                      'SELECT type FROM sqlite_master WHERE name = ?', (name, name)).fetchone()
+    return row[0] if row else None
+
+
+def is_catalog(con):
+    return object_type(con, PARTITION_TABLE) == 'table'
+
+
+def schema_version(con):
+    # version 1 databases keep the melted facts as a table, later ones build it as a view
+    return 1 if object_type(con, 'facts') == 'table' else DATABASE_SCHEMA_VERSION
+
+
+def record_source(con):
+    # one row per record, so per-record queries need no GROUP BY over the results
+    return 'records' if object_type(con, 'records') == 'view' else None
+
+
+def column_expressions(con, profile):
+    # databases saved without organism_name get it from GENUS and SPECIES, or the organism column
+    expressions = OrderedDict((col, quote(col)) for col in table_columns(con))
+    if ORGANISM_NAME not in expressions:
+        organism_col = profile.get('organism_col', '')
+        fallback = 'CAST({} AS TEXT)'.format(quote(organism_col)) if organism_col in expressions else None
+        if 'GENUS' in expressions and 'SPECIES' in expressions:
+            name = "TRIM(TRIM(COALESCE(\"GENUS\", '')) || ' ' || TRIM(COALESCE(\"SPECIES\", '')))"
+            if fallback:
+                name = "COALESCE(NULLIF({}, ''), {})".format(name, fallback)
+            expressions[ORGANISM_NAME] = name
+        elif fallback:
+            expressions[ORGANISM_NAME] = fallback
+    return expressions
+
+
+def record_columns(expressions):
+    return [col for col in expressions if col not in FACT_COLUMNS]
+
+
+def date_bounds(con, expressions, date_col):
+    if date_col not in expressions:
+        return None, None
+    if is_catalog(con):
+        low, high = con.execute('SELECT MIN(first_date), MAX(last_date) FROM {}'.format(PARTITION_TABLE)).fetchone()
+        return pd.to_datetime(low, errors='coerce'), pd.to_datetime(high, errors='coerce')
+    # MIN and MAX are single index lookups on the isolates table but not through a view
+    source = 'isolates' if 'isolates_date' in read_index_set(con) else record_source(con) or 'facts'
+    low, high = con.execute('SELECT MIN({0}), MAX({0}) FROM {1}'.format(expressions[date_col], source)).fetchone()
+    return pd.to_datetime(low, errors='coerce'), pd.to_datetime(high, errors='coerce')
+
+
+def _date_conditions(expressions, date_col, start=None, end=None):
+    # dates are stored as ISO text, so the window is a plain range over the column
+    conditions = []
+    params = []
+    if date_col in expressions and start is not None:
+        conditions.append('{} >= ?'.format(expressions[date_col]))
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if date_col in expressions and end is not None:
+        conditions.append('{} < ?'.format(expressions[date_col]))
+        params.append((pd.Timestamp(end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+    return conditions, params
+
+
+def _filter_conditions(expressions, filters):
+    conditions = []
+    params = []
+    for col, value in (filters or {}).items():
+        if value is None:
+            conditions.append('{} IS NULL'.format(expressions[col]))
+        elif isinstance(value, (list, tuple, set)):
+            value = list(value)
+            conditions.append('{} IN ({})'.format(expressions[col], ', '.join('?' * len(value))))
+            params.extend(value)
+        else:
+            conditions.append('{} = ?'.format(expressions[col]))
+            params.append(value)
+    return conditions, params
+
+
+def _where(conditions):
+    return ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+
+def distinct_values(con, expressions, column, date_col=None, start=None, end=None, filters=None):
+    summary = summary_conditions(con, expressions, [column] + list(filters or {}), date_col, start, end)
+    if summary is not None:
+        conditions, params = summary
+        source = SUMMARY_TABLE
+    else:
+        conditions, params = _date_conditions(expressions, date_col, start, end)
+        source = 'facts'
+    more_conditions, more_params = _filter_conditions(expressions, filters)
+    conditions += more_conditions + ['{} IS NOT NULL'.format(expressions[column])]
+    sql = 'SELECT DISTINCT {} FROM {}{}'.format(expressions[column], source, _where(conditions))
+    return sorted(row[0] for row in con.execute(sql, params + more_params))
+
+
+def summary_conditions(con, expressions, columns, date_col=None, start=None, end=None, dedup_keys=()):
+    # the conditions that pick the months of the window from the monthly counts, or
+    # None when the counts cannot answer: deduplication needs the records, and a
+    # window edge inside a month needs the dates unless no record lies beyond it
+    if dedup_keys or object_type(con, SUMMARY_TABLE) not in ('table', 'view'):
+        return None
+    available = table_columns(con, SUMMARY_TABLE)
+    if any(col not in available or expressions.get(col) != quote(col) for col in columns):
+        return None
+    # the unary + keeps SQLite from skip-scanning the organism index on window only queries
+    conditions = []
+    params = []
+    if date_col in expressions and (start is not None or end is not None):
+        first, last = date_bounds(con, expressions, date_col)
+        if start is not None:
+            start = pd.Timestamp(start)
+            if start.day != 1 and not start <= first:
+                return None
+            conditions.append('+month >= ?')
+            params.append(start.strftime('%Y-%m'))
+        if end is not None:
+            end = pd.Timestamp(end)
+            if not end.is_month_end and not end >= last.normalize():
+                return None
+            conditions.append('+month <= ?')
+            params.append(end.strftime('%Y-%m'))
+    return conditions, params
+
+
+def read_facts(con, expressions, columns, date_col=None, start=None, end=None, filters=None,
+               chunksize=READ_CHUNK_SIZE):
+    # only the requested columns of the rows inside the window leave SQLite, and
+    # each chunk is compacted before the next one is fetched
+    conditions, params = _date_conditions(expressions, date_col, start, end)
+    more_conditions, more_params = _filter_conditions(expressions, filters)
+    sql = 'SELECT {} FROM facts{}'.format(
+        ', '.join('{} AS {}'.format(expressions[col], quote(col)) for col in columns),
+        _where(conditions + more_conditions))
+    for chunk in pd.read_sql_query(sql, con, params=params + more_params, chunksize=chunksize):
+        yield compact_frame(chunk, date_col=date_col,
+                            category_cols=[col for col in columns if col in LABEL_COLUMNS])
+
+
+def _record_keys(expressions, keys, date_col=None, source=None):
+    # one row per record with its key columns k0, k1, ... and its date
+    columns = [expressions[key] for key in keys] + ([expressions[date_col]] if date_col else [])
+    names = ['k{}'.format(i) for i in range(len(keys))] + (['record_date'] if date_col else [])
+    if source:
+        return 'SELECT record_id{} FROM {}'.format(
+            ''.join(', {} AS {}'.format(col, name) for col, name in zip(columns, names)), source)
+    return 'SELECT record_id{} FROM facts GROUP BY record_id'.format(
+        ''.join(', MIN({}) AS {}'.format(col, name) for col, name in zip(columns, names)))
+
+
+def _kept_records(expressions, keys, date_col=None, source=None):
+    # one record per key, the earliest one when ordered by date and the first
+    # loaded one otherwise, like sorting and drop_duplicates(keep='first')
+    partition = ', '.join('k{}'.format(i) for i in range(len(keys)))
+    order = 'record_date IS NULL, record_date, record_id' if date_col else 'record_id'
+    return ('kept AS (SELECT record_id FROM ('
+            'SELECT record_id, ROW_NUMBER() OVER (PARTITION BY {} ORDER BY {}) AS position '
+            'FROM ({})) WHERE position = 1)'
+            .format(partition, order, _record_keys(expressions, keys, date_col, source)))
+
+
+def record_keys(con, expressions, keys, date_col=None):
+    # in load order, which breaks the ties between records of the same key and day
+    records = pd.read_sql_query(_record_keys(expressions, keys, date_col, record_source(con)), con)
+    return records.sort_values('record_id', kind='stable', ignore_index=True)
+
+
+def merge_record_keys(parts):
+    # record ids are unique over the partitions of a catalog, their order is the load order
+    return pd.concat(parts, ignore_index=True).sort_values('record_id', kind='stable', ignore_index=True)
+
+
+def kept_records(records, window=0):
+    # the kept record ids and the duplicate stats of record keys read before: the first
+    # isolate per episode of `window` days, or the earliest record of every key, by
+    # date when the keys were read with one
+    key_names = [col for col in records.columns if col not in ('record_id', 'record_date')]
+    date_col = 'record_date' if 'record_date' in records.columns else None
+    keep, stats = find_duplicates(records, key_names, date_col, window if date_col else 0)
+    return records['record_id'][keep], stats
+
+
+def kept_summary(records, kept):
+    # dedup_summary of record keys read before and their kept_records
+    ids, stats = kept
+    return len(records), len(ids), len(stats), int(stats['records'].max()) if len(stats) else 0
+
+
+def episode_records(con, expressions, keys, date_col, window):
+    # episodes need the previous kept isolate of every key, which a single SQL pass
+    # cannot express, so the record keys are loaded and deduplicated with numpy
+    return kept_records(record_keys(con, expressions, keys, date_col), window)
+
+
+def _store_kept_records(con, record_ids):
+    con.execute('DROP TABLE IF EXISTS temp.kept_records')
+    con.execute('CREATE TEMP TABLE kept_records (record_id INTEGER PRIMARY KEY)')
+    con.executemany('INSERT INTO temp.kept_records VALUES (?)', ((int(i),) for i in record_ids))
+
+
+def dedup_summary(con, expressions, keys, date_col=None, episode_days=0, episodes=None):
+    # records, kept records, keys with duplicates and the records behind the most repeated key,
+    # `episodes` being the episode_records of the same keys when they were already computed
+    source = record_source(con)
+    records = con.execute('SELECT COUNT(*) FROM isolates' if source else
+                          'SELECT COUNT(DISTINCT record_id) FROM facts').fetchone()[0]
+    if not keys:
+        return records, records, 0, 0
+    if episode_days > 0 and date_col in expressions:
+        kept, stats = episodes or episode_records(con, expressions, keys, date_col, episode_days)
+        return records, len(kept), len(stats), int(stats['records'].max()) if len(stats) else 0
+    kept, groups, largest = con.execute(
+        'SELECT COUNT(*), SUM(n > 1), MAX(n) FROM (SELECT {} AS n FROM {} GROUP BY {})'
+        .format('COUNT(*)' if source else 'COUNT(DISTINCT record_id)', source or 'facts',
+                ', '.join(expressions[key] for key in keys))).fetchone()
+    return records, kept, groups or 0, largest or 0
+
+
+def antibiogram_counts(con, expressions, indexes, date_col=None, start=None, end=None,
+                       dedup_keys=(), sort_by_date=False, episode_days=0, min_isolates=0, kept=None):
+    # only one row per (group, drug) comes back, whatever the size of the history
+    summary = summary_conditions(con, expressions, indexes, date_col, start, end, dedup_keys)
+    if summary is not None:
+        return _summary_counts(con, expressions, indexes, summary, min_isolates)
+    source = record_source(con)
+    record_id = 'r.record_id' if source else 'record_id'
+    labels = ', '.join("COALESCE({}, '') AS i{}".format(expressions[col], i) for i, col in enumerate(indexes))
+    conditions, params = _date_conditions(expressions, date_col, start, end)
+    sql = ''
+    if dedup_keys and (kept is not None or episode_days > 0 and date_col in expressions):
+        # `kept` being the kept_records of the keys over the whole history when they were found before
+        kept = kept or episode_records(con, expressions, dedup_keys, date_col, episode_days)
+        _store_kept_records(con, kept[0])
+        conditions.append('{} IN (SELECT record_id FROM temp.kept_records)'.format(record_id))
+    elif dedup_keys:
+        sql = 'WITH {} '.format(_kept_records(expressions, dedup_keys, date_col if sort_by_date else None, source))
+        conditions.append('{} IN (SELECT record_id FROM kept)'.format(record_id))
+    having = ''
+    if min_isolates > 1:
+        having = ' HAVING COUNT(*) >= ?'
+        params.append(int(min_isolates))
+    if source:
+        # grouped on the integer drug and result codes, the names are joined to the
+        # few rows that come out
+        sql += ('SELECT {0}, g.drug_group, d.drug, c.total, c.sens, c.resists FROM ('
+                'SELECT {1}, r.drug_id, COUNT(*) AS total, SUM(r.sensitivity_id = {2}) AS sens, '
+                'SUM(r.sensitivity_id IN ({3}, {4})) AS resists '
+                'FROM results r JOIN records ON records.record_id = r.record_id{5} GROUP BY {6}{7}) c '
+                'JOIN drugs d ON d.drug_id = c.drug_id JOIN drug_groups g ON g.drug_group_id = d.drug_group_id'
+                .format(', '.join('c.i{}'.format(i) for i in range(len(indexes))), labels, SIR_S, SIR_I, SIR_R,
+                        _where(conditions), ', '.join(str(i) for i in range(1, len(indexes) + 2)), having))
+    else:
+        sql += ('SELECT {}, drug_group, drug, COUNT(*) AS total, SUM(sensitivity = \'S\') AS sens, '
+                'SUM(sensitivity IN (\'I\', \'R\')) AS resists FROM facts{} GROUP BY {}{}'
+                .format(labels, _where(conditions), ', '.join(str(i) for i in range(1, len(indexes) + 3)), having))
+    counts = pd.read_sql_query(sql, con, params=params)
+    counts.columns = list(indexes) + ['group', 'variable', 'total', 'sens', 'resists']
+    return counts
+
+
+def merge_counts(parts, indexes, min_isolates=0):
+    # antibiogram_counts read without a minimum from several sets of partitions
+    columns = list(indexes) + ['group', 'variable']
+    counts = pd.concat(parts, ignore_index=True).groupby(columns, sort=False, dropna=False, as_index=False)[
+        ['total', 'sens', 'resists']].sum()
+    if min_isolates > 1:
+        counts = counts[counts['total'] >= min_isolates].reset_index(drop=True)
+    return counts
+
+
+def _summary_counts(con, expressions, indexes, summary, min_isolates=0):
+    conditions, params = summary
+    labels = ', '.join("COALESCE({}, '') AS i{}".format(expressions[col], i) for i, col in enumerate(indexes))
+    having = ''
+    if min_isolates > 1:
+        having = ' HAVING SUM(total) >= ?'
+        params = params + [int(min_isolates)]
+    counts = pd.read_sql_query(
+        'SELECT {0}, g.drug_group, d.drug, c.total, c.sens, c.resists FROM ('
+        'SELECT {1}, drug_id, SUM(total) AS total, SUM(sens) AS sens, SUM(resists) AS resists '
+        'FROM {2}{3} GROUP BY {4}{5}) c '
+        'JOIN drugs d ON d.drug_id = c.drug_id JOIN drug_groups g ON g.drug_group_id = d.drug_group_id'
+        .format(', '.join('c.i{}'.format(i) for i in range(len(indexes))), labels, SUMMARY_TABLE,
+                _where(conditions), ', '.join(str(i) for i in range(1, len(indexes) + 2)), having), con, params=params)
+    counts.columns = list(indexes) + ['group', 'variable', 'total', 'sens', 'resists']
+    return counts
+
+
+def heatmap_counts(con, expressions, row_field, date_col=None, start=None, end=None, filters=None):
+    # tested isolates (those with an identifier) and susceptible ones per row and drug
+    # from the monthly counts, None when they cannot answer the query
+    summary = summary_conditions(con, expressions, [row_field] + list(filters or {}), date_col, start, end)
+    if summary is None:
+        return None
+    conditions, params = summary
+    more_conditions, more_params = _filter_conditions(expressions, filters)
+    conditions += more_conditions + ['{} IS NOT NULL'.format(expressions[row_field])]
+    counts = pd.read_sql_query(
+        'SELECT {0}, d.drug, SUM(m.identified) AS tested, SUM(m.sens) AS sens FROM {1} m '
+        'JOIN drugs d ON d.drug_id = m.drug_id{2} GROUP BY 1, 2'
+        .format(expressions[row_field], SUMMARY_TABLE, _where(conditions)), con, params=params + more_params)
+    counts.columns = [row_field, 'drug', 'tested', 'sens']
+    return counts
+
+
+def merge_heatmap_counts(parts, row_field):
+    # the partitions share the columns of their monthly counts, they all answer or none does
+    if any(part is None for part in parts):
+        return None
+    return pd.concat(parts, ignore_index=True).groupby(
+        [row_field, 'drug'], sort=False, dropna=False, as_index=False)[['tested', 'sens']].sum()
+
+
+def sql_type(series):
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'TIMESTAMP'
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def _digests(values):
+    # 64 bit blake2b digests, computed once per distinct value
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    digests = [int.from_bytes(blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+               for value in uniques]
+    return np.array(digests + [0], dtype=np.uint64)[codes]
+
+
+def _identity_value(value):
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def identity_text(series):
+    # the same text for a value whatever the dtype it was read with: a numeric column
+    # reads as float in an export with a blank cell and as int in one without, and
+    # strings keep the spaces around them. Nulls are ''.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    codes, uniques = pd.factorize(series)
+    return np.array([_identity_value(value) for value in uniques] + [''], dtype=object)[codes]
+
+
+def identity_digests(frame, profile):
+    # identifier, date, organism and specimen of every record, as text that reads
+    # the same from a loaded frame and from the isolates table
+    text = None
+    for field in FINGERPRINT_FIELDS:
+        col = profile.get(field, '')
+        if col not in frame.columns:
+            values = np.full(len(frame), '')
+        elif field == 'date_col':
+            values = pd.to_datetime(frame[col], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S').fillna('')
+        else:
+            values = identity_text(frame[col])
+        values = np.asarray(values, dtype=str)
+        text = values if text is None else np.strings.add(np.strings.add(text, '\x1f'), values)
+    return _digests(text)
+
+
+def result_digests(record_positions, drugs, sensitivities, size):
+    # the results of a record form a set, so the digests of its drug=result pairs
+    # are summed (wrapping) rather than hashed in any particular order
+    tokens = np.strings.add(np.strings.add(np.asarray(drugs, dtype=str), '='),
+                            np.asarray(sensitivities, dtype=str))
+    digests = np.zeros(size, dtype=np.uint64)
+    np.add.at(digests, record_positions, _digests(tokens))
+    return digests
+
+
+def fingerprints(identity, results):
+    return [bytes(row) for row in np.column_stack([identity, results]).astype('<u8').view(np.uint8)
+            .reshape(len(identity), 16)]
+
+
+def build_tables(df, drug_columns, organism_lookup, drug_lookup, profile, added_at=None):
+    # one isolate row per record with at least one result, small integer keyed
+    # dimensions and a narrow fact table of (record, drug, result) codes
+    organism_col = profile['organism_col']
+    drug_lookup = drug_lookup[drug_lookup['drug'].isin(drug_columns)].drop_duplicates().reset_index(drop=True)
+    drug_columns = [col for col in drug_columns if col in set(drug_lookup['drug'])]
+    if not drug_columns:
+        return None
+
+    sir = [encode_sir(df[col], normalize=True) for col in drug_columns]
+    labels = SIR_CATEGORIES + sorted({c for column in sir for c in column.cat.categories} - set(SIR_CATEGORIES))
+    position = {label: i for i, label in enumerate(labels)}
+    codes = np.column_stack([
+        np.append(np.array([position[c] for c in column.cat.categories], dtype=np.int64), -1)[column.cat.codes]
+        for column in sir
+    ])
+    tested = (codes >= 0).any(axis=1)
+
+    drug_groups = pd.DataFrame({'drug_group': pd.unique(drug_lookup['group'])})
+    drug_groups.insert(0, 'drug_group_id', np.arange(len(drug_groups)))
+    drugs = pd.DataFrame({
+        'drug_id': np.arange(len(drug_lookup)),
+        'drug': drug_lookup['drug'],
+        'drug_group_id': pd.Index(drug_groups['drug_group']).get_indexer(drug_lookup['group']),
+    })
+    results = []
+    for drug_id, drug in zip(drugs['drug_id'], drugs['drug']):
+        column = codes[:, drug_columns.index(drug)]
+        record_ids = np.flatnonzero(column >= 0)
+        results.append(pd.DataFrame({'record_id': record_ids, 'drug_id': drug_id,
+                                     'sensitivity_id': column[record_ids]}))
+    results = pd.concat(results, ignore_index=True)
+
+    organism_ids, organisms = pd.factorize(df[organism_col], use_na_sentinel=False)
+    organism_lookup = organism_lookup.drop_duplicates('ORGANISM').set_index('ORGANISM')
+    organisms = pd.DataFrame({'organism_id': np.arange(len(organisms)), 'organism': organisms})
+    for col in ['GENUS', 'SPECIES', 'GRAM']:
+        organisms[col] = as_text(organism_lookup[col].reindex(organisms['organism']).reset_index(drop=True))
+    organisms[ORGANISM_NAME] = (organisms['GENUS'].str.strip() + ' ' + organisms['SPECIES'].str.strip()).str.strip()
+    unnamed = organisms[ORGANISM_NAME] == ''
+    organisms.loc[unnamed, ORGANISM_NAME] = as_text(organisms.loc[unnamed, 'organism'])
+
+    isolates = df[[col for col in df.columns if col not in drug_columns]].copy(deep=False)
+    isolates.insert(0, 'record_id', np.arange(len(df)))
+    isolates['organism_id'] = organism_ids
+    isolates['added_at'] = added_at or datetime.utcnow().isoformat(timespec='seconds')
+    isolates = isolates[tested]
+    # one pass per drug column, so drugs listed under several groups count once
+    digests = np.zeros(len(isolates), dtype=np.uint64)
+    for position, drug in enumerate(drug_columns):
+        pairs = np.append(_digests(['{}={}'.format(drug, label) for label in labels]), np.uint64(0))
+        digests += pairs[codes[tested, position]]
+    isolates['fingerprint'] = fingerprints(identity_digests(isolates, profile), digests)
+    return OrderedDict([
+        ('isolates', isolates),
+        ('organisms', organisms),
+        ('drug_groups', drug_groups),
+        ('drugs', drugs),
+        ('sensitivities', pd.DataFrame({'sensitivity_id': np.arange(len(labels)), 'sensitivity': labels})),
+        ('results', results),
+    ])
+
+
+def _isolate_table(columns):
+    # columns lists (name, type) of the record attributes
+    return ('CREATE TABLE isolates (record_id INTEGER PRIMARY KEY, {}, '
+            'organism_id INTEGER REFERENCES organisms (organism_id), added_at TEXT, fingerprint BLOB)'
+            .format(', '.join('{} {}'.format(quote(name), sql_type) for name, sql_type in columns)))
+
+
+FINGERPRINT_INDEX = 'CREATE INDEX IF NOT EXISTS isolates_fingerprint ON isolates (fingerprint)'
+DIMENSION_TABLES = [
+    'CREATE TABLE organisms (organism_id INTEGER PRIMARY KEY, organism, GENUS TEXT, SPECIES TEXT, '
+    'GRAM TEXT, organism_name TEXT)',
+    'CREATE TABLE drug_groups (drug_group_id INTEGER PRIMARY KEY, drug_group TEXT)',
+    'CREATE TABLE drugs (drug_id INTEGER PRIMARY KEY, drug TEXT, '
+    'drug_group_id INTEGER REFERENCES drug_groups (drug_group_id))',
+    'CREATE TABLE sensitivities (sensitivity_id INTEGER PRIMARY KEY, sensitivity TEXT)',
+    'CREATE TABLE results (record_id INTEGER REFERENCES isolates (record_id), '
+    'drug_id INTEGER REFERENCES drugs (drug_id), '
+    'sensitivity_id INTEGER REFERENCES sensitivities (sensitivity_id))',
+]
+
+
+def _views(columns):
+    # facts keeps the columns of the version 1 table, so every reader works on both
+    attributes = ''.join('i.{}, '.format(quote(name)) for name, _ in columns)
+    return [
+        'CREATE VIEW records AS SELECT {}i.record_id, o.GENUS, o.SPECIES, o.GRAM, o.organism_name, i.added_at '
+        'FROM isolates i JOIN organisms o ON o.organism_id = i.organism_id'.format(attributes),
+        'CREATE VIEW facts AS SELECT {}i.record_id, o.GENUS, o.SPECIES, o.GRAM, o.organism_name, d.drug, '
+        's.sensitivity, g.drug_group, i.added_at FROM results r '
+        'JOIN isolates i ON i.record_id = r.record_id '
+        'JOIN organisms o ON o.organism_id = i.organism_id '
+        'JOIN drugs d ON d.drug_id = r.drug_id '
+        'JOIN drug_groups g ON g.drug_group_id = d.drug_group_id '
+        'JOIN sensitivities s ON s.sensitivity_id = r.sensitivity_id'.format(attributes),
+    ]
+
+
+def drop_schema(con):
+    for name in [PARTITION_TABLE, SUMMARY_TABLE, 'facts', 'records', 'results', 'isolates', 'drugs', 'drug_groups',
+                 'organisms', 'sensitivities']:
+        kind = object_type(con, name)
+        if kind in ('table', 'view'):
+            con.execute('DROP {} {}'.format(kind.upper(), quote(name)))
+
+
+def create_schema(con, columns):
+    for statement in [_isolate_table(columns)] + DIMENSION_TABLES + _views(columns):
+        con.execute(statement)
+    con.execute(FINGERPRINT_INDEX)
+
+
+@contextmanager
+def bulk_load(con):
+    # WAL with syncs only at checkpoints, a large page cache and in-memory temp
+    # storage while loading, then a checkpoint that syncs everything to the main
+    # file and the previous journal mode back so the database stays a single file
+    con.commit()
+    journal_mode = con.execute('PRAGMA journal_mode').fetchone()[0]
+    synchronous = con.execute('PRAGMA synchronous').fetchone()[0]
+    con.execute('PRAGMA journal_mode = WAL')
+    con.execute('PRAGMA synchronous = NORMAL')
+    con.execute('PRAGMA cache_size = -{}'.format(BULK_CACHE_KIB))
+    con.execute('PRAGMA temp_store = MEMORY')
+    try:
+        yield con
+        con.commit()
+    except:
+        con.rollback()
+        raise
+    finally:
+        con.execute('PRAGMA synchronous = {}'.format(synchronous))
+        con.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        con.execute('PRAGMA journal_mode = {}'.format(journal_mode))
+
+
+def _column_values(series):
+    # plain python values sqlite3 binds without adapters, NULL for missing values
+    # and dates as the text to_sql writes
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iub':
+        return series.to_numpy().tolist()
+    values = series
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+    return values.astype(object).where(series.notna().to_numpy(), None).tolist()
+
+
+def insert_frame(con, name, frame):
+    # one prepared statement run over column arrays, inside the caller's transaction
+    statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(name), ', '.join(quote(col) for col in frame.columns), ', '.join('?' * len(frame.columns)))
+    for start in range(0, len(frame), WRITE_CHUNK_SIZE):
+        chunk = frame.iloc[start:start + WRITE_CHUNK_SIZE]
+        con.executemany(statement, zip(*(_column_values(chunk[col]) for col in chunk.columns)))
+
+
+def write_tables(con, tables, metadata, summary_cols=None):
+    # replaces the schema, the tables, the monthly counts and the metadata in one
+    # transaction, so a failed save leaves the previous contents of the file
+    columns = [(col, sql_type(tables['isolates'][col])) for col in tables['isolates'].columns
+               if col not in ('record_id', 'organism_id', 'added_at', 'fingerprint')]
+    con.execute('BEGIN')
+    drop_schema(con)
+    create_schema(con, columns)
+    for name, frame in tables.items():
+        insert_frame(con, name, frame)
+    write_summary(con, tables['isolates'], tables['results'], json.loads(metadata['profile_json'].iloc[-1]),
+                  columns=summary_cols)
+    _write_metadata(con, metadata)
+
+
+def _write_metadata(con, metadata):
+    con.execute('DROP TABLE IF EXISTS metadata')
+    con.execute('CREATE TABLE metadata ({})'.format(
+        ', '.join('{} {}'.format(quote(col), sql_type(metadata[col])) for col in metadata.columns)))
+    insert_frame(con, 'metadata', metadata)
+
+
+def index_definitions(con, profile):
+    # chosen for the read paths: results are reached by record, records by date
+    # window and by organism (and specimen) within a window
+    columns = table_columns(con, 'isolates')
+    date = quote(profile.get('date_col', '')) if profile.get('date_col', '') in columns else None
+    specimen = quote(profile.get('specimens_col', '')) if profile.get('specimens_col', '') in columns else None
+    definitions = OrderedDict()
+    definitions['results_record'] = 'results (record_id, drug_id, sensitivity_id)'
+    definitions['organisms_name'] = 'organisms (organism_name, organism_id)'
+    if date:
+        definitions['isolates_date'] = 'isolates ({}, organism_id)'.format(date)
+        definitions['isolates_organism'] = 'isolates (organism_id, {})'.format(date)
+    else:
+        definitions['isolates_organism'] = 'isolates (organism_id)'
+    if specimen:
+        definitions['isolates_specimen'] = 'isolates ({}{})'.format(specimen, ', ' + date if date else '')
+    if object_type(con, SUMMARY_TABLE) == 'table':
+        definitions['summary_organism'] = '{} (organism_name, month)'.format(SUMMARY_TABLE)
+    return definitions
+
+
+def read_index_set(con):
+    if 'index_set' not in table_columns(con, 'metadata'):
+        return set()
+    row = con.execute('SELECT index_set FROM metadata ORDER BY rowid DESC LIMIT 1').fetchone()
+    return set(json.loads(row[0])) if row and row[0] else set()
+
+
+def create_indexes(con):
+    # drops and recreates the index set, refreshes the planner statistics and
+    # records the set in metadata for the readers
+    definitions = index_definitions(con, read_profile(con))
+    for name in INDEX_NAMES:
+        con.execute('DROP INDEX IF EXISTS {}'.format(quote(name)))
+    for name, target in definitions.items():
+        con.execute('CREATE INDEX {} ON {}'.format(quote(name), target))
+    con.execute('ANALYZE')
+    if 'index_set' not in table_columns(con, 'metadata'):
+        con.execute('ALTER TABLE metadata ADD COLUMN index_set TEXT')
+    con.execute('UPDATE metadata SET index_set = ? WHERE rowid = (SELECT MAX(rowid) FROM metadata)',
+                (json.dumps(list(definitions)),))
+    con.commit()
+    return list(definitions)
+
+
+def summary_candidates(columns, profile):
+    # every record column but the identifier and the date
+    skip = [profile.get('identifier_col', ''), profile.get('date_col', ''), 'record_id', 'added_at', 'fingerprint',
+            'month', 'drug_id'] + ORGANISM_COLUMNS + SUMMARY_COUNTS
+    return [col for col in columns if col not in skip]
+
+
+def _summary_kept(profile):
+    return ['organism_id', profile.get('specimens_col', '')]
+
+
+def summary_columns(isolates, profile, max_cardinality=SUMMARY_MAX_CARDINALITY):
+    # the organism, the specimen and the columns with few enough values to group by. A
+    # column with a value per record, like a lab number, would make the counts as large
+    # as the results; queries grouping by it read the records instead
+    kept = _summary_kept(profile)
+    return [col for col in summary_candidates(isolates.columns, profile)
+            if col in kept or isolates[col].nunique(dropna=False) <= max_cardinality]
+
+
+def catalog_summary_columns(paths, profile, max_cardinality=SUMMARY_MAX_CARDINALITY):
+    # summary_columns over the partitions of a catalog, whose counts must have the same
+    # columns for the views; values are collected until a column has too many
+    values = OrderedDict()
+    for path in paths:
+        con = sqlite3.connect(path)
+        try:
+            for col in summary_candidates(table_columns(con, 'isolates'), profile):
+                seen = values.setdefault(col, set())
+                if len(seen) <= max_cardinality:
+                    seen.update(row[0] for row in con.execute('SELECT DISTINCT {} FROM isolates LIMIT ?'.format(
+                        quote(col)), (max_cardinality + 1,)))
+        finally:
+            con.close()
+    kept = _summary_kept(profile)
+    return [col for col, seen in values.items() if col in kept or len(seen) <= max_cardinality]
+
+
+def stored_summary_columns(con):
+    # the grouping columns of the monthly counts, organism_id for the organism names
+    return ['organism_id'] + [col for col in table_columns(con, SUMMARY_TABLE)
+                              if col not in ['month', 'drug_id'] + ORGANISM_COLUMNS + SUMMARY_COUNTS]
+
+
+def _format_dates(frame, date_col, date_format, missing=None):
+    # formatted once per distinct date
+    values = np.full(len(frame), missing, dtype=object)
+    if date_col in frame.columns:
+        codes, dates = pd.factorize(pd.to_datetime(frame[date_col], errors='coerce'))
+        found = codes >= 0
+        values[found] = np.asarray(pd.DatetimeIndex(dates).strftime(date_format), dtype=object)[codes[found]]
+    return values
+
+
+def summary_frame(isolates, results, organisms, profile, columns):
+    # counts per month, record columns and drug, grouped with numpy over the codes
+    # of the isolate cells rather than sorted by SQLite over every result
+    date_col = profile.get('date_col', '')
+    identifier_col = profile.get('identifier_col', '')
+    cells = isolates[columns]
+    cells.insert(0, 'month', _format_dates(isolates, date_col, '%Y-%m'))
+    cell_codes = key_codes(cells, list(cells.columns))
+    identified = isolates[identifier_col].notna().to_numpy() if identifier_col in isolates.columns \
+        else np.ones(len(isolates), dtype=bool)
+    positions = pd.Index(isolates['record_id']).get_indexer(results['record_id'])
+    drugs = results['drug_id'].to_numpy().astype('int64')
+    sensitivities = results['sensitivity_id'].to_numpy()
+    pairs, uniques = pd.factorize(cell_codes[positions] * (int(drugs.max()) + 1 if len(drugs) else 1) + drugs)
+    first = np.unique(pairs, return_index=True)[1]
+    summary = cells.iloc[positions[first]].reset_index(drop=True)
+    names = organisms.set_index('organism_id')[ORGANISM_COLUMNS].reindex(summary.pop('organism_id'))
+    for col in ORGANISM_COLUMNS:
+        summary[col] = names[col].to_numpy()
+    summary['drug_id'] = drugs[first]
+    size = len(uniques)
+    summary['total'] = np.bincount(pairs, minlength=size)
+    summary['identified'] = np.bincount(pairs, weights=identified[positions], minlength=size).astype('int64')
+    summary['sens'] = np.bincount(pairs, weights=sensitivities == SIR_S, minlength=size).astype('int64')
+    summary['resists'] = np.bincount(pairs, weights=np.isin(sensitivities, [SIR_I, SIR_R]),
+                                     minlength=size).astype('int64')
+    return summary
+
+
+def write_summary(con, isolates, results, profile, replace=True, columns=None):
+    # appended records add rows of their own over the columns the counts have, the
+    # readers sum over them
+    if replace:
+        if columns is None:
+            columns = summary_columns(isolates, profile)
+        con.execute('DROP TABLE IF EXISTS {}'.format(SUMMARY_TABLE))
+        declared = OrderedDict((row[1], row[2] or 'TEXT') for row in con.execute('PRAGMA table_info(isolates)'))
+        con.execute('CREATE TABLE {} (month TEXT, {}{}, drug_id INTEGER, {})'.format(
+            SUMMARY_TABLE, ''.join('{} {}, '.format(quote(col), declared[col])
+                                   for col in columns if col != 'organism_id'),
+            ', '.join('{} TEXT'.format(col) for col in ORGANISM_COLUMNS),
+            ', '.join('{} INTEGER'.format(col) for col in SUMMARY_COUNTS)))
+    else:
+        columns = stored_summary_columns(con)
+    organisms = pd.read_sql_query('SELECT organism_id, {} FROM organisms'.format(', '.join(ORGANISM_COLUMNS)), con)
+    insert_frame(con, SUMMARY_TABLE, summary_frame(isolates, results, organisms, profile, columns))
+
+
+def build_summary(con, columns=None):
+    # databases saved or upgraded without monthly counts get them from their tables
+    profile = read_profile(con)
+    isolates = pd.read_sql_query('SELECT * FROM isolates', con)
+    results = pd.read_sql_query('SELECT record_id, drug_id, sensitivity_id FROM results', con)
+    write_summary(con, isolates.drop(columns=['fingerprint', 'added_at'], errors='ignore'), results, profile,
+                  columns=columns)
+
+
+def migrate_database(con):
+    # rebuilds a version 1 melted facts table as the version 2 tables, in SQL and in
+    # one transaction, and records the new version in metadata
+    profile = read_profile(con)
+    expressions = column_expressions(con, profile)
+    declared = OrderedDict((row[1], row[2]) for row in con.execute('PRAGMA table_info(facts)'))
+    columns = [(col, declared[col] or 'TEXT') for col in declared if col not in FACT_COLUMNS + ORGANISM_COLUMNS]
+    names = ', '.join(quote(name) for name, _ in columns)
+    organism_col = profile.get('organism_col', '')
+    organism = quote(organism_col) if organism_col in declared else 'NULL'
+    fields = ['o_' + col for col in ORGANISM_COLUMNS]
+    con.execute('BEGIN')
+    con.execute('CREATE TEMP TABLE v1_records AS SELECT record_id, {}, MIN(added_at) AS added_at, '
+                '{} AS o_organism, {} FROM facts GROUP BY record_id'
+                .format(names, organism, ', '.join('{} AS {}'.format(expressions.get(col, "''"), field)
+                                                   for col, field in zip(ORGANISM_COLUMNS, fields))))
+    con.execute('ALTER TABLE facts RENAME TO facts_v1')
+    create_schema(con, columns)
+    con.execute('INSERT INTO organisms (organism, {}) SELECT DISTINCT o_organism, {} FROM temp.v1_records'
+                .format(', '.join(ORGANISM_COLUMNS), ', '.join(fields)))
+    con.execute('INSERT INTO isolates (record_id, {0}, organism_id, added_at) '
+                'SELECT r.record_id, {1}, o.organism_id, r.added_at FROM temp.v1_records r JOIN organisms o '
+                'ON o.organism IS r.o_organism AND {2}'
+                .format(names, ', '.join('r.' + quote(name) for name, _ in columns),
+                        ' AND '.join('o.{} IS r.{}'.format(col, field) for col, field in zip(ORGANISM_COLUMNS, fields))))
+    con.execute('INSERT INTO drug_groups (drug_group) SELECT DISTINCT drug_group FROM facts_v1')
+    con.execute('INSERT INTO drugs (drug, drug_group_id) SELECT DISTINCT f.drug, g.drug_group_id '
+                'FROM facts_v1 f JOIN drug_groups g ON g.drug_group IS f.drug_group')
+    con.executemany('INSERT INTO sensitivities (sensitivity_id, sensitivity) VALUES (?, ?)',
+                    enumerate(SIR_CATEGORIES))
+    con.execute('INSERT INTO sensitivities (sensitivity) SELECT DISTINCT sensitivity FROM facts_v1 '
+                'WHERE sensitivity NOT IN ({})'.format(', '.join('?' * len(SIR_CATEGORIES))), SIR_CATEGORIES)
+    con.execute('INSERT INTO results (record_id, drug_id, sensitivity_id) '
+                'SELECT f.record_id, d.drug_id, s.sensitivity_id FROM facts_v1 f '
+                'JOIN drug_groups g ON g.drug_group IS f.drug_group '
+                'JOIN drugs d ON d.drug IS f.drug AND d.drug_group_id = g.drug_group_id '
+                'JOIN sensitivities s ON s.sensitivity = f.sensitivity')
+    con.execute('DROP TABLE facts_v1')
+    con.execute('DROP TABLE temp.v1_records')
+    profile['schema_version'] = DATABASE_SCHEMA_VERSION
+    _add_metadata(con, profile)
+    con.commit()
+    con.execute('VACUUM')
+    build_summary(con)
+    create_indexes(con)
+    update_fingerprints(con, profile)
+
+
+def _add_metadata(con, profile, source_path=None):
+    # copies the previous row, index set included, with the new profile and date
+    values = OrderedDict([('schema_version', DATABASE_SCHEMA_VERSION),
+                          ('created_at', datetime.utcnow().isoformat(timespec='seconds')),
+                          ('profile_json', json.dumps(profile))])
+    if source_path is not None:
+        values['source_path'] = source_path
+    copied = [col for col in table_columns(con, 'metadata') if col not in values]
+    con.execute('INSERT INTO metadata ({}) SELECT {}{} FROM metadata ORDER BY rowid DESC LIMIT 1'.format(
+        ', '.join(quote(col) for col in list(values) + copied), ', '.join('?' * len(values)),
+        ''.join(', ' + quote(col) for col in copied)), list(values.values()))
+
+
+def update_fingerprints(con, profile):
+    # databases saved before fingerprints existed get them computed from their tables
+    if 'fingerprint' not in table_columns(con, 'isolates'):
+        con.execute('ALTER TABLE isolates ADD COLUMN fingerprint BLOB')
+    con.execute(FINGERPRINT_INDEX)
+    columns = [profile.get(field, '') for field in FINGERPRINT_FIELDS]
+    columns = [col for col in dict.fromkeys(columns) if col in table_columns(con, 'isolates')]
+    isolates = pd.read_sql_query('SELECT record_id{} FROM isolates WHERE fingerprint IS NULL'.format(
+        ''.join(', ' + quote(col) for col in columns)), con)
+    if not isolates.empty:
+        results = pd.read_sql_query(
+            'SELECT DISTINCT r.record_id, d.drug, s.sensitivity FROM results r '
+            'JOIN drugs d ON d.drug_id = r.drug_id JOIN sensitivities s ON s.sensitivity_id = r.sensitivity_id '
+            'WHERE r.record_id IN (SELECT record_id FROM isolates WHERE fingerprint IS NULL)', con)
+        positions = pd.Index(isolates['record_id']).get_indexer(results['record_id'])
+        digests = result_digests(positions, results['drug'], results['sensitivity'], len(isolates))
+        con.executemany('UPDATE isolates SET fingerprint = ? WHERE record_id = ?',
+                        zip(fingerprints(identity_digests(isolates, profile), digests),
+                            isolates['record_id'].tolist()))
+    con.commit()
+
+
+def _match_ids(new, existing, columns, id_col):
+    # ids of the new dimension rows in the database, adding the rows it does not have yet
+    merged = new[columns].merge(existing, on=columns, how='left')
+    missing = merged[id_col].isna().to_numpy()
+    start = int(existing[id_col].max()) + 1 if len(existing) else 0
+    merged.loc[missing, id_col] = np.arange(start, start + missing.sum())
+    ids = merged[id_col].astype('int64').to_numpy()
+    added = new[columns][missing].copy()
+    added.insert(0, id_col, ids[missing])
+    return ids, added
+
+
+def append_tables(con, tables, profile, source_path=None):
+    # adds the records whose fingerprint the database does not have, so loading
+    # an export that overlaps an earlier one adds only the new records
+    stored = read_profile(con)
+    changed = [field for field in FINGERPRINT_FIELDS if stored.get(field, '') != profile.get(field, '')]
+    if changed:
+        raise ValueError('The database was saved with different {} settings.'.format(', '.join(changed)))
+    isolates = tables['isolates']
+    existing_columns = table_columns(con, 'isolates')
+    extra = [col for col in isolates.columns if col not in existing_columns]
+    if extra:
+        raise ValueError('The database has no {} columns.'.format(', '.join(extra)))
+    update_fingerprints(con, stored)
+
+    con.execute('DROP TABLE IF EXISTS temp.incoming')
+    con.execute('CREATE TEMP TABLE incoming (fingerprint BLOB)')
+    con.executemany('INSERT INTO temp.incoming VALUES (?)', ((f,) for f in isolates['fingerprint']))
+    seen = {row[0] for row in con.execute(
+        'SELECT DISTINCT fingerprint FROM isolates WHERE fingerprint IN (SELECT fingerprint FROM temp.incoming)')}
+    con.execute('DROP TABLE temp.incoming')
+    # compared as python bytes, numpy would drop trailing zero bytes
+    isolates = isolates[[fingerprint not in seen for fingerprint in isolates['fingerprint']]]
+    if isolates.empty:
+        return 0, len(tables['isolates'])
+
+    organism_columns = ['organism'] + ORGANISM_COLUMNS
+    organism_ids, organisms = _match_ids(tables['organisms'], pd.read_sql_query(
+        'SELECT organism_id, {} FROM organisms'.format(', '.join(organism_columns)), con),
+        organism_columns, 'organism_id')
+    group_ids, drug_groups = _match_ids(tables['drug_groups'], pd.read_sql_query(
+        'SELECT drug_group_id, drug_group FROM drug_groups', con), ['drug_group'], 'drug_group_id')
+    drugs = tables['drugs'].assign(drug_group_id=group_ids[tables['drugs']['drug_group_id']])
+    drug_ids, drugs = _match_ids(drugs, pd.read_sql_query(
+        'SELECT drug_id, drug, drug_group_id FROM drugs', con), ['drug', 'drug_group_id'], 'drug_id')
+    sensitivity_ids, sensitivities = _match_ids(tables['sensitivities'], pd.read_sql_query(
+        'SELECT sensitivity_id, sensitivity FROM sensitivities', con), ['sensitivity'], 'sensitivity_id')
+
+    start = con.execute('SELECT COALESCE(MAX(record_id) + 1, 0) FROM isolates').fetchone()[0]
+    record_ids = pd.Series(np.arange(start, start + len(isolates)), index=isolates['record_id'].to_numpy())
+    results = tables['results']
+    results = results[results['record_id'].isin(record_ids.index)]
+    results = pd.DataFrame({
+        'record_id': record_ids.reindex(results['record_id']).to_numpy(),
+        'drug_id': drug_ids[results['drug_id']],
+        'sensitivity_id': sensitivity_ids[results['sensitivity_id']],
+    })
+    isolates = isolates.assign(record_id=record_ids.to_numpy(),
+                               organism_id=organism_ids[isolates['organism_id'].to_numpy()])
+    for name, frame in [('organisms', organisms), ('drug_groups', drug_groups), ('drugs', drugs),
+                        ('sensitivities', sensitivities), ('isolates', isolates), ('results', results)]:
+        insert_frame(con, name, frame)
+    if object_type(con, SUMMARY_TABLE) == 'table':
+        write_summary(con, isolates, results, stored, replace=False)
+    _add_metadata(con, stored, source_path)
+    con.commit()
+    con.execute('ANALYZE')
+    return len(isolates), len(tables['isolates']) - len(isolates)
+
+
+def _frame_digest(digest, frame):
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in frame.dtypes.items()]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+
+
+def partition_labels(isolates, date_col, grain):
+    return _format_dates(isolates, date_col, PARTITION_FORMATS[grain], UNDATED_PARTITION)
+
+
+def write_partitions(con, file_path, tables, metadata, grain):
+    # one database per year or month next to the catalog at file_path. A partition
+    # whose records did not change since the last save keeps its file, so saving
+    # again after editing a month only rewrites that month.
+    profile_json = metadata['profile_json'].iloc[-1]
+    date_col = json.loads(profile_json).get('date_col', '')
+    isolates = tables['isolates']
+    results = tables['results']
+    labels = partition_labels(isolates, date_col, grain)
+    # every partition counts over the same columns, a kept partition only when they did not change
+    summary_cols = summary_columns(isolates, json.loads(profile_json))
+    shared = blake2b(digest_size=16)
+    shared.update(profile_json.encode('utf-8'))
+    shared.update(repr(summary_cols).encode('utf-8'))
+    for name in SHARED_TABLES:
+        _frame_digest(shared, tables[name])
+    previous = {}
+    if is_catalog(con):
+        previous = {row[0]: row[1:] for row in
+                    con.execute('SELECT partition, file_name, digest FROM {}'.format(PARTITION_TABLE))}
+    folder, name = os.path.split(os.path.abspath(file_path))
+    stem, ext = os.path.splitext(name)
+    rows = []
+    written = 0
+    for label in sorted(set(labels)):
+        part = isolates[labels == label]
+        part_results = results[results['record_id'].isin(part['record_id'])]
+        digest = shared.copy()
+        # added_at and the fingerprints change with every save of the same records
+        _frame_digest(digest, part.drop(columns=['added_at', 'fingerprint'], errors='ignore'))
+        _frame_digest(digest, part_results)
+        digest = digest.hexdigest()
+        file_name = '{}_{}{}'.format(stem, label, ext)
+        part_path = os.path.join(folder, file_name)
+        if previous.get(label) != (file_name, digest) or not os.path.exists(part_path):
+            part_tables = OrderedDict(tables)
+            part_tables['isolates'] = part
+            part_tables['results'] = part_results
+            part_con = sqlite3.connect(part_path)
+            try:
+                with bulk_load(part_con):
+                    write_tables(part_con, part_tables, metadata, summary_cols)
+                create_indexes(part_con)
+            finally:
+                part_con.close()
+            written += 1
+        first_date = last_date = None
+        if label != UNDATED_PARTITION:
+            dates = pd.to_datetime(part[date_col], errors='coerce')
+            first_date = dates.min().strftime('%Y-%m-%d %H:%M:%S')
+            last_date = dates.max().strftime('%Y-%m-%d %H:%M:%S')
+        rows.append((label, file_name, first_date, last_date, len(part), digest))
+    con.commit()
+    con.execute('BEGIN')
+    # the catalog replaces whatever database was saved under its name before
+    drop_schema(con)
+    con.execute('CREATE TABLE {} (partition TEXT PRIMARY KEY, file_name TEXT, first_date TEXT, last_date TEXT, '
+                'records INTEGER, digest TEXT)'.format(PARTITION_TABLE))
+    con.executemany('INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?)'.format(PARTITION_TABLE), rows)
+    _write_metadata(con, metadata)
+    con.commit()
+    current = set(row[1] for row in rows)
+    for file_name, _ in previous.values():
+        stale = os.path.join(folder, file_name)
+        if file_name not in current and os.path.exists(stale):
+            os.remove(stale)
+    return written, len(rows)
+
+
+def partition_files(con, folder, start=None, end=None):
+    # the partitions that can hold records dated inside the window; the undated one
+    # only when there is no window
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('last_date >= ?')
+        params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+    if end is not None:
+        conditions.append('first_date < ?')
+        params.append((pd.Timestamp(end) + pd.Timedelta(days=1)).strftime('%Y-%m-%d'))
+    rows = con.execute('SELECT file_name FROM {}{} ORDER BY partition'.format(
+        PARTITION_TABLE, _where(conditions)), params).fetchall()
+    return [os.path.join(folder, row[0]) for row in rows]
+
+
+def detach_partitions(con):
+    for name in PARTITIONED_TABLES + SHARED_TABLES:
+        con.execute('DROP VIEW IF EXISTS temp.{}'.format(quote(name)))
+    for row in con.execute('PRAGMA database_list').fetchall():
+        if row[1].startswith('partition_'):
+            con.execute('DETACH DATABASE {}'.format(row[1]))
+
+
+def attach_partitions(con, files):
+    # points temp views named like the tables of a single database at the partitions
+    # in files, so every reader works on a catalog unchanged. The readers still filter
+    # by date, pruning only saves them from reading partitions for nothing.
+    attached = [row[2] for row in con.execute('PRAGMA database_list') if row[1].startswith('partition_')]
+    if [os.path.abspath(path) for path in attached] == [os.path.abspath(path) for path in files]:
+        return files
+    detach_partitions(con)
+    # more than MAX_ATTACHED raise an OperationalError, the callers read in batches
+    for index, path in enumerate(files):
+        con.execute('ATTACH DATABASE ? AS partition_{}'.format(index), (path,))
+    for name in PARTITIONED_TABLES:
+        con.execute('CREATE TEMP VIEW {} AS {}'.format(quote(name), ' UNION ALL '.join(
+            'SELECT * FROM partition_{}.{}'.format(index, quote(name)) for index in range(len(files)))))
+    for name in SHARED_TABLES:
+        con.execute('CREATE TEMP VIEW {0} AS SELECT * FROM partition_0.{0}'.format(quote(name)))
+    return files
@@ -0,0 +1,197 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+SIR_CATEGORIES = ['S', 'I', 'R']
+SIR_S = 0
+SIR_I = 1
+SIR_R = 2
+SIR_MISSING = -1
+CATEGORY_MAX_RATIO = 0.5
+
+
+def normalize_sensitivity(value):
+    if pd.isna(value):
+        return ''
+    return str(value).strip().upper()
+
+
+def is_sir_column(series):
+    return isinstance(series.dtype, pd.CategoricalDtype) \
+        and list(series.cat.categories[:len(SIR_CATEGORIES)]) == SIR_CATEGORIES
+
+
+def _sir_label(value):
+    return '' if pd.isna(value) else str(value)
+
+
+def encode_sir(series, normalize=False):
+    # S, I and R always get the codes 0, 1 and 2 so that the codes can be used
+    # directly as an int8 matrix; any other reported value is kept after them.
+    # Biograms count only exact S, I and R like the long format counts did, saves to
+    # a database strip and upper-case the results first like its export did.
+    if is_sir_column(series):
+        if not normalize or all(normalize_sensitivity(c) == c for c in series.cat.categories):
+            return series
+        series = series.astype(object)
+    codes, uniques = pd.factorize(series)
+    labels = [normalize_sensitivity(u) if normalize else _sir_label(u) for u in uniques]
+    extras = sorted({label for label in labels if label and label not in SIR_CATEGORIES})
+    categories = SIR_CATEGORIES + extras
+    position = {c: i for i, c in enumerate(categories)}
+    lookup = np.array([position.get(label, SIR_MISSING) for label in labels] + [SIR_MISSING],
+                      dtype=np.int32)
+    return pd.Series(pd.Categorical.from_codes(lookup[codes], categories=categories),
+                     index=series.index, name=series.name)
+
+
+def sir_codes(series):
+    return encode_sir(series).cat.codes.to_numpy()
+
+
+def _all_strings(series):
+    values = series.dropna()
+    if pd.api.types.is_string_dtype(values.dtype) and not pd.api.types.is_object_dtype(values.dtype):
+        return True
+    return values.map(type).eq(str).all()
+
+
+def encode_category(series, max_ratio=None):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    if not (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)):
+        return series
+    if not _all_strings(series):
+        return series
+    if max_ratio is not None and len(series) and series.nunique() > len(series) * max_ratio:
+        return series
+    return series.astype(object).astype('category')
+
+
+def encode_datetime(series):
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    return pd.to_datetime(series.replace('', np.nan), errors='coerce')
+
+
+def compact_frame(df, date_col=None, drug_cols=(), category_cols=()):
+    # a shallow copy is enough, every column is replaced rather than modified
+    df = df.copy(deep=False)
+    for col in df.columns:
+        if col == date_col:
+            df[col] = encode_datetime(df[col])
+        elif col in drug_cols:
+            df[col] = encode_sir(df[col])
+        elif col in category_cols:
+            df[col] = encode_category(df[col])
+        else:
+            df[col] = encode_category(df[col], max_ratio=CATEGORY_MAX_RATIO)
+    return df
+
+
+def _typed_like(part, dtype):
+    # a batch without a single value in a column gets its dtype inferred from nothing,
+    # it takes the one of the batches that have values instead
+    if part.notna().any() or part.dtype == dtype:
+        return part
+    if dtype.kind in 'iu':
+        dtype = np.dtype('float64')
+    try:
+        return part.astype(dtype)
+    except (TypeError, ValueError):
+        return part
+
+
+def concat_compact(frames):
+    # frames compacted on their own carry different categories, a plain concat
+    # would turn those columns back into objects
+    frames = list(frames)
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    data = {}
+    for col in frames[0].columns:
+        parts = [frame[col] for frame in frames]
+        typed = next((part.dtype for part in parts if part.notna().any()), None)
+        if typed is not None:
+            parts = [_typed_like(part, typed) for part in parts]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            try:
+                data[col] = pd.Series(union_categoricals(parts, sort_categories=True), name=col)
+                continue
+            except TypeError:
+                pass
+        data[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data, columns=frames[0].columns)
+
+
+def as_text(series):
+    # string view of a column with nulls rendered as '' like the old fillna('') frames
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    return series.where(series.notna(), '').astype(str)
+
+
+def add_category(series, value):
+    # keep the categories sorted so grouping orders labels like plain strings
+    series = series.cat.add_categories([value])
+    if is_sir_column(series):
+        return series
+    try:
+        return series.cat.reorder_categories(sorted(series.cat.categories))
+    except TypeError:
+        return series
+
+
+def fill_missing_labels(df, columns):
+    df = df.copy(deep=False)
+    for col in columns:
+        if col not in df.columns or not df[col].isna().any():
+            continue
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            if '' not in series.cat.categories:
+                series = add_category(series, '')
+            df[col] = series.fillna('')
+        else:
+            df[col] = series.astype(object).fillna('')
+    return df
+
+
+def map_values(series, lookup):
+    # the lookup is applied to the distinct values only and then broadcast by code
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    missing = next((v for k, v in lookup.items() if pd.isna(k)), None)
+    mapped = pd.Series([missing if pd.isna(u) else lookup.get(u) for u in uniques], dtype=object)
+    result = pd.Series(mapped.to_numpy()[codes], index=series.index, name=series.name)
+    return encode_category(result)
+
+
+def coerce_value(series, value):
+    if isinstance(value, str) and not value.strip():
+        return np.nan
+    if is_sir_column(series):
+        return _sir_label(value)
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return pd.to_datetime(value, errors='coerce')
+    if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+        number = pd.to_numeric(value, errors='coerce')
+        return value if pd.isna(number) else number
+    return value
+
+
+def set_cell(df, position, column, value):
+    series = df[column]
+    value = coerce_value(series, value)
+    if isinstance(series.dtype, pd.CategoricalDtype) and not pd.isna(value) \
+            and value not in series.cat.categories:
+        df[column] = add_category(series, value)
+    elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_numeric_dtype(type(value)) \
+            and not pd.isna(value):
+        df[column] = series.astype(object)
+    df.iloc[position, df.columns.get_loc(column)] = value
+    return df
@@ -0,0 +1,176 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+import wx
+import numpy as np
+import pandas as pd
+
+
+def column_reader(series):
+    # returns a position -> value accessor that does not materialize the column
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        categories = series.cat.categories.to_numpy(dtype=object)
+        return lambda pos: categories[codes[pos]] if codes[pos] >= 0 else None
+    values = series.to_numpy()
+    if values.dtype.kind == 'M':
+        return lambda pos: pd.Timestamp(values[pos])
+    return values.__getitem__
+
+
+class DataFrameListCtrl(wx.ListCtrl):
+    def __init__(self, parent, cache_size=1000):
+        super(DataFrameListCtrl, self).__init__(parent, wx.ID_ANY,
+                                                style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.SUNKEN_BORDER)
+        self.cache_size = cache_size
+        self.columns = []
+        self.formatters = []
+        self.edit_handler = None
+        self._chunks = []
+        self._offsets = []
+        self._order = None
+        self._sort = None
+        self._cache = OrderedDict()
+        self.odd_attr = wx.ItemAttr()
+        self.odd_attr.SetBackgroundColour(wx.Colour(230, 230, 230, 100))
+        self.even_attr = wx.ItemAttr()
+        self.even_attr.SetBackgroundColour(wx.WHITE)
+        self.empty_msg = wx.StaticText(self, label='', style=wx.ALIGN_CENTER_HORIZONTAL)
+        self.Bind(wx.EVT_LIST_CACHE_HINT, self.on_cache_hint)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.on_col_click)
+        self.Bind(wx.EVT_LEFT_DCLICK, self.on_double_click)
+        self.Bind(wx.EVT_SIZE, self.on_size)
+
+    def SetEmptyListMsg(self, msg):
+        self.empty_msg.SetLabel(msg)
+        self._update_empty_msg()
+
+    def _update_empty_msg(self):
+        self.empty_msg.Show(self.GetItemCount() == 0)
+        self.on_size(None)
+
+    def on_size(self, event):
+        if event is not None:
+            event.Skip()
+        width, height = self.GetClientSize()
+        self.empty_msg.SetSize(0, int(height / 3), width, height)
+
+    def set_columns(self, columns, formatters):
+        self.ClearAll()
+        self.columns = list(columns)
+        self.formatters = list(formatters)
+        for col in self.columns:
+            self.AppendColumn(str(col).title(), width=wx.LIST_AUTOSIZE_USEHEADER)
+        self.refresh()
+
+    def add_column(self, col, formatter):
+        self.columns.append(col)
+        self.formatters.append(formatter)
+        self.AppendColumn(str(col), width=wx.LIST_AUTOSIZE_USEHEADER)
+        self.refresh()
+
+    def _readers(self, df):
+        return [column_reader(df[c]) if c in df.columns else (lambda pos: None) for c in self.columns]
+
+    def set_frame(self, df):
+        self._chunks = []
+        self._offsets = []
+        self._order = None
+        if not df.empty:
+            self._chunks.append((df, self._readers(df)))
+            self._offsets.append(0)
+            # an edited frame keeps the sort the user picked
+            if self._sort is not None and self._sort[0] in df.columns:
+                self._order = self._sorted_order(df, *self._sort)
+        if self._order is None:
+            self._sort = None
+        self.refresh()
+
+    def append_frame(self, df):
+        if df.empty:
+            return
+        self._offsets.append(self.row_count())
+        self._chunks.append((df, self._readers(df)))
+        self.refresh()
+
+    def row_count(self):
+        if not self._chunks:
+            return 0
+        return self._offsets[-1] + len(self._chunks[-1][0])
+
+    def position(self, item):
+        if self._order is not None:
+            return self._order[item]
+        return item
+
+    def locate(self, item):
+        pos = self.position(item)
+        chunk = bisect_right(self._offsets, pos) - 1
+        return chunk, pos - self._offsets[chunk]
+
+    def refresh(self):
+        self._cache.clear()
+        count = self.row_count()
+        self.SetItemCount(count)
+        if count:
+            self.RefreshItems(0, count - 1)
+        self._update_empty_msg()
+
+    def render_row(self, item):
+        row = self._cache.get(item)
+        if row is not None:
+            self._cache.move_to_end(item)
+            return row
+        chunk, pos = self.locate(item)
+        readers = self._chunks[chunk][1]
+        row = [formatter(reader(pos)) for reader, formatter in zip(readers, self.formatters)]
+        self._cache[item] = row
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return row
+
+    def on_cache_hint(self, event):
+        for item in range(event.GetCacheFrom(), min(event.GetCacheTo() + 1, self.row_count())):
+            self.render_row(item)
+
+    def OnGetItemText(self, item, col):
+        return self.render_row(item)[col]
+
+    def OnGetItemAttr(self, item):
+        return self.odd_attr if item % 2 else self.even_attr
+
+    def _sorted_order(self, df, col, descending):
+        series = df[col]
+        try:
+            order = np.argsort(series.to_numpy(), kind='stable') \
+                if not isinstance(series.dtype, pd.CategoricalDtype) \
+                else np.argsort(series.cat.codes.to_numpy(), kind='stable')
+        except TypeError:
+            return None
+        return order[::-1] if descending else order
+
+    def on_col_click(self, event):
+        if len(self._chunks) != 1:
+            return
+        df = self._chunks[0][0]
+        col = self.columns[event.GetColumn()]
+        descending = self._sort == (col, False)
+        order = self._sorted_order(df, col, descending)
+        if order is None:
+            return
+        self._order = order
+        self._sort = (col, descending)
+        self.refresh()
+
+    def on_double_click(self, event):
+        item, flags, col = self.HitTestSubItem(event.GetPosition())
+        if item == wx.NOT_FOUND or col < 0 or self.edit_handler is None:
+            event.Skip()
+            return
+        chunk, pos = self.locate(item)
+        with wx.TextEntryDialog(self, 'New value for {}'.format(self.columns[col]), 'Edit Value',
+                                value=self.render_row(item)[col]) as dlg:
+            if dlg.ShowModal() != wx.ID_OK:
+                return
+            value = dlg.GetValue()
+        self.edit_handler(self._offsets[chunk] + pos, self.columns[col], value)
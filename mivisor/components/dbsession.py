@@ -0,0 +1,216 @@
+import os
+import sys
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from components.database import (MAX_ATTACHED, antibiogram_counts, attach_partitions, column_expressions,
+                                  date_bounds, dedup_summary, detach_partitions, distinct_values, heatmap_counts,
+                                  is_catalog, kept_records, kept_summary, merge_counts, merge_heatmap_counts,
+                                  merge_record_keys, partition_files, read_facts, read_profile, record_keys)
+from components.dataset import concat_compact
+from components.resultcache import file_stamp
+
+
+# the records a read needs: every partition of a catalog, the partitions of a date
+# window, any one partition for reads of the schema only, or none for reads answered
+# by the catalog itself or from other cached values
+ALL_RECORDS = None
+SCHEMA_ONLY = 'schema'
+NO_RECORDS = 'none'
+DEFAULT_SESSION_CACHE_LIMIT = 128 * 1024 * 1024
+
+
+def value_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_nbytes(k) + value_nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(value_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _query_key(query):
+    return tuple(sorted((name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+                        for name, value in query.items()))
+
+
+def _window(query):
+    # the readers apply a window only on a date column
+    if not query.get('date_col') or (query.get('start') is None and query.get('end') is None):
+        return ALL_RECORDS
+    return query.get('start'), query.get('end')
+
+
+def _merge_values(parts):
+    return sorted(set().union(*parts))
+
+
+class DatabaseSession(object):
+    # a connected database: one connection for every menu action, and everything read
+    # from the file kept until the file changes on disk
+    def __init__(self, file_path, limit=DEFAULT_SESSION_CACHE_LIMIT):
+        self.file_path = os.path.abspath(file_path)
+        self.limit = limit
+        # the generator threads query through the same connection, one at a time
+        self.con = sqlite3.connect(self.file_path, check_same_thread=False)
+        self.stamp = file_stamp(self.file_path)
+        # least recently used first, with the size of every value
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+        self.partitioned = is_catalog(self.con)
+
+    @property
+    def name(self):
+        return os.path.basename(self.file_path)
+
+    def refresh(self):
+        # size and mtime change with every write, including the app's own saves
+        stamp = file_stamp(self.file_path)
+        if stamp != self.stamp:
+            self.stamp = stamp
+            self._clear()
+            # a database saved over a catalog, or the other way around
+            detach_partitions(self.con)
+            self.partitioned = is_catalog(self.con)
+        return stamp
+
+    def cached(self, key, read, records=ALL_RECORDS, merge=None):
+        # reads that depend on other cached values get them before calling, the
+        # partitions attached here are the ones of this read only. A read over more
+        # partitions than SQLite attaches at once runs once per batch of partitions
+        # and `merge` combines the values of the batches.
+        with self._lock:
+            self.refresh()
+            if key in self._values:
+                self._values.move_to_end(key)
+                return self._values[key][0]
+            values = []
+            for files in self._batches(records):
+                if files is not None:
+                    attach_partitions(self.con, files)
+                # committed right away, an open transaction would lock out writers
+                with self.con:
+                    values.append(read(self.con))
+            value = values[0] if len(values) == 1 else merge(values)
+            self._remember(key, value)
+            return value
+
+    def _remember(self, key, value):
+        nbytes = value_nbytes(value)
+        if nbytes > self.limit:
+            return
+        self._values[key] = (value, nbytes)
+        self._size += nbytes
+        while self._size > self.limit:
+            _, (_, evicted) = self._values.popitem(last=False)
+            self._size -= evicted
+
+    def _clear(self):
+        self._values.clear()
+        self._size = 0
+
+    def _files(self, records):
+        folder = os.path.dirname(self.file_path)
+        files = partition_files(self.con, folder, *(records or ())) if records != SCHEMA_ONLY else []
+        # a window without records still reads the tables of one partition
+        return files or partition_files(self.con, folder)[:1]
+
+    def _batches(self, records):
+        if not self.partitioned or records == NO_RECORDS:
+            return [None]
+        files = self._files(records)
+        return [files[start:start + MAX_ATTACHED] for start in range(0, max(len(files), 1), MAX_ATTACHED)]
+
+    def _spans_batches(self, records):
+        with self._lock:
+            self.refresh()
+            return len(self._batches(records)) > 1
+
+    def close(self):
+        with self._lock:
+            self._clear()
+            self.con.close()
+
+    def profile(self):
+        # a catalog keeps the metadata of its partitions
+        return self.cached(('profile',), read_profile, NO_RECORDS if self.partitioned else SCHEMA_ONLY)
+
+    def expressions(self):
+        profile = self.profile()
+        return self.cached(('expressions',), lambda con: column_expressions(con, profile), SCHEMA_ONLY)
+
+    def date_bounds(self, date_col):
+        expressions = self.expressions()
+        # a catalog has the dates of every partition
+        return self.cached(('date_bounds', date_col), lambda con: date_bounds(con, expressions, date_col),
+                           NO_RECORDS if self.partitioned else SCHEMA_ONLY)
+
+    def distinct_values(self, column, **query):
+        expressions = self.expressions()
+        return self.cached(('distinct_values', column, _query_key(query)),
+                           lambda con: distinct_values(con, expressions, column, **query), _window(query),
+                           merge=_merge_values)
+
+    def record_keys(self, keys, date_col=None):
+        expressions = self.expressions()
+        return self.cached(('record_keys', tuple(keys), date_col),
+                           lambda con: record_keys(con, expressions, keys, date_col), merge=merge_record_keys)
+
+    def kept(self, keys, date_col=None, window=0):
+        # the kept records of the whole history, deduplicated with numpy over the record keys
+        records = self.record_keys(keys, date_col)
+        return self.cached(('kept', tuple(keys), date_col, window), lambda con: kept_records(records, window),
+                           NO_RECORDS)
+
+    def _kept_for(self, keys, date_col, sort_by_date, window):
+        # episodes always need the kept records, first records only when the partitions
+        # cannot be attached at once for SQL to find them
+        if keys and window > 0 and date_col in self.expressions():
+            return self.kept(keys, date_col, window)
+        if keys and self._spans_batches(ALL_RECORDS):
+            return self.kept(keys, date_col if sort_by_date and date_col in self.expressions() else None)
+        return None
+
+    def dedup_summary(self, keys, date_col=None, episode_days=0):
+        expressions = self.expressions()
+        if self._spans_batches(ALL_RECORDS):
+            episodes = episode_days > 0 and date_col in expressions
+            records = self.record_keys(keys, date_col if episodes else None)
+            kept = self.kept(keys, date_col if episodes else None, episode_days if episodes else 0)
+            return self.cached(('dedup_summary', tuple(keys), date_col, episode_days),
+                               lambda con: kept_summary(records, kept), NO_RECORDS)
+        episodes = self._kept_for(keys, date_col, False, episode_days)
+        return self.cached(('dedup_summary', tuple(keys), date_col, episode_days), lambda con: dedup_summary(
+            con, expressions, keys, date_col, episode_days, episodes=episodes))
+
+    def antibiogram_counts(self, indexes, **query):
+        expressions = self.expressions()
+        kept = self._kept_for(query.get('dedup_keys', ()), query.get('date_col'), query.get('sort_by_date'),
+                              query.get('episode_days', 0))
+        # the first isolate of a patient can lie before the window, so counts deduplicated
+        # in SQL read every partition, counts of kept records found before only the window
+        records = ALL_RECORDS if query.get('dedup_keys') and kept is None else _window(query)
+        min_isolates = query.get('min_isolates', 0)
+        read_query = dict(query, min_isolates=0) if self._spans_batches(records) else query
+        return self.cached(('antibiogram_counts', tuple(indexes), _query_key(query)), lambda con: antibiogram_counts(
+            con, expressions, indexes, kept=kept, **read_query), records,
+            merge=lambda parts: merge_counts(parts, indexes, min_isolates))
+
+    def heatmap_counts(self, row_field, **query):
+        expressions = self.expressions()
+        return self.cached(('heatmap_counts', row_field, _query_key(query)),
+                           lambda con: heatmap_counts(con, expressions, row_field, **query), _window(query),
+                           merge=lambda parts: merge_heatmap_counts(parts, row_field))
+
+    def facts(self, columns, **query):
+        expressions = self.expressions()
+        return self.cached(('facts', tuple(columns), _query_key(query)),
+                           lambda con: concat_compact(read_facts(con, expressions, columns, **query)), _window(query),
+                           merge=concat_compact)
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+from components.biogram import NO_DAY, day_numbers
+
+
+NO_RANK = np.iinfo('int64').max
+
+
+def _column_codes(series):
+    # missing values get a code of their own so they count as a key like in drop_duplicates
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy().astype('int64') + 1, len(series.cat.categories) + 1
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    return codes.astype('int64') + 1, len(uniques) + 1
+
+
+def key_codes(df, subset):
+    # codes of the combined key built from the codes of every column, hashed
+    # again only when they get too sparse to index arrays with
+    combined = np.zeros(len(df), dtype='int64')
+    size = 1
+    for col in subset:
+        codes, count = _column_codes(df[col])
+        if size * count >= 2 ** 62:
+            combined, uniques = pd.factorize(combined)
+            size = len(uniques)
+        combined = combined * count + codes
+        size *= count
+    if size > 2 * len(df) + 1:
+        combined = pd.factorize(combined)[0]
+    return combined
+
+
+def _date_ranks(series):
+    # smaller is earlier, missing dates rank last like sort_values(na_position='last')
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        ranks = series.to_numpy().view('int64').copy()
+        ranks[series.isna().to_numpy()] = NO_RANK
+        return ranks
+    ranks, _ = pd.factorize(series, sort=True)
+    ranks = ranks.astype('int64')
+    ranks[ranks < 0] = NO_RANK
+    return ranks
+
+
+def first_records(codes, ranks=None):
+    # the earliest record of every key, ties going to the first loaded one, so the
+    # result matches a stable sort by date followed by drop_duplicates(keep='first')
+    size = codes.max() + 1 if len(codes) else 0
+    candidates = np.arange(len(codes))
+    if ranks is not None:
+        earliest = np.full(size, NO_RANK)
+        np.minimum.at(earliest, codes, ranks)
+        candidates = candidates[ranks == earliest[codes]]
+    first = np.full(size, len(codes))
+    np.minimum.at(first, codes[candidates], candidates)
+    keep = np.zeros(len(codes), dtype=bool)
+    keep[first[first < len(codes)]] = True
+    return keep
+
+
+def first_isolates(codes, days, window):
+    # first isolate of every key per episode of `window` days: an isolate opens a new
+    # episode when it comes at least `window` days after the one that opened the last
+    # episode. Keys advance together, one episode per pass, so the number of passes is
+    # the largest number of episodes of a single key rather than the number of keys.
+    keep = np.zeros(len(codes), dtype=bool)
+    dated = np.flatnonzero(days != NO_DAY)
+    if len(dated):
+        # one integer per isolate ordering by key then day, so a single searchsorted
+        # finds the next episode of every key
+        offsets = days[dated] - days[dated].min()
+        composite = codes[dated] * (offsets.max() + window + 1) + offsets
+        order = np.argsort(composite, kind='stable')
+        composite = composite[order]
+        order = dated[order]
+        groups = codes[order]
+        kept = np.zeros(len(order), dtype=bool)
+        current = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        while len(current):
+            kept[current] = True
+            following = np.searchsorted(composite, composite[current] + window, side='left')
+            inside = following < len(order)
+            current, following = current[inside], following[inside]
+            current = following[groups[following] == groups[current]]
+        keep[order[kept]] = True
+    # a key without any dated isolate still keeps its first record
+    undated = np.flatnonzero(days == NO_DAY)
+    if len(undated):
+        has_dated = np.zeros(codes.max() + 1, dtype=bool)
+        has_dated[codes[dated]] = True
+        undated = undated[~has_dated[codes[undated]]]
+        keep[undated[first_records(codes[undated])]] = True
+    return keep
+
+
+def _keep_mask(codes, dates, window=0):
+    if dates is not None and window > 0:
+        return first_isolates(codes, day_numbers(dates), window)
+    return first_records(codes, _date_ranks(dates) if dates is not None else None)
+
+
+def duplicate_stats(df, subset, codes, keep):
+    # the number of records behind every key that had duplicates, largest first
+    kept_rows = np.flatnonzero(keep)
+    firsts = kept_rows[first_records(codes[kept_rows])] if len(kept_rows) else kept_rows
+    records = np.bincount(codes)
+    kept = np.bincount(codes[kept_rows], minlength=len(records))
+    stats = df[list(subset)].iloc[firsts].reset_index(drop=True)
+    stats['records'] = records[codes[firsts]]
+    stats['duplicates'] = stats['records'] - kept[codes[firsts]]
+    stats = stats[stats['duplicates'] > 0]
+    return stats.sort_values('duplicates', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def find_duplicates(df, subset, date_col=None, window=0):
+    subset = list(subset)
+    if not subset:
+        return np.ones(len(df), dtype=bool), pd.DataFrame(columns=['records', 'duplicates'])
+    codes = key_codes(df, subset)
+    keep = _keep_mask(codes, df[date_col] if date_col else None, window)
+    return keep, duplicate_stats(df, subset, codes, keep)
+
+
+def deduplicate(df, subset, date_col=None, window=0):
+    # keeps the first record of every key, the earliest one when sorted by date,
+    # or the first one of every `window` days episode when a window is given
+    if not subset:
+        return df
+    return df[_keep_mask(key_codes(df, list(subset)), df[date_col] if date_col else None, window)]
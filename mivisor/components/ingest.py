@@ -0,0 +1,160 @@
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from components.dataset import concat_compact
+
+
+DEFAULT_BATCH_SIZE = 5000
+SOURCE_FILE_COLUMN = 'SOURCE_FILE'
+
+
+def normalize_headers(values):
+    values = list(values)
+    while values and values[-1] is None:
+        values.pop()
+    headers = []
+    seen = {}
+    for i, value in enumerate(values):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            name = 'Unnamed: {}'.format(i)
+        else:
+            name = value if isinstance(value, str) else str(value)
+        # mimic pandas.read_excel, which mangles duplicated headers to "A", "A.1", ...
+        if name in seen:
+            seen[name] += 1
+            mangled = '{}.{}'.format(name, seen[name])
+            while mangled in seen:
+                seen[name] += 1
+                mangled = '{}.{}'.format(name, seen[name])
+            seen[mangled] = 0
+            name = mangled
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+
+def list_sheets(filepath):
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def _get_sheet(wb, sheet_name):
+    if sheet_name is None:
+        return wb.worksheets[0]
+    return wb[sheet_name]
+
+
+def count_sheet_rows(filepath, sheet_name=None):
+    # The row count comes from the sheet's <dimension> record, so it is cheap
+    # but may be missing (None) for files written by some exporters.
+    wb = load_workbook(filepath, read_only=True)
+    try:
+        ws = _get_sheet(wb, sheet_name)
+        if ws.max_row is None:
+            return None
+        return max(ws.max_row - 1, 0)
+    finally:
+        wb.close()
+
+
+def _make_frame(rows, columns, offset):
+    width = len(columns)
+    rows = [row[:width] if len(row) >= width else row + (None,) * (width - len(row))
+            for row in rows]
+    return pd.DataFrame.from_records(rows, columns=columns,
+                                     index=pd.RangeIndex(offset, offset + len(rows)))
+
+
+def iter_excel_batches(filepath, sheet_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    wb = load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        ws = _get_sheet(wb, sheet_name)
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = normalize_headers(header)
+        if not columns:
+            return
+        offset = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield _make_frame(batch, columns, offset)
+                offset += len(batch)
+                batch = []
+        if batch:
+            yield _make_frame(batch, columns, offset)
+    finally:
+        wb.close()
+
+
+def read_excel_streaming(filepath, sheet_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    batches = [batch.dropna(how='all')
+               for batch in iter_excel_batches(filepath, sheet_name, batch_size)]
+    # dtypes are inferred per batch, concat_compact settles columns left empty in some of them
+    return concat_compact(batches)
+
+
+def read_sheet(filepath, sheet_name=None, batch_size=DEFAULT_BATCH_SIZE):
+    # module level so that it can be pickled into worker processes
+    return filepath, sheet_name, read_excel_streaming(filepath, sheet_name, batch_size)
+
+
+def _header_key(column):
+    if isinstance(column, str):
+        return ' '.join(column.split()).upper()
+    return column
+
+
+def reconcile_columns(frames):
+    canonical = {}
+    columns = []
+    renamed = []
+    for df in frames:
+        mapping = {}
+        used = set()
+        for column in df.columns:
+            key = _header_key(column)
+            target = canonical.setdefault(key, column)
+            if target in used:
+                # two headers of the same sheet only differ by case/spacing, keep both
+                target = column
+            if target not in columns:
+                columns.append(target)
+            mapping[column] = target
+            used.add(target)
+        renamed.append(df.rename(columns=mapping))
+    return renamed, columns
+
+
+def source_label(filepath, sheet_name, sheet_count):
+    name = os.path.basename(filepath)
+    if sheet_name is None or sheet_count <= 1:
+        return name
+    return '{}:{}'.format(name, sheet_name)
+
+
+def combine_sources(results):
+    sheet_counts = {}
+    for filepath, _, _ in results:
+        sheet_counts[filepath] = sheet_counts.get(filepath, 0) + 1
+    frames = []
+    for filepath, sheet_name, df in results:
+        if df.empty:
+            continue
+        df = df.copy()
+        df[SOURCE_FILE_COLUMN] = source_label(filepath, sheet_name, sheet_counts[filepath])
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    frames, columns = reconcile_columns(frames)
+    columns = [c for c in columns if c != SOURCE_FILE_COLUMN] + [SOURCE_FILE_COLUMN]
+    return pd.concat(frames, ignore_index=True)[columns]
@@ -0,0 +1,182 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_DIR = os.path.join('appdata', 'cache', 'frames')
+DEFAULT_CACHE_LIMIT = 1024 * 1024 * 1024
+MANIFEST_FILE = 'manifest.json'
+CACHE_FORMAT_VERSION = 1
+
+
+def file_fingerprint(filepath, chunk_size=1024 * 1024):
+    filepath = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+    content = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            content.update(chunk)
+    fingerprint = {
+        'path': filepath,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'content_hash': content.hexdigest(),
+    }
+    key = '|'.join(str(fingerprint[k]) for k in ['path', 'size', 'mtime_ns', 'content_hash'])
+    fingerprint['key'] = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+    return fingerprint
+
+
+def _is_string_column(series):
+    if pd.api.types.is_string_dtype(series.dtype) and not pd.api.types.is_object_dtype(series.dtype):
+        return True
+    if not pd.api.types.is_object_dtype(series.dtype):
+        return False
+    values = series.dropna()
+    return values.map(type).eq(str).all()
+
+
+def _save_column(entry_dir, position, series):
+    filename = 'c{}.npy'.format(position)
+    column = {'name': series.name, 'file': filename}
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        column['kind'] = 'category'
+        np.save(os.path.join(entry_dir, filename), series.cat.codes.to_numpy())
+        column['categories'] = 'k{}.npy'.format(position)
+        categories = series.cat.categories
+        if all(isinstance(c, str) for c in categories):
+            np.save(os.path.join(entry_dir, column['categories']), categories.to_numpy(dtype=str))
+        else:
+            np.save(os.path.join(entry_dir, column['categories']),
+                    categories.to_numpy(dtype=object), allow_pickle=True)
+            column['pickled'] = True
+    elif (pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype)) \
+            and isinstance(series.dtype, np.dtype):
+        column['kind'] = 'numeric'
+        np.save(os.path.join(entry_dir, filename), series.to_numpy())
+    elif isinstance(series.dtype, np.dtype) and series.dtype.kind == 'M':
+        column['kind'] = 'datetime'
+        np.save(os.path.join(entry_dir, filename), series.to_numpy())
+    elif _is_string_column(series):
+        # strings are dictionary encoded so both arrays stay fixed-width and mappable
+        column['kind'] = 'string'
+        codes, uniques = pd.factorize(series)
+        column['categories'] = 'k{}.npy'.format(position)
+        np.save(os.path.join(entry_dir, filename), codes.astype(np.int32))
+        np.save(os.path.join(entry_dir, column['categories']), np.asarray(uniques, dtype=str))
+    else:
+        column['kind'] = 'object'
+        np.save(os.path.join(entry_dir, filename), series.to_numpy(dtype=object), allow_pickle=True)
+    return column
+
+
+def _load_column(entry_dir, column):
+    path = os.path.join(entry_dir, column['file'])
+    kind = column['kind']
+    if kind == 'object':
+        return np.load(path, allow_pickle=True)
+    values = np.load(path, mmap_mode='r')
+    if kind in ('numeric', 'datetime'):
+        return values
+    categories = np.load(os.path.join(entry_dir, column['categories']),
+                         allow_pickle=column.get('pickled', False))
+    if kind == 'category':
+        return pd.Categorical.from_codes(values, categories=categories)
+    lookup = np.append(categories.astype(object), np.nan)
+    return lookup[np.where(values < 0, len(categories), values)]
+
+
+class LoadCache(object):
+    def __init__(self, cache_dir=CACHE_DIR, limit=DEFAULT_CACHE_LIMIT):
+        self.cache_dir = cache_dir
+        self.limit = limit
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = self._entry_dir(name)
+            manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+            if not os.path.isfile(manifest_path):
+                continue
+            nbytes = sum(os.path.getsize(os.path.join(entry_dir, f)) for f in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(manifest_path), nbytes, entry_dir))
+        return entries
+
+    def size(self):
+        return sum(nbytes for _, nbytes, _ in self._entries())
+
+    def get(self, fingerprint):
+        entry_dir = self._entry_dir(fingerprint['key'])
+        manifest_path = os.path.join(entry_dir, MANIFEST_FILE)
+        if not os.path.isfile(manifest_path):
+            return None
+        try:
+            with open(manifest_path) as fp:
+                manifest = json.load(fp)
+            if manifest.get('format_version') != CACHE_FORMAT_VERSION \
+                    or manifest.get('fingerprint', {}).get('content_hash') != fingerprint['content_hash']:
+                return None
+            data = {column['name']: _load_column(entry_dir, column) for column in manifest['columns']}
+            index = np.load(os.path.join(entry_dir, manifest['index']), mmap_mode='r')
+            df = pd.DataFrame(data, index=pd.Index(index), columns=[c['name'] for c in manifest['columns']],
+                              copy=False)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        # the manifest's mtime doubles as the last access time used for eviction
+        os.utime(manifest_path)
+        return df
+
+    def put(self, fingerprint, df):
+        if df.columns.duplicated().any() or not all(isinstance(c, str) for c in df.columns):
+            return False
+        entry_dir = self._entry_dir(fingerprint['key'])
+        tmp_dir = entry_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            os.makedirs(tmp_dir)
+            columns = [_save_column(tmp_dir, i, df[c]) for i, c in enumerate(df.columns)]
+            np.save(os.path.join(tmp_dir, 'index.npy'), df.index.to_numpy(dtype=np.int64))
+            with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as fp:
+                json.dump({
+                    'format_version': CACHE_FORMAT_VERSION,
+                    'fingerprint': fingerprint,
+                    'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                    'index': 'index.npy',
+                    'columns': columns,
+                }, fp)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+        except (OSError, ValueError, TypeError):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        self.evict(keep=entry_dir)
+        return True
+
+    def evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, entry_dir in entries:
+            if total <= self.limit:
+                break
+            if entry_dir == keep:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= nbytes
+
+    def clear(self):
+        removed = 0
+        for _, nbytes, entry_dir in self._entries():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            removed += nbytes
+        return removed
@@ -1,7 +1,9 @@
 import os
 import sys
+import glob
 import json
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 import wx
@@ -12,18 +14,39 @@ import xlsxwriter
 if hasattr(wx, 'ItemAttr'):
     wx.ListItemAttr = wx.ItemAttr
 
-from ObjectListView import ObjectListView, ColumnDefn, FastObjectListView
+from ObjectListView import ObjectListView, ColumnDefn
 from threading import Thread
 from pubsub import pub
 
 from components.drug_dialog import DrugRegFormDialog
+from components.ingest import (DEFAULT_BATCH_SIZE, combine_sources, count_sheet_rows,
+                               iter_excel_batches, list_sheets, read_sheet)
+from components.loadcache import LoadCache, file_fingerprint
+from components.dataset import (compact_frame, concat_compact, map_values,
+                                set_cell)
+from components.dataview import DataFrameListCtrl
+from components.biogram import (ORGANISM_FIELDS, PARALLEL_MIN_ROWS, AggregationCube, annotate_organisms,
+                                biogram_counts, cube_dimensions, drug_pairs_for, filter_date_range, narst_frame)
+from components.resultcache import (RESULT_CACHE_DIR, ResultCache, file_stamp, frame_fingerprint,
+                                    result_key)
+from components.dedup import deduplicate, find_duplicates
+from components.reports import check_reports, group_by_dedup, load_report_spec, report_dedup, write_workbook
+from components.database import (DATABASE_SCHEMA_VERSION, FACT_COLUMNS, PARTITION_FORMATS,
+                                  append_tables, build_summary, build_tables, bulk_load, catalog_summary_columns,
+                                  create_indexes, is_catalog, migrate_database, partition_files, read_profile,
+                                  record_columns, schema_version, write_partitions, write_tables)
+from components.dbsession import DatabaseSession
 
 
 CLOSE_PROGRESS_BAR_SIGNAL = 'close-progressbar'
 WRITE_TO_EXCEL_FILE_SIGNAL = 'write-to-excel-file'
 ENABLE_BUTTONS = 'enable-buttons'
 DISABLE_BUTTONS = 'disable-buttons'
-DATABASE_SCHEMA_VERSION = 1
+LOAD_BATCH_SIGNAL = 'load-batch'
+LOAD_PROGRESS_SIGNAL = 'load-progress'
+LOAD_FAILED_SIGNAL = 'load-failed'
+REPORT_PROGRESS_SIGNAL = 'report-progress'
+REPORT_FINISHED_SIGNAL = 'report-finished'
 
 
 def patch_object_list_view():
@@ -66,22 +89,130 @@ class PulseProgressBarDialog(wx.ProgressDialog):
         self.Update(self.GetRange())
 
 
+class RowProgressDialog(wx.ProgressDialog):
+    def __init__(self, title, message, total_rows=None):
+        super(RowProgressDialog, self)\
+            .__init__(title, message, maximum=total_rows or 100,
+                      style=wx.PD_AUTO_HIDE | wx.PD_APP_MODAL | wx.PD_ELAPSED_TIME)
+        self._message = message
+        pub.subscribe(self.close, CLOSE_PROGRESS_BAR_SIGNAL)
+
+    def update_rows(self, rows_read, total_rows=None):
+        message = '{}\n{:,} rows read'.format(self._message, rows_read)
+        if total_rows:
+            if self.GetRange() != total_rows:
+                self.SetRange(total_rows)
+            message = '{}\n{:,} of {:,} rows read'.format(self._message, rows_read, total_rows)
+            # keep the dialog open until the loader says it is done
+            self.Update(min(rows_read, total_rows - 1), message)
+        else:
+            self.Pulse(message)
+
+    def close(self):
+        pub.unsubscribe(self.close, CLOSE_PROGRESS_BAR_SIGNAL)
+        self.Update(self.GetRange())
+
+
 class ReadExcelThread(Thread):
-    def __init__(self, filepath, message):
+    def __init__(self, filepath, message, batch_size=DEFAULT_BATCH_SIZE, cache=None, compact=None):
         super(ReadExcelThread, self).__init__()
         self._filepath = filepath
         self._message = message
+        self._batch_size = batch_size
+        self._cache = cache
+        self._compact = compact
+        self.start()
+
+    def run(self):
+        fingerprint = None
+        if self._cache is not None:
+            try:
+                fingerprint = file_fingerprint(self._filepath)
+                df = self._cache.get(fingerprint)
+            except OSError:
+                df = None
+            if df is not None:
+                wx.CallAfter(pub.sendMessage, self._message, df=df)
+                return
+
+        total_rows = count_sheet_rows(self._filepath)
+        batches = []
+        rows_read = 0
+        for batch in iter_excel_batches(self._filepath, batch_size=self._batch_size):
+            rows_read += len(batch)
+            batch = batch.dropna(how='all')
+            # only the compacted batch is kept, the list view shows the same frame
+            if self._compact is not None:
+                batch = self._compact(batch)
+            batches.append(batch)
+            wx.CallAfter(pub.sendMessage, LOAD_BATCH_SIGNAL,
+                         df=batch, rows_read=rows_read, total_rows=total_rows)
+        df = concat_compact(batches)
+        wx.CallAfter(pub.sendMessage, self._message, df=df)
+        if fingerprint is not None and not df.empty:
+            self._cache.put(fingerprint, df)
+
+
+class ReadExcelFilesThread(Thread):
+    def __init__(self, sources, message, max_workers=None):
+        super(ReadExcelFilesThread, self).__init__()
+        self._sources = sources
+        self._message = message
+        self._max_workers = max_workers or min(len(sources), os.cpu_count() or 1)
         self.start()
 
     def run(self):
-        df = pd.read_excel(self._filepath)
-        df = df.dropna(how='all').fillna('')
+        total_rows = 0
+        for filepath, sheet_name in self._sources:
+            try:
+                total_rows += count_sheet_rows(filepath, sheet_name) or 0
+            except Exception:
+                pass
+        results = {}
+        failed = []
+        rows_read = 0
+        with ProcessPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = {executor.submit(read_sheet, filepath, sheet_name): (filepath, sheet_name)
+                       for filepath, sheet_name in self._sources}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    results[source] = future.result()
+                except Exception:
+                    failed.append(source)
+                    continue
+                rows_read += len(results[source][2])
+                wx.CallAfter(pub.sendMessage, LOAD_PROGRESS_SIGNAL,
+                             rows_read=rows_read, total_rows=total_rows or None)
+        # keep the order the user picked the files in, not the order the workers finished
+        df = combine_sources([results[source] for source in self._sources if source in results])
         wx.CallAfter(pub.sendMessage, self._message, df=df)
+        if failed:
+            wx.CallAfter(pub.sendMessage, LOAD_FAILED_SIGNAL, sources=failed)
+
+
+def output_message(outputs, include_count, include_percent, include_narst, identifier_col):
+    sens, resists, biogram_sens, biogram_resists, biogram_narst_s = outputs
+    return dict(sens=sens if include_count else None,
+                resists=resists if include_count else None,
+                biogram_sens=biogram_sens if include_percent else None,
+                biogram_resists=biogram_resists if include_percent else None,
+                biogram_narst_s=biogram_narst_s if include_narst else None,
+                identifier_col=identifier_col)
+
+
+def dedup_message(removed, groups, largest):
+    if removed == 0:
+        return 'No duplicates found.'
+    return (f'{removed} duplicates were removed from {groups} keys.\n'
+            f'The most repeated key had {largest} records.')
 
 
 class BiogramGeneratorThread(Thread):
     def __init__(self, data, date_col, identifier_col, organism_col, indexes, keys,
-                 include_count, include_percent, include_narst, columns, drug_data):
+                 include_count, include_percent, include_narst, columns, drug_data,
+                 start_date=None, end_date=None, cube_cache=None, cube_key=None,
+                 result_cache=None, result_key=None, executor=None, partitions=1, min_isolates=0):
         super(BiogramGeneratorThread, self).__init__()
         self.drug_data = drug_data
         self.data = data
@@ -94,6 +225,15 @@ class BiogramGeneratorThread(Thread):
         self.include_count = include_count
         self.include_percent = include_percent
         self.include_narst = include_narst
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cube_cache = cube_cache
+        self.cube_key = cube_key
+        self.result_cache = result_cache
+        self.result_key = result_key
+        self.executor = executor
+        self.partitions = partitions
+        self.min_isolates = min_isolates
         self.start()
 
     @staticmethod
@@ -113,84 +253,100 @@ class BiogramGeneratorThread(Thread):
 
     @staticmethod
     def _coerce_numeric(frame):
+        if all(pd.api.types.is_numeric_dtype(dtype) for dtype in frame.dtypes):
+            return frame
         return frame.apply(pd.to_numeric, errors='coerce')
 
-    @staticmethod
-    def _format_count(value):
-        if pd.isna(value):
-            return ''
-        try:
-            return '{:.0f}'.format(float(value))
-        except (TypeError, ValueError):
-            return ''
-
-    def _build_outputs(self, long_df, indexes):
-        if long_df.empty:
-            total = self._empty_result(indexes)
-            sens = self._empty_result(indexes)
-            resists = self._empty_result(indexes)
-        else:
-            working_df = long_df.copy()
-            working_df['is_s'] = (working_df['value'] == 'S').astype('int64')
-            working_df['is_resist'] = working_df['value'].isin(['I', 'R']).astype('int64')
-
-            grouped = working_df.groupby(indexes + ['group', 'variable'], observed=True)[
-                [self.identifier_col, 'is_s', 'is_resist']
-            ].agg({
-                self.identifier_col: 'count',
-                'is_s': 'sum',
-                'is_resist': 'sum',
-            })
-
-            total = self._wrap_result(grouped[self.identifier_col].unstack(['group', 'variable']))
-            sens = self._wrap_result(grouped['is_s'].unstack(['group', 'variable']))
-            resists = self._wrap_result(grouped['is_resist'].unstack(['group', 'variable']))
-
+    def _empty_outputs(self, indexes):
+        return self._empty_result(indexes), self._empty_result(indexes), self._empty_result(indexes)
+
+    def _unstack_counts(self, counts, indexes):
+        if counts.empty:
+            return self._empty_outputs(indexes)
+        grouped = counts.set_index(indexes + ['group', 'variable']).sort_index()
+        total = self._wrap_result(grouped['total'].unstack(['group', 'variable']))
+        sens = self._wrap_result(grouped['sens'].unstack(['group', 'variable']))
+        resists = self._wrap_result(grouped['resists'].unstack(['group', 'variable']))
+        return total, sens, resists
+
+    def _count_wide(self, data, indexes):
+        drug_columns = [column for column in data.columns if column not in self.keys]
+        drug_pairs = drug_pairs_for(self.drug_data, drug_columns)
+        if not drug_pairs:
+            return self._empty_outputs(indexes)
+        fields = [field for field in ORGANISM_FIELDS if field in indexes]
+        annotated_df = annotate_organisms(data, self.organism_col, self._organism_lookup(), fields)
+        if annotated_df.empty:
+            return self._empty_outputs(indexes)
+        total, sens, resists = biogram_counts(annotated_df, indexes, drug_pairs, self.executor, self.partitions,
+                                              self.min_isolates)
+        if total.empty:
+            return self._empty_outputs(indexes)
+        return self._wrap_result(total), self._wrap_result(sens), self._wrap_result(resists)
+
+    def _build_cube(self):
+        drug_columns = [column for column in self.data.columns if column not in self.keys]
+        drug_pairs = drug_pairs_for(self.drug_data, drug_columns)
+        if not drug_pairs:
+            return None
+        annotated_df = annotate_organisms(self.data, self.organism_col, self._organism_lookup())
+        if annotated_df.empty:
+            return None
+        dims = cube_dimensions(annotated_df, self.columns)
+        return AggregationCube.build(annotated_df, dims, drug_pairs, self.date_col or None,
+                                     executor=self.executor, partitions=self.partitions)
+
+    def _cube(self):
+        if self.cube_cache is None:
+            return None
+        cube = self.cube_cache.get(self.cube_key)
+        if cube is None:
+            cube = self._build_cube()
+            if cube is not None:
+                self.cube_cache[self.cube_key] = cube
+        return cube
+
+    def _count(self, indexes):
+        cube = self._cube()
+        if cube is not None and cube.covers(indexes):
+            total, sens, resists = cube.rollup(indexes, self.start_date, self.end_date, self.min_isolates)
+            if total.empty:
+                return self._empty_outputs(indexes)
+            return self._wrap_result(total), self._wrap_result(sens), self._wrap_result(resists)
+        data = self.data
+        if self.date_col and (self.start_date is not None or self.end_date is not None):
+            data = filter_date_range(data, self.date_col, self.start_date, self.end_date)
+        return self._count_wide(data, indexes)
+
+    def _format_outputs(self, total, sens, resists):
         total = self._coerce_numeric(total)
         sens = self._coerce_numeric(sens)
         resists = self._coerce_numeric(resists)
         biogram_resists = (resists / total * 100).round(2)
         biogram_sens = (sens / total * 100).round(2)
-        formatted_total = total.map(self._format_count)
-        biogram_narst_s = biogram_sens.fillna('-').map(str) + " (" + formatted_total + ")"
-        biogram_narst_s = biogram_narst_s.map(lambda x: '' if x.startswith('-') else x)
+        biogram_narst_s = narst_frame(biogram_sens, total)
         return sens, resists, biogram_sens, biogram_resists, biogram_narst_s
 
+    def _send_outputs(self, outputs):
+        if self.result_cache is not None:
+            self.result_cache.put(self.result_key, outputs)
+        wx.CallAfter(pub.sendMessage, CLOSE_PROGRESS_BAR_SIGNAL)
+        wx.CallAfter(pub.sendMessage, WRITE_TO_EXCEL_FILE_SIGNAL,
+                     **output_message(outputs, self.include_count, self.include_percent,
+                                      self.include_narst, self.identifier_col))
+
     def run(self):
         indexes = [self.columns[idx] for idx in self.indexes]
-        drug_columns = [column for column in self.data.columns if column not in self.keys]
-
-        long_df = pd.DataFrame(columns=indexes + ['group', 'variable', 'value', self.identifier_col])
-        if drug_columns:
-            organism_df = self._organism_lookup().rename(columns={'ORGANISM': self.organism_col})
-            annotated_df = self.data.merge(organism_df, on=self.organism_col, how='inner')
-            melted_df = annotated_df.melt(id_vars=self.keys + ['GENUS', 'SPECIES', 'GRAM'],
-                                          value_vars=drug_columns)
-            drug_lookup = self.drug_data[['abbr', 'group']].drop_duplicates()
-            merged_df = melted_df.merge(drug_lookup, left_on='variable', right_on='abbr', how='inner')
-            long_df = merged_df[[
-                *indexes,
-                self.identifier_col,
-                'group',
-                'variable',
-                'value',
-            ]]
-
-        sens, resists, biogram_sens, biogram_resists, biogram_narst_s = self._build_outputs(long_df, indexes)
-        wx.CallAfter(pub.sendMessage, CLOSE_PROGRESS_BAR_SIGNAL)
-        wx.CallAfter(pub.sendMessage,
-                     WRITE_TO_EXCEL_FILE_SIGNAL,
-                     sens=sens if self.include_count else None,
-                     resists=resists if self.include_count else None,
-                     biogram_sens=biogram_sens if self.include_percent else None,
-                     biogram_resists=biogram_resists if self.include_percent else None,
-                     biogram_narst_s=biogram_narst_s if self.include_narst else None,
-                     identifier_col=self.identifier_col)
+        self._send_outputs(self._format_outputs(*self._count(indexes)))
 
 
 class DatabaseBiogramGeneratorThread(BiogramGeneratorThread):
-    def __init__(self, facts_df, identifier_col, indexes, include_count, include_percent, include_narst):
-        self.facts_df = facts_df
+    def __init__(self, session, query, identifier_col, indexes, include_count, include_percent, include_narst,
+                 result_cache=None, result_key=None, close_session=False):
+        self.session = session
+        self.query = query
+        # a session opened for this antibiogram only is closed when it is done
+        self.close_session = close_session
         super().__init__(
             data=pd.DataFrame(),
             date_col='',
@@ -203,45 +359,85 @@ class DatabaseBiogramGeneratorThread(BiogramGeneratorThread):
             include_narst=include_narst,
             columns=indexes,
             drug_data=pd.DataFrame(),
+            result_cache=result_cache,
+            result_key=result_key,
         )
 
     def run(self):
         indexes = [self.columns[idx] for idx in self.indexes]
-        long_df = self.facts_df.rename(columns={
-            'drug_group': 'group',
-            'drug': 'variable',
-            'sensitivity': 'value',
-        })
-        sens, resists, biogram_sens, biogram_resists, biogram_narst_s = self._build_outputs(long_df, indexes)
+        # the grouping runs inside SQLite, only the count rows are loaded
+        try:
+            counts = self.session.antibiogram_counts(indexes, **self.query)
+        finally:
+            if self.close_session:
+                self.session.close()
+        self._send_outputs(self._format_outputs(*self._unstack_counts(counts, indexes)))
+
+
+class ReportBatchThread(BiogramGeneratorThread):
+    def __init__(self, data, reports, date_col, identifier_col, organism_col, keys, columns, drug_data,
+                 cube_cache=None, result_cache=None, executor=None, partitions=1):
+        self.reports = reports
+        super().__init__(data, date_col, identifier_col, organism_col,
+                         indexes=[], keys=keys, include_count=True, include_percent=True, include_narst=True,
+                         columns=columns, drug_data=drug_data, cube_cache=cube_cache,
+                         result_cache=result_cache, executor=executor, partitions=partitions)
+
+    def _report_outputs(self, report):
+        outputs = self.result_cache.get(report['key']) if self.result_cache is not None else None
+        if outputs is None:
+            self.start_date = report['start']
+            self.end_date = report['end']
+            self.min_isolates = report['min_isolates']
+            outputs = self._format_outputs(*self._count(report['indexes']))
+            if self.result_cache is not None:
+                self.result_cache.put(report['key'], outputs)
+        return outputs
+
+    def run(self):
+        source = self.data
+        written = []
+        failed = []
+        for dedup, reports in group_by_dedup(self.reports).items():
+            # one deduplication and one cube serve every report of the group
+            self.data = deduplicate(source, dedup[0], self.date_col if dedup[1] or dedup[2] else None, dedup[2])
+            self.cube_key = dedup
+            for report in reports:
+                try:
+                    outputs = self._report_outputs(report)
+                    write_workbook(report['output'],
+                                   **output_message(outputs, report['include_count'], report['include_percent'],
+                                                    report['include_narst'], self.identifier_col))
+                except Exception:
+                    failed.append(report['name'])
+                else:
+                    written.append(report['output'])
+                wx.CallAfter(pub.sendMessage, REPORT_PROGRESS_SIGNAL,
+                             done=len(written) + len(failed), total=len(self.reports))
         wx.CallAfter(pub.sendMessage, CLOSE_PROGRESS_BAR_SIGNAL)
-        wx.CallAfter(pub.sendMessage,
-                     WRITE_TO_EXCEL_FILE_SIGNAL,
-                     sens=sens if self.include_count else None,
-                     resists=resists if self.include_count else None,
-                     biogram_sens=biogram_sens if self.include_percent else None,
-                     biogram_resists=biogram_resists if self.include_percent else None,
-                     biogram_narst_s=biogram_narst_s if self.include_narst else None,
-                     identifier_col=self.identifier_col)
+        wx.CallAfter(pub.sendMessage, REPORT_FINISHED_SIGNAL, written=written, failed=failed)
 
 
-class DataRow(object):
-    def __init__(self, id, series) -> None:
-        self.id = id
-        for k, v in series.items():
-            setattr(self, k, v)
+def format_datetime(value):
+    if pd.isna(value):
+        return ''
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
 
-    def to_list(self, columns):
-        return [getattr(self, c) for c in columns]
 
-    def to_dict(self, columns):
-        return {c: getattr(self, c) for c in columns}
+def format_number(value):
+    if pd.isna(value):
+        return ''
+    try:
+        return '%.1f' % value
+    except TypeError:
+        return str(value)
 
 
-def format_datetime(value):
+def format_text(value):
     if pd.isna(value):
         return ''
-    if hasattr(value, 'strftime'):
-        return value.strftime('%Y-%m-%d')
     return str(value)
 
 
@@ -256,10 +452,10 @@ def to_wx_date(value):
 
 
 class HeatmapConfigDialog(wx.Dialog):
-    def __init__(self, parent, fields, start=None, end=None, title='Heatmap Configuration'):
+    def __init__(self, parent, fields, start=None, end=None, specimens=None, title='Heatmap Configuration'):
         super().__init__(parent, title=title, style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
         main_sizer = wx.BoxSizer(wx.VERTICAL)
-        form_sizer = wx.FlexGridSizer(3, 2, 10, 10)
+        form_sizer = wx.FlexGridSizer(4 if specimens else 3, 2, 10, 10)
 
         form_sizer.Add(wx.StaticText(self, label='Row Field'))
         self.field_choice = wx.Choice(self, choices=fields)
@@ -275,6 +471,14 @@ class HeatmapConfigDialog(wx.Dialog):
         self.endDate = wx.adv.DatePickerCtrl(self, dt=end or wx.DateTime.Now())
         form_sizer.Add(self.endDate, 0, wx.EXPAND)
 
+        self.specimens = specimens or []
+        self.specimen_choice = None
+        if self.specimens:
+            form_sizer.Add(wx.StaticText(self, label='Specimen'))
+            self.specimen_choice = wx.Choice(self, choices=['All'] + self.specimens)
+            self.specimen_choice.SetSelection(0)
+            form_sizer.Add(self.specimen_choice, 0, wx.EXPAND)
+
         cutoff_sizer = wx.BoxSizer(wx.HORIZONTAL)
         cutoff_sizer.Add(wx.StaticText(self, label='Minimum Isolates'), 0, wx.RIGHT | wx.ALIGN_CENTER_VERTICAL, 10)
         self.ncutoff = wx.SpinCtrl(self, min=0, initial=0)
@@ -287,6 +491,12 @@ class HeatmapConfigDialog(wx.Dialog):
         self.SetSizer(main_sizer)
         self.Fit()
 
+    @property
+    def specimen(self):
+        if self.specimen_choice is None or self.specimen_choice.GetSelection() < 1:
+            return None
+        return self.specimens[self.specimen_choice.GetSelection() - 1]
+
 
 class BiogramIndexDialog(wx.Dialog):
     def __init__(self, parent, columns, title='Biogram Indexes', start=None, end=None):
@@ -309,6 +519,10 @@ class BiogramIndexDialog(wx.Dialog):
         dateBoxSizer.Add(self.startDate, 0, wx.ALL, 5)
         dateBoxSizer.Add(endDateLabel, 0, wx.ALL, 5)
         dateBoxSizer.Add(self.endDate, 0, wx.ALL, 5)
+        cutoff_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        cutoff_sizer.Add(wx.StaticText(self, label='Minimum Isolates'), 0, wx.RIGHT | wx.ALIGN_CENTER_VERTICAL, 10)
+        self.ncutoff = wx.SpinCtrl(self, min=0, max=1000000, initial=0)
+        cutoff_sizer.Add(self.ncutoff, 0)
         outputBoxSizer = wx.StaticBoxSizer(wx.VERTICAL, self, label='Output')
         self.includeCount = wx.CheckBox(self, label='Raw counts')
         self.includePercent = wx.CheckBox(self, label='Percents')
@@ -323,6 +537,7 @@ class BiogramIndexDialog(wx.Dialog):
         main_sizer.Add(self.chlbox, 1, wx.ALL | wx.EXPAND, 10)
         main_sizer.Add(self.index_items_list, 1, wx.ALL | wx.EXPAND, 10)
         main_sizer.Add(dateBoxSizer, 0, wx.ALL | wx.EXPAND, 5)
+        main_sizer.Add(cutoff_sizer, 0, wx.ALL, 10)
         main_sizer.Add(outputBoxSizer, 0, wx.ALL | wx.EXPAND, 5)
         btn_sizer = wx.StdDialogButtonSizer()
         ok_btn = wx.Button(self, id=wx.ID_OK, label='Generate')
@@ -496,10 +711,16 @@ class DeduplicateIndexDialog(wx.Dialog):
         self.isSortDate.SetValue(True)
         self.chlbox = wx.CheckListBox(self, choices=columns)
         self.chlbox.Bind(wx.EVT_CHECKLISTBOX, self.on_checked)
+        window_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        window_sizer.Add(wx.StaticText(self, label='First isolate per (days, 0 = once)'), 0,
+                         wx.RIGHT | wx.ALIGN_CENTER_VERTICAL, 10)
+        self.episodeDays = wx.SpinCtrl(self, min=0, max=36500, initial=0)
+        window_sizer.Add(self.episodeDays, 0)
         button_sizer = self.CreateStdDialogButtonSizer(flags=wx.OK | wx.CANCEL)
         main_sizer.Add(instruction, 0, wx.ALL, 5)
         main_sizer.Add(self.chlbox, 1, wx.ALL | wx.EXPAND, 5)
         main_sizer.Add(self.isSortDate, 0, wx.ALL, 5)
+        main_sizer.Add(window_sizer, 0, wx.ALL, 5)
         main_sizer.Add(button_sizer, 0, wx.ALL, 5)
         self.SetSizer(main_sizer)
         self.Fit()
@@ -512,6 +733,11 @@ class DeduplicateIndexDialog(wx.Dialog):
         else:
             self.keys.append(item)
 
+    @property
+    def window(self):
+        # episodes only make sense per key, a window without keys keeps every record
+        return self.episodeDays.GetValue() if self.keys else 0
+
 
 class MainFrame(wx.Frame):
     def __init__(self):
@@ -529,21 +755,48 @@ class MainFrame(wx.Frame):
         menuBar.Append(registryMenu, 'Re&gistry')
         menuBar.Append(databaseMenu, '&Database')
         loadItem = fileMenu.Append(wx.ID_ANY, 'Load Data', 'Load Data')
+        loadFilesItem = fileMenu.Append(wx.ID_ANY, 'Load Multiple Files', 'Load and combine several Excel files')
+        loadFolderItem = fileMenu.Append(wx.ID_ANY, 'Load Folder', 'Load and combine all Excel files in a folder')
         exportItem = fileMenu.Append(wx.ID_ANY, 'Export Data', 'Export Data')
+        reportsItem = fileMenu.Append(wx.ID_ANY, 'Run Report Batch', 'Generate the antibiograms listed in a report file')
+        fileMenu.AppendSeparator()
+        clearCacheItem = fileMenu.Append(wx.ID_ANY, 'Clear Load Cache', 'Remove cached copies of loaded files')
+        clearResultsItem = fileMenu.Append(wx.ID_ANY, 'Clear Result Cache', 'Remove cached antibiograms')
         fileMenu.AppendSeparator()
         fileItem = fileMenu.Append(wx.ID_EXIT, '&Quit', 'Quit Application')
         drugItem = registryMenu.Append(wx.ID_ANY, 'Drugs', 'Drug Registry')
+        connectDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Connect Database',
+                                                  'Keep a database open for the following analyses')
+        disconnectDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Disconnect Database', 'Close the connected database')
+        databaseMenu.AppendSeparator()
         exportDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Save Database', 'Save current data to a database')
+        partitionDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Save Database by Period',
+                                                    'Save current data to one database per year or month')
+        appendDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Add to Database',
+                                                 'Add the records a database does not have yet')
         generateDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Generate Antibiogram', 'Generate antibiogram from a database')
         heatmapDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Generate Heatmap', 'Generate heatmap from a database')
+        databaseMenu.AppendSeparator()
+        indexDatabaseItem = databaseMenu.Append(wx.ID_ANY, 'Rebuild Indexes',
+                                                'Recreate the indexes, statistics and monthly counts of a database')
         self.SetMenuBar(menuBar)
         self.Bind(wx.EVT_MENU, lambda x: self.Close(), fileItem)
         self.Bind(wx.EVT_MENU, self.open_drug_dialog, drugItem)
         self.Bind(wx.EVT_MENU, self.export_data, exportItem)
+        self.Bind(wx.EVT_MENU, self.run_report_batch, reportsItem)
         self.Bind(wx.EVT_MENU, self.open_load_data_dialog, loadItem)
+        self.Bind(wx.EVT_MENU, self.open_load_files_dialog, loadFilesItem)
+        self.Bind(wx.EVT_MENU, self.open_load_folder_dialog, loadFolderItem)
+        self.Bind(wx.EVT_MENU, self.clear_load_cache, clearCacheItem)
+        self.Bind(wx.EVT_MENU, self.clear_result_cache, clearResultsItem)
+        self.Bind(wx.EVT_MENU, self.connect_database, connectDatabaseItem)
+        self.Bind(wx.EVT_MENU, self.disconnect_database, disconnectDatabaseItem)
         self.Bind(wx.EVT_MENU, self.export_database, exportDatabaseItem)
+        self.Bind(wx.EVT_MENU, lambda x: self.export_database(x, action='partition'), partitionDatabaseItem)
+        self.Bind(wx.EVT_MENU, lambda x: self.export_database(x, action='append'), appendDatabaseItem)
         self.Bind(wx.EVT_MENU, self.generate_from_database, generateDatabaseItem)
         self.Bind(wx.EVT_MENU, self.generate_heatmap_from_database, heatmapDatabaseItem)
+        self.Bind(wx.EVT_MENU, self.rebuild_database_indexes, indexDatabaseItem)
 
         self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Center()
@@ -552,14 +805,25 @@ class MainFrame(wx.Frame):
         self.load_drug_data()
 
         self.df = pd.DataFrame()
-        self.data = []
         self.colnames = []
+        self.progress_dialog = None
+        self.cube_cache = {}
+        self.load_cache = LoadCache(limit=config.ReadInt('LoadCacheLimitMB', 1024) * 1024 * 1024)
+        self.result_cache = ResultCache(
+            limit=config.ReadInt('ResultCacheLimitMB', 128) * 1024 * 1024,
+            cache_dir=RESULT_CACHE_DIR if config.ReadBool('PersistResultCache', True) else None,
+            disk_limit=config.ReadInt('ResultCacheDiskLimitMB', 256) * 1024 * 1024,
+        )
+        self.data_fingerprint = None
+        self.biogram_executor = None
+        self.biogram_workers = config.ReadInt('BiogramWorkers', os.cpu_count() or 1)
         self.organism_col = config.Read('OrganismCol', '')
         self.identifier_col = config.Read('IdentifierCol', '')
         self.date_col = config.Read('DateCol', '')
         self.specimens_col = config.Read('SpecimensCol', '')
         self.drugs_col = config.Read('Drugs', '').split(';') or []
         self.current_data_path = ''
+        self.db_session = None
         main_sizer = wx.BoxSizer(wx.VERTICAL)
         btn_sizer = wx.BoxSizer(wx.HORIZONTAL)
         load_button = wx.Button(panel, label="Load")
@@ -571,13 +835,9 @@ class MainFrame(wx.Frame):
         self.config_btn.Bind(wx.EVT_BUTTON, self.configure)
         self.generate_btn.Bind(wx.EVT_BUTTON, self.generate)
 
-        self.dataOlv = FastObjectListView(panel, wx.ID_ANY,
-                                          style=wx.LC_REPORT | wx.SUNKEN_BORDER)
-        self.dataOlv.oddRowsBackColor = wx.Colour(230, 230, 230, 100)
-        self.dataOlv.evenRowsBackColor = wx.WHITE
-        self.dataOlv.cellEditMode = ObjectListView.CELLEDIT_DOUBLECLICK
+        self.dataOlv = DataFrameListCtrl(panel)
+        self.dataOlv.edit_handler = self.update_cell
         self.dataOlv.SetEmptyListMsg('Welcome to Mivisor Version 2021.1')
-        self.dataOlv.SetObjects([])
         main_sizer.Add(self.dataOlv, 1, wx.ALL | wx.EXPAND, 10)
         btn_sizer.Add(load_button, 0, wx.ALL, 5)
         btn_sizer.Add(self.copy_button, 0, wx.ALL, 5)
@@ -592,12 +852,21 @@ class MainFrame(wx.Frame):
         pub.subscribe(self.disable_buttons, DISABLE_BUTTONS)
         pub.subscribe(self.enable_buttons, ENABLE_BUTTONS)
         pub.subscribe(self.write_output, WRITE_TO_EXCEL_FILE_SIGNAL)
+        pub.subscribe(self.append_data_batch, LOAD_BATCH_SIGNAL)
+        pub.subscribe(self.update_load_progress, LOAD_PROGRESS_SIGNAL)
+        pub.subscribe(self.show_load_failures, LOAD_FAILED_SIGNAL)
+        pub.subscribe(self.update_report_progress, REPORT_PROGRESS_SIGNAL)
+        pub.subscribe(self.show_report_summary, REPORT_FINISHED_SIGNAL)
 
     def OnClose(self, event):
         if event.CanVeto():
             if wx.MessageBox('You want to quit the program?', 'Please confirm', style=wx.YES_NO) != wx.YES:
                 event.Veto()
                 return
+        if self.biogram_executor is not None:
+            self.biogram_executor.shutdown(wait=False, cancel_futures=True)
+        if self.db_session is not None:
+            self.db_session.close()
         event.Skip()
 
     def disable_buttons(self):
@@ -611,7 +880,7 @@ class MainFrame(wx.Frame):
         self.config_btn.Enable()
 
     def export_data(self, event):
-        df = pd.DataFrame([d.to_dict(self.colnames) for d in self.data])
+        df = self.build_current_dataframe()
         if df.empty:
             with wx.MessageDialog(self, 'No data to export. Please load data first.',
                                   'Export Data', style=wx.OK) as dlg:
@@ -654,13 +923,87 @@ class MainFrame(wx.Frame):
                 drug_list.append({'drug': row['drug'], 'abbr': ab, 'group': row['group']})
         self.drug_data = pd.DataFrame(drug_list)
 
+    def reset_data_olv(self):
+        self.df = pd.DataFrame()
+        self.colnames = []
+        self.dataOlv.set_frame(self.df)
+
+    def append_data_batch(self, df, rows_read, total_rows):
+        if not self.colnames:
+            self.setColumns(df)
+        self.dataOlv.append_frame(df)
+        if self.progress_dialog:
+            self.progress_dialog.update_rows(rows_read, total_rows)
+
+    def update_load_progress(self, rows_read, total_rows):
+        if self.progress_dialog:
+            self.progress_dialog.update_rows(rows_read, total_rows)
+
+    def show_load_failures(self, sources):
+        names = ['{} ({})'.format(os.path.basename(f), s) if s else os.path.basename(f) for f, s in sources]
+        with wx.MessageDialog(self, 'The following sheets could not be read:\n' + '\n'.join(names),
+                              'Load Data', style=wx.OK) as dlg:
+            dlg.ShowModal()
+
+    def compact_data(self, df):
+        return compact_frame(df, date_col=self.date_col, drug_cols=self.drugs_col,
+                             category_cols=[self.organism_col, self.specimens_col])
+
+    def touch_data(self):
+        # aggregates built from the previous state of the data are stale now
+        self.cube_cache.clear()
+        self.data_fingerprint = None
+
+    def dataset_fingerprint(self):
+        if self.data_fingerprint is None:
+            self.data_fingerprint = frame_fingerprint(self.df)
+        return self.data_fingerprint
+
+    def drug_fingerprint(self):
+        if self.drug_data.empty:
+            return ()
+        return tuple(sorted(set(zip(self.drug_data['abbr'], self.drug_data['group']))))
+
+    def biogram_pool(self, num_rows):
+        # worker processes only pay off once pickling the partitions is cheap
+        # compared to counting them; the pool is kept for later antibiograms
+        if num_rows < PARALLEL_MIN_ROWS or self.biogram_workers <= 1:
+            return None
+        if self.biogram_executor is None:
+            self.biogram_executor = ProcessPoolExecutor(max_workers=self.biogram_workers)
+        return self.biogram_executor
+
+    def biogram_result_key(self, dedup, indexes, start_date, end_date, min_isolates=0):
+        return result_key('data', self.dataset_fingerprint(), self.identifier_col, self.organism_col,
+                          self.date_col, tuple(self.drugs_col), self.drug_fingerprint(),
+                          file_stamp(os.path.join('appdata', 'organisms2020.xlsx')), dedup,
+                          tuple(indexes), start_date, end_date, min_isolates)
+
+    def biogram_columns(self):
+        keys = [c for c in self.colnames if c not in self.drugs_col]
+        columns = keys + ['GENUS', 'SPECIES', 'GRAM']
+        if self.identifier_col in columns:
+            columns.remove(self.identifier_col)
+        if self.date_col in columns:
+            columns.remove(self.date_col)
+        return keys, columns
+
+    def show_cached_output(self, key, include_count, include_percent, include_narst, identifier_col):
+        outputs = self.result_cache.get(key)
+        if outputs is None:
+            return False
+        self.statusbar.SetStatusText('Antibiogram taken from the result cache.')
+        self.write_output(**output_message(outputs, include_count, include_percent, include_narst,
+                                           identifier_col))
+        return True
+
     def set_data_olv(self, df):
-        self.df = df
-        self.df = self.df.dropna(how='all').fillna('')
+        self.df = self.compact_data(df.dropna(how='all'))
+        self.touch_data()
         self.setColumns()
-        self.data = [DataRow(idx, row) for idx, row in self.df.iterrows()]
-        self.dataOlv.SetObjects(self.data)
+        self.dataOlv.set_frame(self.df)
         pub.sendMessage(CLOSE_PROGRESS_BAR_SIGNAL)
+        self.progress_dialog = None
         pub.sendMessage(ENABLE_BUTTONS)
 
     def read_data_from_file(self):
@@ -671,9 +1014,84 @@ class MainFrame(wx.Frame):
                 return
             filepath = file_dialog.GetPath()
             self.current_data_path = filepath
+            self.reset_data_olv()
             pub.subscribe(self.set_data_olv, 'load_excel_data_finished')
-            ReadExcelThread(filepath, 'load_excel_data_finished')
-            progress_bar = PulseProgressBarDialog('Loading Data', 'Reading data from {}'.format(filepath))
+            self.progress_dialog = RowProgressDialog('Loading Data', 'Reading data from {}'.format(filepath))
+            ReadExcelThread(filepath, 'load_excel_data_finished', cache=self.load_cache,
+                            compact=self.compact_data)
+
+    def select_sheets(self, filepaths):
+        sheets = {}
+        for filepath in filepaths:
+            try:
+                sheets[filepath] = list_sheets(filepath)
+            except Exception:
+                sheets[filepath] = []
+        sheet_names = []
+        for names in sheets.values():
+            sheet_names.extend(name for name in names if name not in sheet_names)
+        if not sheet_names:
+            return []
+        if any(len(names) > 1 for names in sheets.values()):
+            with wx.MultiChoiceDialog(self, 'Select worksheets to load', 'Worksheets', sheet_names) as dlg:
+                dlg.SetSelections(list(range(len(sheet_names))))
+                if dlg.ShowModal() != wx.ID_OK:
+                    return []
+                selected = {sheet_names[i] for i in dlg.GetSelections()}
+        else:
+            selected = set(sheet_names)
+        return [(filepath, name) for filepath in filepaths for name in sheets[filepath] if name in selected]
+
+    def read_data_from_files(self, filepaths):
+        filepaths = sorted(filepaths)
+        sources = self.select_sheets(filepaths)
+        if not sources:
+            with wx.MessageDialog(self, 'No worksheets were selected.', 'Load Data', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+        self.current_data_path = filepaths[0] if len(filepaths) == 1 else os.path.commonpath(filepaths)
+        self.reset_data_olv()
+        pub.subscribe(self.set_data_olv, 'load_excel_data_finished')
+        self.progress_dialog = RowProgressDialog(
+            'Loading Data', 'Reading {} worksheets from {} files'.format(len(sources), len(filepaths)))
+        ReadExcelFilesThread(sources, 'load_excel_data_finished')
+
+    def confirm_load_new_dataset(self):
+        if self.df.empty:
+            return True
+        with wx.MessageDialog(self, "Load new dataset?", "Load data", style=wx.YES_NO) as msg_dialog:
+            return msg_dialog.ShowModal() == wx.ID_YES
+
+    def open_load_files_dialog(self, event):
+        pub.sendMessage(DISABLE_BUTTONS)
+        if not self.confirm_load_new_dataset():
+            return
+        with wx.FileDialog(self, "Load data from files",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST | wx.FD_MULTIPLE,
+                           wildcard="Excel file (*.xlsx)|*.xlsx") as file_dialog:
+            if file_dialog.ShowModal() == wx.ID_CANCEL:
+                return
+            filepaths = file_dialog.GetPaths()
+        self.read_data_from_files(filepaths)
+
+    def open_load_folder_dialog(self, event):
+        pub.sendMessage(DISABLE_BUTTONS)
+        if not self.confirm_load_new_dataset():
+            return
+        with wx.DirDialog(self, "Load all Excel files in a folder",
+                          style=wx.DD_DEFAULT_STYLE | wx.DD_DIR_MUST_EXIST) as dir_dialog:
+            if dir_dialog.ShowModal() == wx.ID_CANCEL:
+                return
+            folder = dir_dialog.GetPath()
+        # skip Excel's "~$" lock files of workbooks that are currently open
+        filepaths = [f for f in glob.glob(os.path.join(folder, '*.xlsx'))
+                     if not os.path.basename(f).startswith('~$')]
+        if not filepaths:
+            with wx.MessageDialog(self, 'No Excel files were found in the folder.',
+                                  'Load Data', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+        self.read_data_from_files(filepaths)
 
     def open_load_data_dialog(self, event):
         pub.sendMessage(DISABLE_BUTTONS)
@@ -684,6 +1102,24 @@ class MainFrame(wx.Frame):
         else:
             self.read_data_from_file()
 
+    def clear_load_cache(self, event):
+        size_mb = self.load_cache.size() / (1024 * 1024)
+        with wx.MessageDialog(self, 'Remove {:.1f} MB of cached data files?'.format(size_mb),
+                              'Clear Load Cache', style=wx.YES_NO) as dlg:
+            if dlg.ShowModal() != wx.ID_YES:
+                return
+        self.load_cache.clear()
+        self.statusbar.SetStatusText('Load cache cleared.')
+
+    def clear_result_cache(self, event):
+        size_mb = self.result_cache.size() / (1024 * 1024)
+        with wx.MessageDialog(self, 'Remove {:.1f} MB of cached antibiograms?'.format(size_mb),
+                              'Clear Result Cache', style=wx.YES_NO) as dlg:
+            if dlg.ShowModal() != wx.ID_YES:
+                return
+        self.result_cache.clear()
+        self.statusbar.SetStatusText('Result cache cleared.')
+
     def open_drug_dialog(self, event):
         with DrugRegFormDialog() as drug_dlg:
             drug_dlg.ShowModal()
@@ -704,13 +1140,9 @@ class MainFrame(wx.Frame):
         return True
 
     def build_current_dataframe(self):
-        return pd.DataFrame([d.to_dict(self.colnames) for d in self.data])
-
-    @staticmethod
-    def normalize_sensitivity(value):
-        if pd.isna(value):
-            return ''
-        return str(value).strip().upper()
+        # the frame is the single source of truth, callers get it as is and
+        # must not modify it in place
+        return self.df
 
     def load_organism_lookup(self):
         organism_df = pd.read_excel(os.path.join('appdata', 'organisms2020.xlsx'))
@@ -727,35 +1159,10 @@ class MainFrame(wx.Frame):
             'colnames': self.colnames,
         }
 
-    def build_database_facts(self, df):
-        drug_columns = [col for col in self.drugs_col if col in df.columns]
-        if not drug_columns:
-            return pd.DataFrame()
-
-        facts_df = df.copy()
-        facts_df['record_id'] = range(len(facts_df))
-        organism_lookup = self.load_organism_lookup().rename(columns={'ORGANISM': self.organism_col})
-        facts_df = facts_df.merge(organism_lookup, on=self.organism_col, how='left')
-        for col in ['GENUS', 'SPECIES', 'GRAM']:
-            if col in facts_df:
-                facts_df[col] = facts_df[col].fillna('')
-        facts_df['organism_name'] = (
-            facts_df['GENUS'].astype(str).str.strip() + ' ' + facts_df['SPECIES'].astype(str).str.strip()
-        ).str.strip()
-        facts_df.loc[facts_df['organism_name'] == '', 'organism_name'] = facts_df[self.organism_col].astype(str)
-
-        id_vars = [col for col in facts_df.columns if col not in drug_columns]
-        melted_df = facts_df.melt(id_vars=id_vars, value_vars=drug_columns,
-                                  var_name='drug', value_name='sensitivity')
-        melted_df['sensitivity'] = melted_df['sensitivity'].map(self.normalize_sensitivity)
-        melted_df = melted_df[melted_df['sensitivity'] != '']
-
-        drug_lookup = self.drug_data[['abbr', 'group']].drop_duplicates().rename(
-            columns={'abbr': 'drug', 'group': 'drug_group'}
-        )
-        melted_df = melted_df.merge(drug_lookup, on='drug', how='inner')
-        melted_df['added_at'] = datetime.utcnow().isoformat(timespec='seconds')
-        return melted_df
+    def build_database_tables(self, df):
+        drug_lookup = self.drug_data[['abbr', 'group']].rename(columns={'abbr': 'drug'})
+        return build_tables(df, [col for col in self.drugs_col if col in df.columns], self.load_organism_lookup(),
+                            drug_lookup, self.build_database_profile())
 
     @staticmethod
     def build_database_metadata(profile_json, source_path):
@@ -766,7 +1173,7 @@ class MainFrame(wx.Frame):
             'profile_json': profile_json,
         }])
 
-    def export_database(self, event):
+    def export_database(self, event, action='replace'):
         if not self.require_configuration():
             return
 
@@ -777,13 +1184,17 @@ class MainFrame(wx.Frame):
                 dlg.ShowModal()
                 return
 
-        facts_df = self.build_database_facts(df)
-        if facts_df.empty:
+        tables = self.build_database_tables(df)
+        if tables is None or tables['results'].empty:
             with wx.MessageDialog(self, 'No database rows could be created from the configured drug columns.',
                                   'Save Database', style=wx.OK) as dlg:
                 dlg.ShowModal()
                 return
 
+        if action == 'append':
+            self.append_database(tables)
+            return
+
         with wx.FileDialog(self, "Please select the database file",
                            wildcard="SQLite file (*.sqlite;*.db)|*.sqlite;*.db",
                            style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as file_dialog:
@@ -793,81 +1204,83 @@ class MainFrame(wx.Frame):
             if os.path.splitext(file_path)[1] not in ('.sqlite', '.db'):
                 file_path = file_path + '.sqlite'
 
+        grain = None
+        if action == 'partition':
+            grains = list(PARTITION_FORMATS)
+            with wx.SingleChoiceDialog(self, 'Save one database per', 'Save Database by Period', grains) as dlg:
+                if dlg.ShowModal() != wx.ID_OK:
+                    return
+                grain = grains[dlg.GetSelection()]
+
         metadata_df = self.build_database_metadata(
             json.dumps(self.build_database_profile()),
             self.current_data_path,
         )
+        try:
+            if grain is not None:
+                # the file picked keeps the catalog of the partitions saved next to it
+                with sqlite3.connect(file_path) as con:
+                    written, total = write_partitions(con, file_path, tables, metadata_df, grain)
+                message = 'Database saved in {} partitions, {} of them changed.'.format(total, written)
+            else:
+                with sqlite3.connect(file_path) as con, bulk_load(con):
+                    write_tables(con, tables, metadata_df)
+                    create_indexes(con)
+                message = 'Database saved.'
+        except:
+            message = 'Failed to save database.'
+        with wx.MessageDialog(self, message, 'Save Database', style=wx.OK) as dlg:
+            dlg.ShowModal()
+
+    def append_database(self, tables):
+        with wx.FileDialog(self, "Please select the database to add the records to",
+                           wildcard="SQLite file (*.sqlite;*.db)|*.sqlite;*.db",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as file_dialog:
+            if file_dialog.ShowModal() == wx.ID_CANCEL:
+                return
+            file_path = file_dialog.GetPath()
+
+        self.upgrade_database(file_path)
         try:
             with sqlite3.connect(file_path) as con:
-                facts_df.to_sql('facts', con=con, if_exists='replace', index=False)
-                metadata_df.to_sql('metadata', con=con, if_exists='replace', index=False)
+                if is_catalog(con):
+                    raise ValueError('Records cannot be added to a database saved by period, '
+                                     'save it by period again instead.')
+                if schema_version(con) < DATABASE_SCHEMA_VERSION:
+                    raise ValueError('Records can only be added to upgraded databases.')
+                with bulk_load(con):
+                    added, skipped = append_tables(con, tables, self.build_database_profile(),
+                                                   self.current_data_path)
+        except ValueError as e:
+            message = str(e)
         except:
-            with wx.MessageDialog(self, 'Failed to save database.',
-                                  'Save Database', style=wx.OK) as dlg:
-                dlg.ShowModal()
+            message = 'Failed to save database.'
         else:
-            with wx.MessageDialog(self, 'Database saved.',
-                                  'Save Database', style=wx.OK) as dlg:
-                dlg.ShowModal()
+            message = '{} records added, {} were already in the database.'.format(added, skipped)
+        with wx.MessageDialog(self, message, 'Save Database', style=wx.OK) as dlg:
+            dlg.ShowModal()
 
-    def read_database(self, file_path):
-        with sqlite3.connect(file_path) as con:
-            facts_df = pd.read_sql_query('SELECT * FROM facts', con)
-            metadata_df = pd.read_sql_query('SELECT * FROM metadata', con)
-        if metadata_df.empty:
-            raise ValueError('metadata is empty')
-        profile = json.loads(metadata_df.iloc[-1]['profile_json'])
-        return facts_df, metadata_df, profile
-
-    def prepare_database_facts(self, facts_df, profile):
-        working_df = facts_df.copy()
-        date_col = profile.get('date_col', '')
-        if date_col and date_col in working_df.columns:
-            working_df[date_col] = pd.to_datetime(working_df[date_col], errors='coerce')
-        if 'organism_name' not in working_df.columns:
-            if 'GENUS' in working_df.columns and 'SPECIES' in working_df.columns:
-                working_df['organism_name'] = (
-                    working_df['GENUS'].fillna('').astype(str).str.strip()
-                    + ' ' +
-                    working_df['SPECIES'].fillna('').astype(str).str.strip()
-                ).str.strip()
-                organism_col = profile.get('organism_col', '')
-                if organism_col and organism_col in working_df.columns:
-                    working_df.loc[working_df['organism_name'] == '', 'organism_name'] = (
-                        working_df[organism_col].astype(str)
-                    )
-            else:
-                organism_col = profile.get('organism_col', '')
-                if organism_col and organism_col in working_df.columns:
-                    working_df['organism_name'] = working_df[organism_col].astype(str)
-        return working_df
-
-    def deduplicate_database_facts(self, facts_df, profile):
-        non_drug_columns = [
-            col for col in facts_df.columns
-            if col not in {'record_id', 'drug', 'drug_group', 'sensitivity', 'added_at'}
-        ]
-        with DeduplicateIndexDialog(self, non_drug_columns) as dlg:
-            if dlg.ShowModal() != wx.ID_OK:
-                return None
-            filtered_facts = facts_df
-            date_col = profile.get('date_col', '')
-            if dlg.isSortDate.GetValue() and date_col in filtered_facts.columns:
-                filtered_facts = filtered_facts.sort_values(date_col, ascending=True)
-            records_df = filtered_facts[non_drug_columns + ['record_id']].drop_duplicates('record_id')
-            if dlg.keys:
-                selected_keys = [non_drug_columns[k] for k in dlg.keys]
-                deduped_records = records_df.drop_duplicates(subset=selected_keys, keep='first')
-            else:
-                deduped_records = records_df
-            removed = len(records_df) - len(deduped_records)
-            with wx.MessageDialog(self,
-                                  'No duplicates found.' if removed == 0 else f'{removed} duplicates were removed.',
-                                  'Deduplication Finished', style=wx.OK) as msg_dlg:
-                msg_dlg.ShowModal()
-            return filtered_facts[filtered_facts['record_id'].isin(deduped_records['record_id'])]
+    def upgrade_database(self, file_path):
+        try:
+            with sqlite3.connect(file_path) as con:
+                if schema_version(con) >= DATABASE_SCHEMA_VERSION:
+                    return
+        except sqlite3.Error:
+            return
+        with wx.MessageDialog(self, 'This database was saved in an older format. Upgrade it now?\n'
+                                    'Upgraded databases are smaller and faster to query.',
+                              'Database', style=wx.YES_NO) as dlg:
+            if dlg.ShowModal() != wx.ID_YES:
+                return
+        try:
+            with sqlite3.connect(file_path) as con:
+                migrate_database(con)
+        except:
+            with wx.MessageDialog(self, 'Failed to upgrade database, it is used as it is.',
+                                  'Database', style=wx.OK) as dlg:
+                dlg.ShowModal()
 
-    def generate_from_database(self, event):
+    def connect_database(self, event):
         with wx.FileDialog(self, "Select a database",
                            wildcard="SQLite file (*.sqlite;*.db)|*.sqlite;*.db",
                            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as file_dialog:
@@ -875,58 +1288,164 @@ class MainFrame(wx.Frame):
                 return
             file_path = file_dialog.GetPath()
 
+        self.upgrade_database(file_path)
+        session = self.open_database(file_path)
         try:
-            facts_df, metadata_df, profile = self.read_database(file_path)
+            session.profile()
         except:
+            session.close()
             with wx.MessageDialog(self, 'Failed to read database.',
                                   'Database', style=wx.OK) as dlg:
                 dlg.ShowModal()
             return
+        self.disconnect_database(event)
+        self.db_session = session
+        self.statusbar.SetStatusText('Connected to {}.'.format(session.name))
+
+    def disconnect_database(self, event):
+        if self.db_session is not None:
+            self.db_session.close()
+            self.db_session = None
+            self.statusbar.SetStatusText('Database disconnected.')
+
+    def select_database(self):
+        # the connected database, or one picked for this action only
+        if self.db_session is not None:
+            if os.path.exists(self.db_session.file_path):
+                return self.db_session
+            self.disconnect_database(None)
+        with wx.FileDialog(self, "Select a database",
+                           wildcard="SQLite file (*.sqlite;*.db)|*.sqlite;*.db",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as file_dialog:
+            if file_dialog.ShowModal() == wx.ID_CANCEL:
+                return None
+            file_path = file_dialog.GetPath()
+
+        self.upgrade_database(file_path)
+        return self.open_database(file_path)
+
+    def open_database(self, file_path):
+        return DatabaseSession(file_path, limit=config.ReadInt('DatabaseCacheLimitMB', 128) * 1024 * 1024)
 
-        facts_df = self.prepare_database_facts(facts_df, profile)
-        facts_df = self.deduplicate_database_facts(facts_df, profile)
-        if facts_df is None:
+    def release_database(self, session):
+        # sessions picked for one action are not kept
+        if session is not self.db_session:
+            session.close()
+
+    def rebuild_database_indexes(self, event):
+        session = self.select_database()
+        if session is None:
+            return
+        self.release_database(session)
+        try:
+            summary_cols = None
+            with sqlite3.connect(session.file_path) as con:
+                if is_catalog(con):
+                    paths = partition_files(con, os.path.dirname(session.file_path))
+                    summary_cols = catalog_summary_columns(paths, read_profile(con))
+                elif schema_version(con) < DATABASE_SCHEMA_VERSION:
+                    paths = None
+                else:
+                    paths = [session.file_path]
+            if paths is None:
+                message = 'Indexes can only be built on upgraded databases.'
+            else:
+                count = 0
+                for path in paths:
+                    with sqlite3.connect(path) as con:
+                        build_summary(con, summary_cols)
+                        count += len(create_indexes(con))
+                message = '{} indexes and the monthly counts rebuilt.'.format(count)
+        except:
+            message = 'Failed to rebuild the indexes.'
+        with wx.MessageDialog(self, message, 'Database', style=wx.OK) as dlg:
+            dlg.ShowModal()
+
+    def generate_from_database(self, event):
+        session = self.select_database()
+        if session is None:
             return
+        started = False
+        try:
+            started = self._generate_from_database(session)
+        finally:
+            if not started:
+                self.release_database(session)
+
+    def _generate_from_database(self, session):
+        # True once the generator thread owns the session
+        try:
+            profile = session.profile()
+            expressions = session.expressions()
+            date_col = profile.get('date_col', '')
+            first_date, last_date = session.date_bounds(date_col)
+        except:
+            with wx.MessageDialog(self, 'Failed to read database.',
+                                  'Database', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return False
 
-        date_col = profile.get('date_col', '')
         identifier_col = profile.get('identifier_col', '')
-        if not identifier_col or identifier_col not in facts_df.columns:
+        if not identifier_col or identifier_col not in expressions:
             with wx.MessageDialog(self, 'Database metadata is missing the identifier column.',
                                   'Database', style=wx.OK) as dlg:
                 dlg.ShowModal()
-            return
+            return False
 
-        columns = [
-            col for col in facts_df.columns
-            if col not in {'record_id', 'drug', 'drug_group', 'sensitivity', 'added_at'}
-        ]
-        if identifier_col in columns:
-            columns.remove(identifier_col)
-        if date_col in columns:
-            columns.remove(date_col)
-
-        start = to_wx_date(facts_df[date_col].min()) if date_col in facts_df.columns else wx.DateTime.Now()
-        end = to_wx_date(facts_df[date_col].max()) if date_col in facts_df.columns else wx.DateTime.Now()
-        with BiogramIndexDialog(self, columns, start=start, end=end) as dlg:
+        non_drug_columns = record_columns(expressions)
+        with DeduplicateIndexDialog(self, non_drug_columns) as dlg:
+            if dlg.ShowModal() != wx.ID_OK:
+                return False
+            dedup = (tuple(non_drug_columns[k] for k in dlg.keys), dlg.isSortDate.GetValue(), dlg.window)
+        try:
+            records, kept, groups, largest = session.dedup_summary(dedup[0], date_col, dedup[2])
+        except sqlite3.Error:
+            with wx.MessageDialog(self, 'Failed to read database.',
+                                  'Database', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return False
+        with wx.MessageDialog(self, dedup_message(records - kept, groups, largest),
+                              'Deduplication Finished', style=wx.OK) as msg_dlg:
+            msg_dlg.ShowModal()
+
+        columns = [col for col in non_drug_columns if col not in (identifier_col, date_col)]
+        with BiogramIndexDialog(self, columns, start=to_wx_date(first_date), end=to_wx_date(last_date)) as dlg:
             if dlg.ShowModal() != wx.ID_OK or not dlg.indexes:
-                return
-            filtered_facts = facts_df
-            if date_col in filtered_facts.columns:
+                return False
+            if date_col in expressions:
                 start_date = pd.Timestamp(dlg.startDate.GetValue().FormatISODate()).date()
                 end_date = pd.Timestamp(dlg.endDate.GetValue().FormatISODate()).date()
-                filtered_facts = filtered_facts[
-                    (filtered_facts[date_col].dt.date >= start_date)
-                    & (filtered_facts[date_col].dt.date <= end_date)
-                ]
+            else:
+                start_date = end_date = None
+            indexes = [columns[idx] for idx in dlg.indexes]
+            key = result_key('database', session.refresh(), dedup, tuple(indexes), start_date, end_date,
+                             dlg.ncutoff.GetValue())
+            if self.show_cached_output(key, dlg.includeCount.GetValue(), dlg.includePercent.GetValue(),
+                                       dlg.includeNarstStyle.GetValue(), identifier_col):
+                return False
+            query = {
+                'date_col': date_col,
+                'start': start_date,
+                'end': end_date,
+                'dedup_keys': dedup[0],
+                'sort_by_date': dedup[1],
+                'episode_days': dedup[2],
+                'min_isolates': dlg.ncutoff.GetValue(),
+            }
             DatabaseBiogramGeneratorThread(
-                filtered_facts[[*columns, identifier_col, 'drug_group', 'drug', 'sensitivity']],
+                session,
+                query,
                 identifier_col,
-                [columns[idx] for idx in dlg.indexes],
+                indexes,
                 dlg.includeCount.GetValue(),
                 dlg.includePercent.GetValue(),
                 dlg.includeNarstStyle.GetValue(),
+                result_cache=self.result_cache,
+                result_key=key,
+                close_session=session is not self.db_session,
             )
-            PulseProgressBarDialog('Generating Antibiogram', f'Calculating from {os.path.basename(file_path)}...')
+            PulseProgressBarDialog('Generating Antibiogram', f'Calculating from {session.name}...')
+            return True
 
     def create_heatmap_dataframe(self, facts_df, row_field, organism_name, identifier_col, cutoff=0):
         filtered_df = facts_df[facts_df['organism_name'] == organism_name].copy()
@@ -940,8 +1459,9 @@ class MainFrame(wx.Frame):
             identifier_col: 'count',
             'is_s': 'sum',
         })
-        counts = grouped[identifier_col].unstack('drug')
-        sens = grouped['is_s'].unstack('drug')
+        return self.heatmap_percent(grouped[identifier_col].unstack('drug'), grouped['is_s'].unstack('drug'), cutoff)
+
+    def heatmap_percent(self, counts, sens, cutoff=0):
         if cutoff > 0:
             counts = counts.where(counts >= cutoff)
         return ((sens / counts) * 100).round(2)
@@ -998,58 +1518,65 @@ class MainFrame(wx.Frame):
                 dlg.ShowModal()
 
     def generate_heatmap_from_database(self, event):
-        with wx.FileDialog(self, "Select a database",
-                           wildcard="SQLite file (*.sqlite;*.db)|*.sqlite;*.db",
-                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as file_dialog:
-            if file_dialog.ShowModal() == wx.ID_CANCEL:
-                return
-            file_path = file_dialog.GetPath()
+        session = self.select_database()
+        if session is None:
+            return
+        try:
+            self._generate_heatmap_from_database(session)
+        finally:
+            self.release_database(session)
 
+    def _generate_heatmap_from_database(self, session):
         try:
-            facts_df, metadata_df, profile = self.read_database(file_path)
+            profile = session.profile()
+            expressions = session.expressions()
+            date_col = profile.get('date_col', '')
+            first_date, last_date = session.date_bounds(date_col)
+            specimens_col = profile.get('specimens_col', '')
+            specimens = session.distinct_values(specimens_col) if specimens_col in expressions else []
         except:
             with wx.MessageDialog(self, 'Failed to read database.',
                                   'Database', style=wx.OK) as dlg:
                 dlg.ShowModal()
             return
 
-        facts_df = self.prepare_database_facts(facts_df, profile)
         identifier_col = profile.get('identifier_col', '')
-        date_col = profile.get('date_col', '')
-        if not identifier_col or identifier_col not in facts_df.columns:
+        if not identifier_col or identifier_col not in expressions:
             with wx.MessageDialog(self, 'Database metadata is missing the identifier column.',
                                   'Database', style=wx.OK) as dlg:
                 dlg.ShowModal()
             return
 
         heatmap_fields = [
-            col for col in facts_df.columns
-            if col not in {'record_id', 'drug', 'drug_group', 'sensitivity', 'added_at',
-                           'organism_name', identifier_col, date_col}
+            col for col in expressions
+            if col not in FACT_COLUMNS + ['organism_name', identifier_col, date_col]
         ]
-        if not heatmap_fields:
+        if not heatmap_fields or 'organism_name' not in expressions:
             with wx.MessageDialog(self, 'No fields are available to build heatmap rows.',
                                   'Heatmap', style=wx.OK) as dlg:
                 dlg.ShowModal()
             return
 
-        start = to_wx_date(facts_df[date_col].min()) if date_col in facts_df.columns else wx.DateTime.Now()
-        end = to_wx_date(facts_df[date_col].max()) if date_col in facts_df.columns else wx.DateTime.Now()
-        with HeatmapConfigDialog(self, heatmap_fields, start=start, end=end) as dlg:
+        start = to_wx_date(first_date) if date_col in expressions else wx.DateTime.Now()
+        end = to_wx_date(last_date) if date_col in expressions else wx.DateTime.Now()
+        specimens = [str(value) for value in specimens if str(value).strip()]
+        with HeatmapConfigDialog(self, heatmap_fields, start=start, end=end, specimens=specimens) as dlg:
             if dlg.ShowModal() != wx.ID_OK or dlg.field_choice.GetSelection() == wx.NOT_FOUND:
                 return
             row_field = heatmap_fields[dlg.field_choice.GetSelection()]
             cutoff = dlg.ncutoff.GetValue()
-            filtered_facts = facts_df
-            if date_col in filtered_facts.columns:
-                start_date = pd.Timestamp(dlg.startDate.GetValue().FormatISODate()).date()
-                end_date = pd.Timestamp(dlg.endDate.GetValue().FormatISODate()).date()
-                filtered_facts = filtered_facts[
-                    (filtered_facts[date_col].dt.date >= start_date)
-                    & (filtered_facts[date_col].dt.date <= end_date)
-                ]
+            query = {'date_col': date_col, 'filters': {}}
+            if date_col in expressions:
+                query['start'] = pd.Timestamp(dlg.startDate.GetValue().FormatISODate()).date()
+                query['end'] = pd.Timestamp(dlg.endDate.GetValue().FormatISODate()).date()
+            if dlg.specimen is not None:
+                query['filters'][specimens_col] = dlg.specimen
 
-        organisms = sorted([name for name in filtered_facts['organism_name'].dropna().unique() if str(name).strip()])
+        try:
+            organisms = session.distinct_values('organism_name', **query)
+        except sqlite3.Error:
+            organisms = []
+        organisms = [name for name in organisms if str(name).strip()]
         if not organisms:
             with wx.MessageDialog(self, 'No organisms are available for heatmap generation.',
                                   'Heatmap', style=wx.OK) as dlg:
@@ -1061,7 +1588,29 @@ class MainFrame(wx.Frame):
                 return
             organism_name = org_dlg.GetStringSelection()
 
-        heatmap_df = self.create_heatmap_dataframe(filtered_facts, row_field, organism_name, identifier_col, cutoff)
+        # the monthly counts answer when they cover the window and the columns, otherwise
+        # only the rows of the chosen organism and the columns of the heatmap are read
+        query['filters']['organism_name'] = organism_name
+        columns = list(dict.fromkeys([row_field, 'drug', 'sensitivity', identifier_col, 'organism_name']))
+        try:
+            counts = session.heatmap_counts(row_field, **query)
+            if counts is None:
+                filtered_facts = session.facts(columns, **query)
+        except sqlite3.Error:
+            with wx.MessageDialog(self, 'Failed to read database.',
+                                  'Database', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+
+        if counts is None:
+            heatmap_df = self.create_heatmap_dataframe(filtered_facts, row_field, organism_name, identifier_col,
+                                                       cutoff)
+        elif counts.empty:
+            heatmap_df = pd.DataFrame()
+        else:
+            grouped = counts.set_index([row_field, 'drug'])
+            heatmap_df = self.heatmap_percent(grouped['tested'].unstack('drug'), grouped['sens'].unstack('drug'),
+                                              cutoff)
         if heatmap_df.empty:
             with wx.MessageDialog(self, 'No heatmap data could be generated for the selected organism and field.',
                                   'Heatmap', style=wx.OK) as dlg:
@@ -1069,28 +1618,34 @@ class MainFrame(wx.Frame):
             return
         self.plot_heatmap(heatmap_df, f'{organism_name} by {row_field}')
 
-    def setColumns(self):
+    def setColumns(self, df=None):
+        if df is None:
+            df = self.df
         columns = []
         self.colnames = []
-        for c in self.df.columns:
+        for c in df.columns:
             self.colnames.append(c)
-            col_type = str(self.df.dtypes.get(c))
+            col_type = str(df.dtypes.get(c))
             if col_type.startswith('int') or col_type.startswith('float'):
-                formatter = '%.1f'
+                formatter = format_number
             elif col_type.startswith('datetime'):
                 formatter = format_datetime
             else:
-                formatter = '%s'
-            columns.append(
-                ColumnDefn(title=c.title(), align='left', stringConverter=formatter, valueGetter=c, minimumWidth=50))
-        self.dataOlv.SetColumns(columns)
+                formatter = format_text
+            columns.append(formatter)
+        self.dataOlv.set_columns(self.colnames, columns)
+
+    def update_cell(self, position, column, value):
+        self.df = set_cell(self.df, position, column, value)
+        self.touch_data()
+        self.dataOlv.set_frame(self.df)
 
     def copy_column(self, event):
         with wx.SingleChoiceDialog(self, 'Select Source Column', 'Source Column', choices=self.colnames) as dlg:
             if dlg.ShowModal() == wx.ID_OK:
                 idx = dlg.GetSelection()
                 colname = self.colnames[idx]
-                data = set([getattr(row, colname) for row in self.data])
+                data = self.df[colname].unique()
                 with NewColumnDialog(self, data) as dlg:
                     if dlg.ShowModal() == wx.ID_OK:
                         new_data = dlg.replace()
@@ -1098,17 +1653,11 @@ class MainFrame(wx.Frame):
                         new_colname = dlg.colname_ctrl.GetValue()
                         for item in new_data:
                             lookup_dict[item['old']] = item['new']
-                        for d in self.data:
-                            old_value = getattr(d, colname)
-                            setattr(d, new_colname, lookup_dict.get(old_value))
-                        self.dataOlv.AddColumnDefn(ColumnDefn(
-                            title=new_colname,
-                            align='left',
-                            valueGetter=new_colname,
-                            minimumWidth=50,
-                        ))
+                        self.df[new_colname] = map_values(self.df[colname], lookup_dict)
+                        self.touch_data()
                         self.colnames.append(new_colname)
-                        self.dataOlv.RepopulateList()
+                        self.dataOlv.add_column(new_colname, format_text)
+                        self.dataOlv.set_frame(self.df)
 
     def configure(self, event):
         with ConfigDialog(self, self.colnames) as dlg:
@@ -1127,23 +1676,25 @@ class MainFrame(wx.Frame):
                 config.Write('OrganismCol', self.organism_col)
                 config.Write('SpecimensCol', self.specimens_col)
                 config.Write('Drugs', ';'.join(self.drugs_col))
+                if not self.df.empty:
+                    self.df = self.compact_data(self.df)
+                    self.touch_data()
+                    self.setColumns()
+                    self.dataOlv.set_frame(self.df)
 
     def melt(self, source_data=None):
         if source_data is None:
-            source_data = self.data
+            source_data = self.df
         keys = []
         for c in self.colnames:
             if c not in self.drugs_col:
                 keys.append(c)
-        data = [row.to_list(self.colnames) for row in source_data]
-        ids = [row.id for row in data]
-        df = pd.DataFrame(data=data, index=ids, columns=self.colnames)
-        return df.melt(id_vars=keys)
+        return source_data.melt(id_vars=keys, ignore_index=False)
 
     def generate(self, event):
         if not all([self.date_col, self.identifier_col, self.organism_col]):
             self.configure(None)
-        df = pd.DataFrame([d.to_dict(self.colnames) for d in self.data])
+        df = self.build_current_dataframe()
         if df.empty:
             with wx.MessageDialog(self, 'No data provided. Please load data from an Excel file',
                                   'Error', style=wx.OK) as dlg:
@@ -1153,39 +1704,30 @@ class MainFrame(wx.Frame):
         with DeduplicateIndexDialog(self, [c for c in self.colnames
                                            if c not in self.drugs_col]) as dlg:
             if dlg.ShowModal() == wx.ID_OK:
-                data = df
-                if dlg.isSortDate.GetValue():
-                    data = data.sort_values(config.Read('DateCol'), ascending=True)
-                if dlg.keys:
-                    data = data.drop_duplicates(subset=[self.colnames[k] for k in dlg.keys],
-                                                keep='first')
-                if num_rows == len(data):
-                    message = 'No duplicates found.'
-                else:
-                    message = f'{ num_rows - len(data) } duplicates were removed.'
+                dedup = (tuple(self.colnames[k] for k in dlg.keys), dlg.isSortDate.GetValue(), dlg.window)
+                keep, stats = find_duplicates(df, dedup[0], self.date_col if dedup[1] or dedup[2] else None,
+                                              dedup[2])
+                data = df[keep]
+                message = dedup_message(num_rows - len(data), len(stats),
+                                        stats['records'].max() if len(stats) else 0)
                 with wx.MessageDialog(self, message, 'Deduplication Finished', style=wx.OK) as dlg:
                     dlg.ShowModal()
             else:
                 return
-        keys = []
-        for c in self.colnames:
-            if c not in self.drugs_col:
-                keys.append(c)
-        columns = [c for c in self.colnames if c not in self.drugs_col] + ['GENUS', 'SPECIES', 'GRAM']
-        if self.identifier_col in columns:
-            columns.remove(self.identifier_col)
-        if self.date_col in columns:
-            columns.remove(self.date_col)
-
+        keys, columns = self.biogram_columns()
         with BiogramIndexDialog(self, columns,
                                 start=to_wx_date(data[self.date_col].min()),
                                 end=to_wx_date(data[self.date_col].max())) as dlg:
             if dlg.ShowModal() == wx.ID_OK and dlg.indexes:
-                # filter data within the date range
+                # the thread filters the data within the date range
                 start_date = pd.Timestamp(dlg.startDate.GetValue().FormatISODate()).date()
                 end_date = pd.Timestamp(dlg.endDate.GetValue().FormatISODate()).date()
-                data = data[(data[self.date_col].dt.date >= start_date)
-                            & (data[self.date_col].dt.date <= end_date)]
+                min_isolates = dlg.ncutoff.GetValue()
+                key = self.biogram_result_key(dedup, [columns[idx] for idx in dlg.indexes], start_date, end_date,
+                                              min_isolates)
+                if self.show_cached_output(key, dlg.includeCount.GetValue(), dlg.includePercent.GetValue(),
+                                           dlg.includeNarstStyle.GetValue(), self.identifier_col):
+                    return
                 BiogramGeneratorThread(data,
                                        self.date_col,
                                        self.identifier_col,
@@ -1196,7 +1738,16 @@ class MainFrame(wx.Frame):
                                        dlg.includePercent.GetValue(),
                                        dlg.includeNarstStyle.GetValue(),
                                        columns,
-                                       self.drug_data)
+                                       self.drug_data,
+                                       start_date=start_date,
+                                       end_date=end_date,
+                                       cube_cache=self.cube_cache,
+                                       cube_key=dedup,
+                                       result_cache=self.result_cache,
+                                       result_key=key,
+                                       executor=self.biogram_pool(len(data)),
+                                       partitions=self.biogram_workers,
+                                       min_isolates=min_isolates)
                 progress_bar = PulseProgressBarDialog('Generating Antibiogram', 'Calculating...')
             else:
                 return
@@ -1212,17 +1763,8 @@ class MainFrame(wx.Frame):
             if os.path.splitext(file_path)[1] != '.xlsx':
                 file_path = file_path + '.xlsx'
         try:
-            with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
-                if sens is not None:
-                    sens[identifier_col].to_excel(writer, sheet_name='count_S')
-                if resists is not None:
-                    resists[identifier_col].to_excel(writer, sheet_name='count_R')
-                if biogram_sens is not None:
-                    biogram_sens[identifier_col].to_excel(writer, sheet_name='percent_S')
-                if biogram_resists is not None:
-                    biogram_resists[identifier_col].to_excel(writer, sheet_name='percent_R')
-                if biogram_narst_s is not None:
-                    biogram_narst_s[identifier_col].to_excel(writer, sheet_name='narst_s')
+            write_workbook(file_path, identifier_col, sens=sens, resists=resists, biogram_sens=biogram_sens,
+                           biogram_resists=biogram_resists, biogram_narst_s=biogram_narst_s)
         except:
             with wx.MessageDialog(self, 'Failed', 'Antibiogram Generator', style=wx.OK) as dlg:
                 dlg.ShowModal()
@@ -1230,6 +1772,60 @@ class MainFrame(wx.Frame):
             with wx.MessageDialog(self, 'Output Saved.', 'Antibiogram Generator', style=wx.OK) as dlg:
                 dlg.ShowModal()
 
+    def run_report_batch(self, event):
+        if not self.require_configuration():
+            return
+        df = self.build_current_dataframe()
+        if df.empty:
+            with wx.MessageDialog(self, 'No data provided. Please load data from an Excel file',
+                                  'Report Batch', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+        with wx.FileDialog(self, "Select a report file",
+                           wildcard="Report file (*.json)|*.json",
+                           style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST) as file_dialog:
+            if file_dialog.ShowModal() == wx.ID_CANCEL:
+                return
+            file_path = file_dialog.GetPath()
+        keys, columns = self.biogram_columns()
+        try:
+            reports = load_report_spec(file_path)
+        except (OSError, ValueError) as e:
+            problems = [str(e)]
+        else:
+            problems = check_reports(reports, columns, keys)
+        if problems:
+            with wx.MessageDialog(self, 'The report file cannot be used:\n' + '\n'.join(problems),
+                                  'Report Batch', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+        try:
+            for report in reports:
+                os.makedirs(os.path.dirname(report['output']), exist_ok=True)
+        except OSError:
+            with wx.MessageDialog(self, 'Cannot create the output folder.', 'Report Batch', style=wx.OK) as dlg:
+                dlg.ShowModal()
+            return
+        for report in reports:
+            report['key'] = self.biogram_result_key(report_dedup(report), report['indexes'], report['start'],
+                                                    report['end'], report['min_isolates'])
+        ReportBatchThread(df, reports, self.date_col, self.identifier_col, self.organism_col, keys, columns,
+                          self.drug_data, cube_cache=self.cube_cache, result_cache=self.result_cache,
+                          executor=self.biogram_pool(len(df)), partitions=self.biogram_workers)
+        PulseProgressBarDialog('Report Batch', 'Generating {} antibiograms...'.format(len(reports)))
+
+    def update_report_progress(self, done, total):
+        self.statusbar.SetStatusText('{} of {} reports done.'.format(done, total))
+
+    def show_report_summary(self, written, failed):
+        message = '{} reports written.'.format(len(written))
+        if written:
+            message += '\nOutput folder: {}'.format(os.path.dirname(written[0]))
+        if failed:
+            message += '\nFailed: {}'.format(', '.join(failed))
+        with wx.MessageDialog(self, message, 'Report Batch', style=wx.OK) as dlg:
+            dlg.ShowModal()
+
 
 
 class GenApp(wx.App):
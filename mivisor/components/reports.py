@@ -0,0 +1,218 @@
+import os
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+OUTPUT_OPTIONS = ['include_count', 'include_percent', 'include_narst']
+SHEETS = [('sens', 'count_S'), ('resists', 'count_R'), ('biogram_sens', 'percent_S'),
+          ('biogram_resists', 'percent_R'), ('biogram_narst_s', 'narst_s')]
+
+# A report file for data with the columns of EXAMPLE_COLUMNS, ORGANISM being the
+# configured organism column. Every report takes the defaults it does not override and
+# paths are relative to the report file. "indexes" may use the organism fields looked up
+# for the organism column, "dedup_keys" only columns of the data since duplicates are
+# removed before the lookup. With "episode_days" the first isolate of every key is kept
+# per episode of that many days.
+EXAMPLE_REPORT = '''{
+  "output_dir": "2021Q1",
+  "defaults": {"dedup_keys": ["HN", "ORGANISM"], "episode_days": 30,
+               "start": "2021-01-01", "end": "2021-03-31"},
+  "reports": [
+    {"name": "ward", "indexes": ["WARD", "GENUS", "SPECIES"], "min_isolates": 30},
+    {"name": "gram-2020", "indexes": ["GRAM"], "start": "2020-01-01", "end": "2020-12-31",
+     "include_narst": false}
+  ]
+}'''
+EXAMPLE_COLUMNS = ['HN', 'DATE', 'ORGANISM', 'SPECIMEN', 'WARD']
+
+
+def _parse_date(value, name, field):
+    if value is None or value == '':
+        return None
+    try:
+        return pd.Timestamp(value).date()
+    except (TypeError, ValueError):
+        raise ValueError('{}: "{}" is not a valid {} date.'.format(name, value, field))
+
+
+def load_report_spec(filepath):
+    with open(filepath) as fp:
+        spec = json.load(fp)
+    return parse_report_spec(spec, os.path.dirname(os.path.abspath(filepath)))
+
+
+def parse_report_spec(spec, base_dir):
+    if not isinstance(spec, dict):
+        raise ValueError('The report file must contain a JSON object.')
+    defaults = spec.get('defaults', {})
+    output_dir = os.path.join(base_dir, spec.get('output_dir', ''))
+    reports = []
+    for number, entry in enumerate(spec.get('reports', []), start=1):
+        entry = dict(defaults, **entry)
+        name = str(entry.get('name') or 'report{}'.format(number))
+        indexes = entry.get('indexes')
+        if not indexes or not isinstance(indexes, list):
+            raise ValueError('{}: "indexes" must list at least one column.'.format(name))
+        output = entry.get('output') or name + '.xlsx'
+        if os.path.splitext(output)[1] != '.xlsx':
+            output = output + '.xlsx'
+        report = {
+            'name': name,
+            'indexes': [str(index) for index in indexes],
+            'start': _parse_date(entry.get('start'), name, 'start'),
+            'end': _parse_date(entry.get('end'), name, 'end'),
+            'dedup_keys': [str(key) for key in entry.get('dedup_keys', [])],
+            'sort_by_date': bool(entry.get('sort_by_date', True)),
+            'output': os.path.join(output_dir, output),
+        }
+        for option in OUTPUT_OPTIONS:
+            report[option] = bool(entry.get(option, True))
+        for option in ['min_isolates', 'episode_days']:
+            try:
+                report[option] = max(int(entry.get(option, 0)), 0)
+            except (TypeError, ValueError):
+                raise ValueError('{}: "{}" must be a whole number.'.format(name, option))
+        reports.append(report)
+    if not reports:
+        raise ValueError('The report file does not list any reports.')
+    return reports
+
+
+def check_reports(reports, index_columns, dedup_columns):
+    problems = []
+    outputs = set()
+    for report in reports:
+        missing = [c for c in report['indexes'] if c not in index_columns]
+        missing += [c for c in report['dedup_keys'] if c not in dedup_columns]
+        if missing:
+            problems.append('{}: unknown columns {}'.format(report['name'], ', '.join(missing)))
+        if report['output'] in outputs:
+            problems.append('{}: {} is written by another report'.format(report['name'], report['output']))
+        outputs.add(report['output'])
+    return problems
+
+
+def report_dedup(report):
+    return tuple(report['dedup_keys']), report['sort_by_date'], report['episode_days']
+
+
+def group_by_dedup(reports):
+    # reports sharing their deduplication also share the deduplicated data and its cube
+    groups = OrderedDict()
+    for report in reports:
+        groups.setdefault(report_dedup(report), []).append(report)
+    return groups
+
+
+def _levels(index):
+    if isinstance(index, pd.MultiIndex):
+        return [index.get_level_values(number).to_numpy(dtype=object) for number in range(index.nlevels)]
+    return [index.to_numpy(dtype=object)]
+
+
+def level_spans(index):
+    # the cells to_excel merges for every level: a run of equal labels inside the
+    # run of the level above, the last level is never merged. Like pandas, an empty
+    # label continues the run it follows.
+    control = np.ones(len(index), dtype=bool)
+    new_run = np.zeros(len(index), dtype=bool)
+    levels = _levels(index)
+    spans = []
+    for number, values in enumerate(levels):
+        missing = pd.isna(values)
+        same = np.r_[False, (values[1:] == values[:-1]) | (missing[1:] & missing[:-1])]
+        new_run |= ~same
+        sentinel = (values == '') if number == len(levels) - 1 else ~new_run | (values == '')
+        control &= sentinel
+        starts = np.flatnonzero(~control)
+        if len(values) and (not len(starts) or starts[0] != 0):
+            starts = np.r_[0, starts]
+        spans.append((values, starts, np.diff(np.r_[starts, len(values)])))
+    return spans
+
+
+def _cell_value(value):
+    if pd.isna(value):
+        return ''
+    if isinstance(value, (bool, np.bool_, int, float, np.integer, np.floating)):
+        return value.item() if isinstance(value, np.generic) else value
+    return str(value)
+
+
+def _write_label(worksheet, row, col, value, last_row=None, last_col=None):
+    value = _cell_value(value)
+    if last_row is not None and (last_row, last_col) != (row, col):
+        worksheet.merge_range(row, col, last_row, last_col, value, None)
+    elif value != '':
+        worksheet.write(row, col, value)
+
+
+def _write_body(worksheet, frame, first_row, first_col):
+    for number in range(frame.shape[1]):
+        values = frame.iloc[:, number].to_numpy()
+        col = first_col + number
+        if values.dtype.kind in 'iuf':
+            present = ~np.isnan(values) if values.dtype.kind == 'f' else np.ones(len(values), dtype=bool)
+            for position in np.flatnonzero(present):
+                value = values[position]
+                if np.isinf(value):
+                    worksheet.write_string(first_row + position, col, 'inf' if value > 0 else '-inf')
+                else:
+                    worksheet.write_number(first_row + position, col, value)
+        else:
+            for position, value in enumerate(values):
+                value = _cell_value(value)
+                if value != '':
+                    worksheet.write(first_row + position, col, value)
+
+
+def _plain_layout(frame):
+    # anything else, like dates in the index, is left to to_excel
+    if frame.empty or not isinstance(frame.columns, pd.MultiIndex) or frame.columns.to_frame().isna().any().any():
+        return False
+    index = frame.index.to_frame()
+    return not any(pd.api.types.is_datetime64_any_dtype(dtype) or pd.api.types.is_timedelta64_dtype(dtype)
+                   for dtype in index.dtypes)
+
+
+def write_sheet(writer, frame, sheet_name):
+    # the cells DataFrame.to_excel writes for a frame with (group, drug) columns,
+    # without building a styled cell object for every count
+    if not _plain_layout(frame):
+        frame.to_excel(writer, sheet_name=sheet_name)
+        return
+    worksheet = writer.book.add_worksheet(sheet_name)
+    index_levels = frame.index.nlevels
+    header_col = index_levels - 1
+    for number, name in enumerate(frame.columns.names):
+        _write_label(worksheet, number, header_col, name)
+    for number, (values, starts, lengths) in enumerate(level_spans(frame.columns)):
+        for start, length in zip(starts, lengths):
+            _write_label(worksheet, number, header_col + start + 1, values[start],
+                         number, header_col + start + length)
+    first_row = frame.columns.nlevels + 1
+    if isinstance(frame.index, pd.MultiIndex):
+        if any(name is not None for name in frame.index.names):
+            for number, name in enumerate(frame.index.names):
+                _write_label(worksheet, first_row - 1, number, name)
+        for number, (values, starts, lengths) in enumerate(level_spans(frame.index)):
+            for start, length in zip(starts, lengths):
+                _write_label(worksheet, first_row + start, number, values[start],
+                             first_row + start + length - 1, number)
+    else:
+        if frame.index.name:
+            _write_label(worksheet, first_row - 1, 0, frame.index.name)
+        for position, value in enumerate(frame.index.to_numpy(dtype=object)):
+            _write_label(worksheet, first_row + position, 0, value)
+    _write_body(worksheet, frame, first_row, index_levels)
+
+
+def write_workbook(file_path, identifier_col, **frames):
+    with pd.ExcelWriter(file_path, engine='xlsxwriter') as writer:
+        for key, sheet_name in SHEETS:
+            if frames.get(key) is not None:
+                write_sheet(writer, frames[key][identifier_col], sheet_name)
+
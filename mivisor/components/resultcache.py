@@ -0,0 +1,159 @@
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+RESULT_CACHE_DIR = os.path.join('appdata', 'cache', 'results')
+DEFAULT_RESULT_CACHE_LIMIT = 128 * 1024 * 1024
+DEFAULT_RESULT_DISK_LIMIT = 256 * 1024 * 1024
+RESULT_CACHE_VERSION = 1
+
+
+def frame_fingerprint(df):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr([(str(c), str(t)) for c, t in df.dtypes.items()]).encode('utf-8'))
+    if len(df):
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def file_stamp(filepath):
+    # cheap stand-in for a content hash, good enough for files the app writes itself
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns
+
+
+def result_key(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((RESULT_CACHE_VERSION,) + parts).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def outputs_nbytes(outputs):
+    return sum(int(frame.memory_usage(deep=True).sum()) for frame in outputs if frame is not None)
+
+
+class ResultCache(object):
+    def __init__(self, limit=DEFAULT_RESULT_CACHE_LIMIT, cache_dir=None, disk_limit=DEFAULT_RESULT_DISK_LIMIT):
+        self.limit = limit
+        self.cache_dir = cache_dir
+        self.disk_limit = disk_limit
+        self._entries = OrderedDict()
+        self._size = 0
+        # results are stored from the generator threads and read from the UI thread
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+        outputs = self._read(key)
+        if outputs is not None:
+            self._remember(key, outputs)
+        return outputs
+
+    def put(self, key, outputs):
+        self._remember(key, outputs)
+        self._write(key, outputs)
+
+    def _remember(self, key, outputs):
+        nbytes = outputs_nbytes(outputs)
+        if nbytes > self.limit:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (outputs, nbytes)
+            self._size += nbytes
+            while self._size > self.limit:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= evicted
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _read(self, key):
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as fp:
+                version, outputs = pickle.load(fp)
+        except (OSError, EOFError, ValueError, AttributeError, ImportError, pickle.UnpicklingError):
+            self._remove(path)
+            return None
+        if version != RESULT_CACHE_VERSION:
+            self._remove(path)
+            return None
+        # the file's mtime doubles as the last access time used for eviction
+        os.utime(path)
+        return outputs
+
+    def _write(self, key, outputs):
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as fp:
+                pickle.dump((RESULT_CACHE_VERSION, outputs), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError):
+            self._remove(tmp_path)
+            return
+        self.evict(keep=path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _files(self):
+        if self.cache_dir is None or not os.path.isdir(self.cache_dir):
+            return []
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.pkl') and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def size(self):
+        return self._size + sum(nbytes for _, nbytes, _ in self._files())
+
+    def evict(self, keep=None):
+        files = sorted(self._files())
+        total = sum(nbytes for _, nbytes, _ in files)
+        for _, nbytes, path in files:
+            if total <= self.disk_limit:
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total -= nbytes
+
+    def clear(self):
+        with self._lock:
+            removed = self._size
+            self._entries.clear()
+            self._size = 0
+        for _, nbytes, path in self._files():
+            self._remove(path)
+            removed += nbytes
+        return removed
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from components.biogram import AggregationCube, biogram_counts, filter_date_range
+
+
+DRUG_PAIRS = [('Penicillins', 'AMP'), ('Aminoglycosides', 'GEN')]
+
+
+@pytest.fixture
+def data():
+    # undated rows in both wards, so a window leaking past the last day of ward A
+    # would pick up the undated rows of ward B
+    return pd.DataFrame({
+        'WARD': ['A', 'A', 'A', 'B', 'B', 'B', 'B'],
+        'DATE': pd.to_datetime(['2021-01-05', '2021-01-20', None, None, None, '2021-01-10', '2021-01-20']),
+        'AMP': ['S', 'R', 'S', 'R', 'R', 'S', 'I'],
+        'GEN': ['S', 'S', None, 'R', 'S', None, 'R'],
+    })
+
+
+@pytest.mark.parametrize('start, end', [
+    (None, None),
+    ('2020-12-01', '2020-12-31'),
+    ('2020-12-01', '2021-01-10'),
+    ('2021-01-06', '2021-01-19'),
+    ('2021-01-10', '2021-01-20'),
+    ('2021-01-15', '2021-02-28'),
+    ('2021-01-21', '2021-02-28'),
+    (None, '2021-01-10'),
+    ('2021-01-10', None),
+    ('2021-02-01', None),
+])
+def test_cube_window_matches_filtered_counts(data, start, end):
+    cube = AggregationCube.build(data, ['WARD'], DRUG_PAIRS, 'DATE')
+    expected_data = data if start is None and end is None else filter_date_range(data, 'DATE', start, end)
+    expected = biogram_counts(expected_data, ['WARD'], DRUG_PAIRS)
+    for got, want in zip(cube.rollup(['WARD'], start, end), expected):
+        pd.testing.assert_frame_equal(got, want, check_dtype=False)
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from components.biogram import biogram_counts, filter_date_range
+from components.database import (DATABASE_SCHEMA_VERSION, antibiogram_counts, append_tables, build_tables, bulk_load,
+                                column_expressions, write_tables)
+
+
+PROFILE = {'identifier_col': 'HN', 'date_col': 'DATE', 'organism_col': 'ORGANISM', 'specimens_col': 'SPECIMEN'}
+ORGANISMS = pd.DataFrame({'ORGANISM': ['eco', 'kpn'], 'GENUS': ['Escherichia', 'Klebsiella'],
+                          'SPECIES': ['coli', 'pneumoniae'], 'GRAM': ['negative', 'negative']})
+DRUGS = pd.DataFrame({'drug': ['AMP', 'GEN'], 'group': ['Penicillins', 'Aminoglycosides']})
+
+
+def records(start, stop):
+    ids = np.arange(start, stop)
+    return pd.DataFrame({
+        'HN': ids + 1000,
+        'DATE': pd.Timestamp('2021-01-01') + pd.to_timedelta(ids % 60, unit='D'),
+        'ORGANISM': np.where(ids % 2, 'eco', 'kpn'),
+        'SPECIMEN': np.where(ids % 3, 'urine', 'blood'),
+        'AMP': np.where(ids % 4, 'S', 'R'),
+        'GEN': np.where(ids % 5, 'S', 'I'),
+    })
+
+
+def unchanged(df):
+    return df
+
+
+def as_float(df):
+    # a blank identifier in the export makes pandas read the column as float
+    blank = records(-1, 0).assign(HN=np.nan)
+    return pd.concat([df.assign(HN=df['HN'].astype(float)), blank], ignore_index=True)
+
+
+def as_padded_text(df):
+    return df.assign(HN=' ' + df['HN'].astype(str) + ' ', SPECIMEN=df['SPECIMEN'] + ' ')
+
+
+def tables_of(df):
+    return build_tables(df, ['AMP', 'GEN'], ORGANISMS, DRUGS, PROFILE)
+
+
+def save(path, df):
+    metadata = pd.DataFrame([{'schema_version': DATABASE_SCHEMA_VERSION, 'created_at': '2021-01-01T00:00:00',
+                              'source_path': '', 'profile_json': json.dumps(PROFILE)}])
+    with sqlite3.connect(path) as con, bulk_load(con):
+        write_tables(con, tables_of(df), metadata)
+
+
+@pytest.mark.parametrize('first, second', [
+    (unchanged, as_float),
+    (as_float, unchanged),
+    (unchanged, as_padded_text),
+    (as_padded_text, as_float),
+])
+def test_overlapping_appends_add_only_new_records(tmp_path, first, second):
+    path = str(tmp_path / 'isolates.db')
+    save(path, first(records(0, 300)))
+    overlap = second(records(200, 500))
+    with sqlite3.connect(path) as con, bulk_load(con):
+        added, skipped = append_tables(con, tables_of(overlap), PROFILE)
+    assert added == len(overlap) - 100
+    assert skipped == 100
+    with sqlite3.connect(path) as con, bulk_load(con):
+        assert append_tables(con, tables_of(overlap), PROFILE) == (0, len(overlap))
+
+
+def fully_tested():
+    # groups of every size around the cutoffs, unlabelled ones included, and every
+    # isolate tested for every drug so that a group's isolates are its tested results
+    df = records(0, 240)
+    sizes = {'blood': 2, 'urine': 18, 'sputum': 20, 'pus': 22, None: 58, 'swab': 120}
+    return df.assign(SPECIMEN=np.repeat(list(sizes), list(sizes.values())))
+
+
+@pytest.mark.parametrize('min_isolates', [0, 5, 10, 11, 30])
+@pytest.mark.parametrize('start, end', [(None, None), ('2021-01-10', '2021-02-20')])
+def test_database_cutoff_matches_in_memory(tmp_path, min_isolates, start, end):
+    # the whole history is answered from the monthly counts, a window inside the months from the records
+    indexes = ['SPECIMEN', 'ORGANISM']
+    df = fully_tested()
+    path = str(tmp_path / 'isolates.db')
+    save(path, df)
+    with sqlite3.connect(path) as con:
+        counts = antibiogram_counts(con, column_expressions(con, PROFILE), indexes, 'DATE', start, end,
+                                    min_isolates=min_isolates)
+    grouped = counts.set_index(indexes + ['group', 'variable']).sort_index()
+    expected = biogram_counts(filter_date_range(df, 'DATE', start, end), indexes,
+                              list(zip(DRUGS['group'], DRUGS['drug'])), min_isolates=min_isolates)
+    for name, frame in zip(['total', 'sens', 'resists'], expected):
+        result = grouped[name].unstack(['group', 'variable'])
+        pd.testing.assert_frame_equal(result, frame, check_dtype=False)
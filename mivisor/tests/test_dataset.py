@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+
+from components.biogram import biogram_counts
+from components.database import build_tables
+from components.dataset import SIR_CATEGORIES, compact_frame, encode_sir, set_cell
+
+
+def test_biograms_count_exact_results_only():
+    # ' s' and 'r ' were never S or R for the in-memory biogram, compacting keeps them apart
+    data = pd.DataFrame({'WARD': ['A'] * 5, 'AMP': ['S', ' s', 'r ', 'R', 'I']})
+    for frame in (data, compact_frame(data, drug_cols=['AMP'])):
+        total, sens, resists = biogram_counts(frame, ['WARD'], [('Penicillins', 'AMP')])
+        assert (total.iloc[0, 0], sens.iloc[0, 0], resists.iloc[0, 0]) == (5, 1, 2)
+
+
+def test_compacted_results_keep_their_text():
+    encoded = encode_sir(pd.Series(['S', ' s', 'r ', None, 'MIC']))
+    assert list(encoded.cat.categories) == SIR_CATEGORIES + [' s', 'MIC', 'r ']
+    assert encoded.tolist()[:3] == ['S', ' s', 'r ']
+    edited = set_cell(pd.DataFrame({'AMP': encoded}), 0, 'AMP', 'r')
+    assert edited['AMP'].tolist()[0] == 'r'
+
+
+def test_database_saves_normalize_results():
+    data = pd.DataFrame({'HN': [1, 2, 3, 4], 'ORGANISM': ['eco'] * 4, 'AMP': ['S', ' s', 'r ', np.nan]})
+    lookup = pd.DataFrame({'ORGANISM': ['eco'], 'GENUS': ['Escherichia'], 'SPECIES': ['coli'], 'GRAM': ['negative']})
+    drugs = pd.DataFrame({'drug': ['AMP'], 'group': ['Penicillins']})
+    profile = {'identifier_col': 'HN', 'organism_col': 'ORGANISM'}
+    for frame in (data, compact_frame(data, drug_cols=['AMP'])):
+        tables = build_tables(frame, ['AMP'], lookup, drugs, profile)
+        labels = tables['sensitivities'].set_index('sensitivity_id')['sensitivity']
+        assert labels.reindex(tables['results']['sensitivity_id']).tolist() == ['S', 'S', 'R']
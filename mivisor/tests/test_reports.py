@@ -0,0 +1,64 @@
+import json
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from components.biogram import ORGANISM_FIELDS
+from components.reports import (EXAMPLE_COLUMNS, EXAMPLE_REPORT, check_reports, parse_report_spec,
+                                write_sheet)
+
+
+COLUMNS = pd.MultiIndex.from_tuples([('G1', 'AMP'), ('G1', 'GEN'), ('G2', 'AMP'), ('G3', 'CRO'), ('G3', 'GEN')],
+                                    names=['group', 'drug'])
+INDEXES = {
+    'three levels': pd.MultiIndex.from_tuples(
+        [('A', 'x', '1'), ('A', 'x', '2'), ('A', 'y', '1'), ('B', 'y', '1'), ('B', '', '1'),
+         ('B', '', '2'), ('C', 'z', ''), ('C', 'z', '3'), ('', 'z', '3')],
+        names=['WARD', 'GENUS', 'SPECIES']),
+    'missing labels': pd.MultiIndex.from_arrays([['a', 'a', np.nan, np.nan, 'b'], ['p', 'q', 'p', 'p', 'q']],
+                                                names=['X', 'Y']),
+    'single level': pd.Index(['neg', 'pos', ''], name='GRAM'),
+    'unnamed': pd.Index(['a', 'b']),
+}
+
+
+def test_example_report_is_valid():
+    # the identifier HN and the date DATE are left out of the indexes like MainFrame.biogram_columns does
+    reports = parse_report_spec(json.loads(EXAMPLE_REPORT), '')
+    index_columns = [c for c in EXAMPLE_COLUMNS if c not in ('HN', 'DATE')] + ORGANISM_FIELDS
+    assert [report['name'] for report in reports] == ['ward', 'gram-2020']
+    assert check_reports(reports, index_columns, EXAMPLE_COLUMNS) == []
+
+
+def _frame(index, kind):
+    rng = np.random.default_rng(1)
+    data = rng.integers(0, 200, (len(index), len(COLUMNS))).astype(float)
+    data[rng.random(data.shape) < 0.2] = np.nan
+    frame = pd.DataFrame(data, index=index, columns=COLUMNS)
+    if kind == 'int':
+        frame = frame.fillna(0).astype('int64')
+    elif kind == 'text':
+        frame = frame.map(lambda v: '' if pd.isna(v) else '%.1f (%d)' % (v, v))
+    elif kind == 'inf':
+        frame.iloc[0, 0] = np.inf
+        frame.iloc[1, 1] = -np.inf
+    return frame
+
+
+def _cells(path):
+    worksheet = openpyxl.load_workbook(path).active
+    cells = {(c.row, c.column): c.value for row in worksheet.iter_rows() for c in row if c.value is not None}
+    return cells, sorted(str(cell_range) for cell_range in worksheet.merged_cells.ranges)
+
+
+@pytest.mark.parametrize('kind', ['float', 'int', 'text', 'inf'])
+@pytest.mark.parametrize('index', list(INDEXES), ids=list(INDEXES))
+def test_write_sheet_matches_to_excel(tmp_path, index, kind):
+    frame = _frame(INDEXES[index], kind)
+    with pd.ExcelWriter(tmp_path / 'expected.xlsx', engine='xlsxwriter') as writer:
+        frame.to_excel(writer, sheet_name='count_S')
+    with pd.ExcelWriter(tmp_path / 'written.xlsx', engine='xlsxwriter') as writer:
+        write_sheet(writer, frame, 'count_S')
+    assert _cells(tmp_path / 'written.xlsx') == _cells(tmp_path / 'expected.xlsx')